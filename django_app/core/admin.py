@@ -0,0 +1,10 @@
+from django.contrib import admin
+from . import models
+
+
+class OutgoingEmailAdmin(admin.ModelAdmin):
+    list_display = ['subject', 'to', 'status', 'attempts', 'created_at', 'sent_at']
+    list_filter = ('status',)
+    search_fields = ('subject',)
+
+admin.site.register(models.OutgoingEmail, OutgoingEmailAdmin)
@@ -0,0 +1,199 @@
+from collections import OrderedDict
+import pickle
+import threading
+import time
+import uuid
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+
+def generation_key(key):
+    """Clé du cache partagé qui accompagne chaque clé : sa valeur change à chaque écriture"""
+    return f"tiered_generation:{key}"
+
+
+class TieredCache(BaseCache):
+    """
+    Cache à deux niveaux : un LRU en mémoire du process (taille et durée de vie
+    bornées) devant un cache partagé entre workers (un autre alias de CACHES,
+    par exemple un FileBasedCache).
+
+    Chaque clé du cache partagé est accompagnée d'une génération (generation_key),
+    remplacée à chaque écriture de la clé (set, add, delete...). Une entrée locale
+    est servie sans accès au cache partagé pendant VERSION_CHECK_INTERVAL secondes,
+    puis sa génération est relue : un worker ne garde donc pas une valeur modifiée
+    par un autre plus de VERSION_CHECK_INTERVAL secondes, et une écriture
+    n'invalide que la clé concernée.
+
+    OPTIONS :
+    - SHARED_ALIAS : alias du cache partagé (défaut 'shared')
+    - LOCAL_MAX_ENTRIES : nombre d'entrées du cache local (défaut 1000)
+    - LOCAL_TIMEOUT : durée de vie maximale d'une entrée locale (défaut 60 s)
+    - VERSION_CHECK_INTERVAL : délai entre deux relectures de la génération d'une clé (défaut 1 s)
+    """
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self._shared_alias = options.get('SHARED_ALIAS', 'shared')
+        self._max_entries = int(options.get('LOCAL_MAX_ENTRIES', 1000))
+        self._local_timeout = float(options.get('LOCAL_TIMEOUT', 60))
+        self._check_interval = float(options.get('VERSION_CHECK_INTERVAL', 1))
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def shared(self):
+        return caches[self._shared_alias]
+
+    def _local_lookup(self, local_key):
+        """(valeur sérialisée, génération, à revérifier) de l'entrée locale, ou None"""
+        with self._lock:
+            entry = self._local.get(local_key)
+            if entry is None:
+                return None
+            pickled, expires_at, generation, checked_at = entry
+            now = time.monotonic()
+            if expires_at <= now:
+                del self._local[local_key]
+                return None
+            self._local.move_to_end(local_key)
+        return pickled, generation, now - checked_at >= self._check_interval
+
+    def _local_confirm(self, local_key):
+        """La génération de l'entrée vient d'être relue : elle est valable un nouvel intervalle"""
+        with self._lock:
+            entry = self._local.get(local_key)
+            if entry is not None:
+                self._local[local_key] = entry[:3] + (time.monotonic(),)
+
+    def _local_discard(self, local_key):
+        with self._lock:
+            self._local.pop(local_key, None)
+
+    def _local_set(self, local_key, value, generation, timeout=DEFAULT_TIMEOUT):
+        ttl = self._local_timeout
+        if timeout is DEFAULT_TIMEOUT:
+            timeout = self.default_timeout
+        if timeout is not None:
+            ttl = min(ttl, timeout)
+        if ttl <= 0 or generation is None:
+            return
+        # Comme le LocMemCache, on stocke une copie sérialisée : l'appelant
+        # peut modifier l'objet retourné sans altérer le cache
+        pickled = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        now = time.monotonic()
+        with self._lock:
+            self._local[local_key] = (pickled, now + ttl, generation, now)
+            self._local.move_to_end(local_key)
+            while len(self._local) > self._max_entries:
+                self._local.popitem(last=False)
+
+    def get(self, key, default=None, version=None):
+        return self.get_many([key], version=version).get(key, default)
+
+    def get_many(self, keys, version=None):
+        found = {}
+        to_check = {}
+        missing = []
+        for key in keys:
+            local_key = self.make_and_validate_key(key, version=version)
+            entry = self._local_lookup(local_key)
+            if entry is None:
+                missing.append(key)
+            elif entry[2]:
+                to_check[key] = entry
+            else:
+                found[key] = pickle.loads(entry[0])
+
+        # Une seule lecture du cache partagé : générations des entrées locales
+        # à revérifier, valeurs et générations des clés absentes localement
+        wanted = [generation_key(key) for key in to_check] + \
+                 [k for key in missing for k in (key, generation_key(key))]
+        shared_values = self.shared.get_many(wanted, version=version) if wanted else {}
+
+        for key, (pickled, generation, _) in to_check.items():
+            local_key = self.make_and_validate_key(key, version=version)
+            if shared_values.get(generation_key(key)) == generation:
+                self._local_confirm(local_key)
+                found[key] = pickle.loads(pickled)
+            else:
+                self._local_discard(local_key)
+                missing.append(key)
+        # Clés modifiées par un autre worker depuis leur mise en cache locale
+        reread = [key for key in missing if key in to_check]
+        if reread:
+            shared_values.update(self.shared.get_many(
+                [k for key in reread for k in (key, generation_key(key))], version=version))
+
+        for key in missing:
+            if key in shared_values:
+                value = shared_values[key]
+                found[key] = value
+                # Sans génération (sortie du cache partagé), la valeur n'est pas gardée localement
+                self._local_set(self.make_and_validate_key(key, version=version), value,
+                                shared_values.get(generation_key(key)))
+        return found
+
+    def has_key(self, key, version=None):
+        return self.get(key, self._missing_key, version=version) is not self._missing_key
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        local_key = self.make_and_validate_key(key, version=version)
+        entry = self._local_lookup(local_key)
+        if entry is not None and entry[0] == pickle.dumps(value, pickle.HIGHEST_PROTOCOL):
+            # Réécrire une valeur identique (ex : menu recalculé à l'identique)
+            # n'invalide pas le cache local des autres workers
+            generation = entry[1]
+        else:
+            generation = uuid.uuid4().hex
+        self.shared.set_many({key: value, generation_key(key): generation}, timeout, version=version)
+        self._local_set(local_key, value, generation, timeout)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        generations = {key: uuid.uuid4().hex for key in data}
+        shared_data = dict(data)
+        shared_data.update({generation_key(key): generation for key, generation in generations.items()})
+        failed = self.shared.set_many(shared_data, timeout, version=version)
+        for key, value in data.items():
+            local_key = self.make_and_validate_key(key, version=version)
+            if key in failed or generation_key(key) in failed:
+                self._local_discard(local_key)
+            else:
+                self._local_set(local_key, value, generations[key], timeout)
+        return [key for key in data if key in failed]
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.make_and_validate_key(key, version=version)
+        added = self.shared.add(key, value, timeout, version=version)
+        if added:
+            self.shared.set(generation_key(key), uuid.uuid4().hex, timeout, version=version)
+        return added
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        self.make_and_validate_key(key, version=version)
+        touched = self.shared.touch(key, timeout, version=version)
+        if touched:
+            self.shared.touch(generation_key(key), timeout, version=version)
+        return touched
+
+    def delete(self, key, version=None):
+        local_key = self.make_and_validate_key(key, version=version)
+        deleted = self.shared.delete(key, version=version)
+        self.shared.delete(generation_key(key), version=version)
+        self._local_discard(local_key)
+        return deleted
+
+    def delete_many(self, keys, version=None):
+        keys = list(keys)
+        if not keys:
+            return
+        local_keys = [self.make_and_validate_key(key, version=version) for key in keys]
+        self.shared.delete_many(keys + [generation_key(key) for key in keys], version=version)
+        for local_key in local_keys:
+            self._local_discard(local_key)
+
+    def clear(self):
+        self.shared.clear()
+        with self._lock:
+            self._local.clear()
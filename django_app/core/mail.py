@@ -0,0 +1,130 @@
+from datetime import timedelta
+import time
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.core.mail.backends.base import BaseEmailBackend
+from django.db import transaction
+from django.utils import timezone
+
+from core.models import OutgoingEmail
+
+
+# Nouvelle tentative après 1, 2, 4, 8... minutes, puis abandon
+MAX_ATTEMPTS = 6
+RETRY_BASE_DELAY = timedelta(minutes=1)
+# Durée de la prise en charge d'un lot par un worker (voir claim_outbox)
+CLAIM_TIMEOUT = timedelta(minutes=15)
+
+
+class OutboxEmailBackend(BaseEmailBackend):
+    """
+    Backend mail qui n'envoie rien : les messages sont enregistrés dans
+    OutgoingEmail et envoyés plus tard par deliver_outbox (commande send_outbox).
+    Une requête ne dépend donc plus du serveur SMTP.
+    """
+    def send_messages(self, email_messages):
+        outgoing = []
+        for message in email_messages:
+            if message.attachments:
+                raise ValueError("Les pièces jointes ne sont pas gérées par l'outbox")
+            outgoing.append(OutgoingEmail(
+                subject=message.subject,
+                body=message.body,
+                from_email=message.from_email,
+                to=list(message.to),
+                cc=list(message.cc),
+                bcc=list(message.bcc),
+                reply_to=list(message.reply_to),
+                headers=dict(message.extra_headers),
+                alternatives=[[content, mimetype] for content, mimetype in getattr(message, 'alternatives', [])],
+            ))
+        OutgoingEmail.objects.bulk_create(outgoing)
+        return len(outgoing)
+
+
+def to_email_message(outgoing: OutgoingEmail, connection):
+    message = EmailMultiAlternatives(
+        subject=outgoing.subject,
+        body=outgoing.body,
+        from_email=outgoing.from_email,
+        to=outgoing.to,
+        cc=outgoing.cc,
+        bcc=outgoing.bcc,
+        reply_to=outgoing.reply_to,
+        headers=outgoing.headers,
+        connection=connection,
+    )
+    for content, mimetype in outgoing.alternatives:
+        message.attach_alternative(content, mimetype)
+    return message
+
+
+def retry_later(outgoing: OutgoingEmail, error: Exception):
+    outgoing.attempts += 1
+    outgoing.last_error = repr(error)
+    if outgoing.attempts >= MAX_ATTEMPTS:
+        outgoing.status = OutgoingEmail.Status.FAILED
+    else:
+        outgoing.next_attempt_at = timezone.now() + RETRY_BASE_DELAY * 2 ** (outgoing.attempts - 1)
+
+
+def claim_outbox(batch_size):
+    """
+    Réserve un lot de mails dans une transaction courte : leur prochaine
+    tentative est repoussée de CLAIM_TIMEOUT, les autres workers les ignorent
+    donc pendant l'envoi. Si ce worker s'arrête, seuls les mails pas encore
+    envoyés sont repris, une fois ce délai écoulé.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        batch = list(OutgoingEmail.objects.
+                        select_for_update(skip_locked=True).
+                        filter(status=OutgoingEmail.Status.PENDING, next_attempt_at__lte=now).
+                        order_by('next_attempt_at')[:batch_size])
+        OutgoingEmail.objects.filter(pk__in=[outgoing.pk for outgoing in batch]).\
+            update(next_attempt_at=now + CLAIM_TIMEOUT)
+    return batch
+
+
+def deliver_outbox(batch_size=50, rate=None) -> int:
+    """
+    Envoie un lot de mails en attente sur une seule connexion SMTP, au plus
+    rate mails par seconde, et retourne le nombre de mails traités.
+    L'envoi se fait hors transaction et le statut de chaque mail est enregistré
+    dès son envoi. En cas d'échec, le mail est retenté plus tard (délai doublé
+    à chaque fois).
+    """
+    batch = claim_outbox(batch_size)
+    if not batch:
+        return 0
+
+    fields = ['status', 'attempts', 'next_attempt_at', 'last_error', 'sent_at']
+    connection = get_connection(settings.OUTBOX_DELIVERY_BACKEND, fail_silently=False)
+    try:
+        connection.open()
+    except Exception as e:
+        # Serveur injoignable : tout le lot est retenté plus tard
+        for outgoing in batch:
+            retry_later(outgoing, e)
+        OutgoingEmail.objects.bulk_update(batch, fields)
+        return len(batch)
+
+    try:
+        for outgoing in batch:
+            start = time.monotonic()
+            try:
+                connection.send_messages([to_email_message(outgoing, connection)])
+                outgoing.attempts += 1
+                outgoing.status = OutgoingEmail.Status.SENT
+                outgoing.sent_at = timezone.now()
+                outgoing.last_error = ""
+            except Exception as e:
+                retry_later(outgoing, e)
+            outgoing.save(update_fields=fields)
+            if rate:
+                time.sleep(max(0, 1 / rate - (time.monotonic() - start)))
+    finally:
+        connection.close()
+
+    return len(batch)
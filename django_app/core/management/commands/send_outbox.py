@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.mail import deliver_outbox
+
+
+class Command(BaseCommand):
+    help = "Envoie par lots les mails en attente dans l'outbox"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=50, help="Nombre de mails envoyés par connexion SMTP")
+        parser.add_argument('--rate', type=float, default=None, help="Nombre maximum de mails envoyés par seconde")
+        parser.add_argument('--loop', action='store_true', help="Tourne en continu au lieu de vider l'outbox une fois")
+        parser.add_argument('--sleep', type=float, default=10, help="Attente (secondes) quand l'outbox est vide, avec --loop")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        total = 0
+        while True:
+            processed = deliver_outbox(batch_size, options['rate'])
+            total += processed
+            if processed < batch_size:
+                if not options['loop']:
+                    break
+                time.sleep(options['sleep'])
+
+        self.stdout.write(f"{total} mail(s) traité(s)")
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.2 on 2026-10-18 07:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutgoingEmail',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('subject', models.CharField(max_length=255, verbose_name='Sujet')),
+                ('body', models.TextField(blank=True, default='')),
+                ('from_email', models.CharField(max_length=255)),
+                ('to', models.JSONField(default=list)),
+                ('cc', models.JSONField(default=list)),
+                ('bcc', models.JSONField(default=list)),
+                ('reply_to', models.JSONField(default=list)),
+                ('headers', models.JSONField(default=dict)),
+                ('alternatives', models.JSONField(default=list)),
+                ('status', models.CharField(choices=[('PENDING', 'En attente'), ('SENT', 'Envoyé'), ('FAILED', 'Abandonné')], default='PENDING', max_length=10)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('next_attempt_at', models.DateTimeField(auto_now_add=True)),
+                ('last_error', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('sent_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'Mail sortant',
+                'verbose_name_plural': 'Mails sortants',
+                'indexes': [models.Index(fields=['status', 'next_attempt_at'], name='outbox_status_next_attempt')],
+            },
+        ),
+    ]
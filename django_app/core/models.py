@@ -0,0 +1,38 @@
+from django.db import models
+
+
+class OutgoingEmail(models.Model):
+    """
+    Mail en attente d'envoi. Les mails du site sont enregistrés ici par
+    core.mail.OutboxEmailBackend, puis envoyés par lots par la commande send_outbox
+    """
+    class Meta:
+        verbose_name = "Mail sortant"
+        verbose_name_plural = "Mails sortants"
+        indexes = [
+            models.Index(fields=["status", "next_attempt_at"], name="outbox_status_next_attempt"),
+        ]
+
+    class Status(models.TextChoices):
+        PENDING = "PENDING", "En attente"
+        SENT    = "SENT", "Envoyé"
+        FAILED  = "FAILED", "Abandonné"
+
+    subject     = models.CharField(verbose_name="Sujet", max_length=255)
+    body        = models.TextField(blank=True, default="")
+    from_email  = models.CharField(max_length=255)
+    to          = models.JSONField(default=list)
+    cc          = models.JSONField(default=list)
+    bcc         = models.JSONField(default=list)
+    reply_to    = models.JSONField(default=list)
+    headers     = models.JSONField(default=dict)
+    alternatives = models.JSONField(default=list)
+    status      = models.CharField(choices=Status, default=Status.PENDING, max_length=10)
+    attempts    = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(auto_now_add=True)
+    last_error  = models.TextField(blank=True, default="")
+    created_at  = models.DateTimeField(auto_now_add=True)
+    sent_at     = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.subject} -> {', '.join(self.to)}"
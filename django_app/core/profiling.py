@@ -0,0 +1,281 @@
+"""
+Profilage des requêtes, activé par PROFILING_ENABLED.
+
+ProfilingMiddleware mesure chaque requête (temps total, nombre et durée des
+requêtes SQL, requêtes SQL répétées, temps de rendu des gabarits) et range
+les mesures par nom d'URL dans un ProfileStore : une fenêtre glissante des
+PROFILING_WINDOW dernières requêtes de chaque vue, en mémoire du worker.
+Une fraction des requêtes (PROFILING_SAMPLE_RATE) passe sous cProfile, et le
+profil de la requête la plus lente de chaque vue est conservé.
+
+Avec PROFILING_DIR, chaque worker recopie régulièrement ses mesures dans un
+fichier de ce dossier : le rapport de l'admin agrège alors tous les workers.
+"""
+from collections import Counter, defaultdict, deque
+from contextlib import contextmanager
+import cProfile
+import io
+import json
+import os
+from pathlib import Path
+import pstats
+import random
+import re
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.template.base import Template
+
+
+# Les listes de paramètres (IN (%s, %s, ...)) ne distinguent pas deux requêtes
+IN_PARAMS_RE = re.compile(r"IN \((?:%s, )*%s\)")
+FLUSH_INTERVAL = 10
+PROFILE_LINES = 40
+
+_recorder = threading.local()
+
+
+def sql_signature(sql):
+    """Requête SQL sans ses valeurs : deux requêtes de même signature ne diffèrent que par leurs paramètres"""
+    return IN_PARAMS_RE.sub("IN (...)", sql)
+
+
+class RequestRecorder:
+    """Mesures d'une requête, remplies par les hooks SQL et gabarits"""
+    def __init__(self):
+        self.nb_queries = 0
+        self.sql_time = 0.0
+        self.signatures = Counter()
+        self.template_time = 0.0
+        self.template_depth = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        # Hook connection.execute_wrapper : appelé pour chaque requête SQL
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_time += time.perf_counter() - start
+            self.nb_queries += 1
+            self.signatures[sql_signature(sql)] += 1
+
+    def duplicates(self):
+        return {signature: count for signature, count in self.signatures.items() if count > 1}
+
+
+_original_template_render = Template.render
+# Nombre de requêtes en cours de mesure : Template.render n'est remplacé que
+# pendant qu'au moins une requête est mesurée dans le process
+_patch_lock = threading.Lock()
+_patch_users = 0
+
+
+def _timed_template_render(self, context):
+    recorder = getattr(_recorder, 'current', None)
+    if recorder is None:
+        return _original_template_render(self, context)
+    # Seuls les gabarits de premier niveau sont chronométrés : les include
+    # et extends sont déjà comptés dans le temps de leur parent
+    recorder.template_depth += 1
+    start = time.perf_counter()
+    try:
+        return _original_template_render(self, context)
+    finally:
+        recorder.template_depth -= 1
+        if recorder.template_depth == 0:
+            recorder.template_time += time.perf_counter() - start
+
+
+@contextmanager
+def timed_templates():
+    """
+    Chronomètre le rendu des gabarits le temps du bloc. Les autres threads
+    rendent leurs gabarits sans mesure tant qu'ils n'ont pas de requête en cours.
+    """
+    global _patch_users
+    with _patch_lock:
+        if _patch_users == 0:
+            Template.render = _timed_template_render
+        _patch_users += 1
+    try:
+        yield
+    finally:
+        with _patch_lock:
+            _patch_users -= 1
+            # Un autre outil a pu remplacer Template.render entre-temps : on n'y touche pas
+            if _patch_users == 0 and Template.render is _timed_template_render:
+                Template.render = _original_template_render
+
+
+class ProfileStore:
+    """
+    Mesures des dernières requêtes de chaque vue (fenêtre glissante de window
+    requêtes) et profil cProfile de la requête profilée la plus lente de chaque vue
+    """
+    def __init__(self, window=200, directory=None):
+        self.window = window
+        self.directory = Path(directory) if directory else None
+        self._samples = defaultdict(lambda: deque(maxlen=self.window))
+        self._profiles = {}
+        self._lock = threading.Lock()
+        self._flushed_at = time.monotonic()
+
+    def add(self, view_name, sample, profile=None):
+        with self._lock:
+            self._samples[view_name].append(sample)
+            if profile is not None:
+                slowest = self._profiles.get(view_name)
+                if slowest is None or slowest['wall_ms'] <= sample['wall_ms']:
+                    self._profiles[view_name] = {'wall_ms': sample['wall_ms'], 'stats': profile}
+        if self.directory and time.monotonic() - self._flushed_at >= FLUSH_INTERVAL:
+            self.flush()
+
+    def clear(self):
+        with self._lock:
+            self._samples.clear()
+            self._profiles.clear()
+        if self.directory:
+            for path in self.directory.glob("*.json"):
+                path.unlink(missing_ok=True)
+
+    def _own_file(self):
+        return self.directory / f"{os.getpid()}.json"
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'samples': {view_name: list(samples) for view_name, samples in self._samples.items()},
+                'profiles': dict(self._profiles),
+            }
+
+    def flush(self):
+        """Recopie les mesures du worker dans PROFILING_DIR (remplacement atomique du fichier)"""
+        self._flushed_at = time.monotonic()
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self._own_file()
+        tmp_path = path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(self.snapshot()))
+        os.replace(tmp_path, path)
+
+    def load_all(self):
+        """Mesures de ce worker et, avec PROFILING_DIR, celles des autres workers"""
+        snapshots = [self.snapshot()]
+        if self.directory and self.directory.is_dir():
+            own_file = self._own_file()
+            for path in self.directory.glob("*.json"):
+                if path != own_file:
+                    try:
+                        snapshots.append(json.loads(path.read_text()))
+                    except (OSError, ValueError):
+                        # Fichier en cours de remplacement ou d'un worker arrêté
+                        continue
+
+        samples = defaultdict(list)
+        profiles = {}
+        for snapshot in snapshots:
+            for view_name, view_samples in snapshot['samples'].items():
+                samples[view_name].extend(view_samples)
+            for view_name, profile in snapshot['profiles'].items():
+                if view_name not in profiles or profiles[view_name]['wall_ms'] < profile['wall_ms']:
+                    profiles[view_name] = profile
+        return samples, profiles
+
+
+def percentile(values, ratio):
+    values = sorted(values)
+    return values[min(int(len(values) * ratio), len(values) - 1)]
+
+
+def build_report(samples, profiles):
+    """
+    Une ligne par vue : nombre de requêtes mesurées, temps total cumulé,
+    temps moyen, p95 et max (ms), requêtes SQL et temps SQL moyens, temps de
+    gabarits moyen et requêtes SQL répétées les plus fréquentes
+    """
+    rows = []
+    for view_name, view_samples in samples.items():
+        nb = len(view_samples)
+        walls = [s['wall_ms'] for s in view_samples]
+        duplicates = Counter()
+        for sample in view_samples:
+            duplicates.update(sample['duplicates'])
+        rows.append({
+            'view_name': view_name,
+            'count': nb,
+            'total_ms': sum(walls),
+            'mean_ms': sum(walls) / nb,
+            'p95_ms': percentile(walls, 0.95),
+            'max_ms': max(walls),
+            'queries': sum(s['queries'] for s in view_samples) / nb,
+            'sql_ms': sum(s['sql_ms'] for s in view_samples) / nb,
+            'template_ms': sum(s['template_ms'] for s in view_samples) / nb,
+            'duplicates': [{'signature': signature, 'count': count / nb}
+                           for signature, count in duplicates.most_common(3)],
+            'profile': profiles.get(view_name),
+        })
+    return rows
+
+
+_store = None
+
+
+def get_store():
+    global _store
+    if _store is None:
+        _store = ProfileStore(window=getattr(settings, 'PROFILING_WINDOW', 200),
+                              directory=getattr(settings, 'PROFILING_DIR', None))
+    return _store
+
+
+class ProfilingMiddleware:
+    """
+    À placer en tête de MIDDLEWARE : les autres middlewares sont compris
+    dans les mesures. Sans PROFILING_ENABLED, Django l'écarte au démarrage.
+    """
+    def __init__(self, get_response):
+        if not getattr(settings, 'PROFILING_ENABLED', False):
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        self.sample_rate = getattr(settings, 'PROFILING_SAMPLE_RATE', 0.01)
+        self.store = get_store()
+
+    def __call__(self, request):
+        recorder = RequestRecorder()
+        profiler = cProfile.Profile() if random.random() < self.sample_rate else None
+        _recorder.current = recorder
+        start = time.perf_counter()
+        try:
+            with connections['default'].execute_wrapper(recorder), timed_templates():
+                if profiler is not None:
+                    try:
+                        profiler.enable()
+                    except ValueError:
+                        # Un autre profileur est actif dans ce process
+                        profiler = None
+                try:
+                    response = self.get_response(request)
+                finally:
+                    if profiler is not None:
+                        profiler.disable()
+        finally:
+            _recorder.current = None
+        wall_ms = (time.perf_counter() - start) * 1000
+
+        match = request.resolver_match
+        view_name = match.view_name if match is not None else "(non résolue)"
+        self.store.add(view_name, {
+            'wall_ms': wall_ms,
+            'queries': recorder.nb_queries,
+            'sql_ms': recorder.sql_time * 1000,
+            'template_ms': recorder.template_time * 1000,
+            'duplicates': recorder.duplicates(),
+        }, profile=self.format_profile(profiler) if profiler is not None else None)
+        return response
+
+    def format_profile(self, profiler):
+        output = io.StringIO()
+        pstats.Stats(profiler, stream=output).sort_stats('cumulative').print_stats(PROFILE_LINES)
+        return output.getvalue()
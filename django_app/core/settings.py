@@ -106,6 +106,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.profiling.ProfilingMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -123,14 +124,41 @@ MIDDLEWARE = [
     "django_htmx.middleware.HtmxMiddleware",
 ]
 
+# Profilage des requêtes (core.profiling), rapport dans l'admin : /admin/profiling/
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", 'False').lower() in ('true', '1')
+# Part des requêtes passées sous cProfile
+PROFILING_SAMPLE_RATE = float(os.getenv("PROFILING_SAMPLE_RATE", "0.01"))
+# Nombre de requêtes gardées par vue
+PROFILING_WINDOW = 200
+# Dossier partagé par les workers, pour un rapport qui les agrège tous
+PROFILING_DIR = os.getenv("PROFILING_DIR")
+
 ROOT_URLCONF = 'core.urls'
 SITE_ID=1
 
+# Cache local à chaque worker (LRU en mémoire) devant un cache fichier
+# partagé par tous les workers du serveur, voir core.cache.TieredCache
 CACHES = {
     "default": {
-        "BACKEND": "django.core.cache.backends.db.DatabaseCache",
-        "LOCATION": "default_cache_table",
-    }
+        "BACKEND": "core.cache.TieredCache",
+        "OPTIONS": {
+            "SHARED_ALIAS": "shared",
+            "LOCAL_MAX_ENTRIES": 1000,
+            "LOCAL_TIMEOUT": 60,
+            "VERSION_CHECK_INTERVAL": 1,
+        },
+    },
+    "shared": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": os.getenv("CACHE_LOCATION", str(BASE_DIR.parent / "cache")),
+        # Chaque clé a une génération à côté d'elle (core.cache) : 20000 fichiers
+        # pour 10000 valeurs (PDF gardés 30 jours, rosters, questionnaires, menus).
+        # Au-delà, un dixième des fichiers est supprimé au lieu du tiers par défaut
+        "OPTIONS": {
+            "MAX_ENTRIES": int(os.getenv("CACHE_MAX_ENTRIES", "20000")),
+            "CULL_FREQUENCY": 10,
+        },
+    },
 }
 
 MESSAGE_STORAGE = 'django.contrib.messages.storage.session.SessionStorage'
@@ -194,15 +222,25 @@ WSGI_APPLICATION = 'core.wsgi.application'
 
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
-DATABASES = { 
-    "default": {
-        "ENGINE": "django.db.backends.mysql",
-        "OPTIONS": {
-            "read_default_file": os.path.join(BASE_DIR, "..", "my.cnf"),
-        },
+# DATABASE_ENGINE=sqlite permet de lancer le site et les tests en local,
+# sans serveur MySQL
+if os.getenv("DATABASE_ENGINE", "mysql") == "sqlite":
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": os.getenv("SQLITE_PATH", str(BASE_DIR.parent / "db.sqlite3")),
+        }
     }
-}   
-print("Connected to MySQL Database")
+else:
+    DATABASES = { 
+        "default": {
+            "ENGINE": "django.db.backends.mysql",
+            "OPTIONS": {
+                "read_default_file": os.path.join(BASE_DIR, "..", "my.cnf"),
+            },
+        }
+    }   
+    print("Connected to MySQL Database")
 
 
 # Password validation
@@ -349,7 +387,10 @@ STRIPE_ENDPOINT_SECRET  = os.environ["STRIPE_ENDPOINT_SECRET"]
 DOMAIN_URL = os.environ["DOMAIN_URL"]
 
 # EMAIL
-#EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
+# Les mails sont enregistrés dans l'outbox (core.models.OutgoingEmail),
+# puis envoyés par lots avec le backend SMTP par : manage.py send_outbox --loop
+EMAIL_BACKEND = 'core.mail.OutboxEmailBackend'
+OUTBOX_DELIVERY_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
 DEFAULT_FROM_EMAIL = os.environ["EMAIL_HOST_USER"]
 
 EMAIL_HOST = os.environ["EMAIL_HOST"]
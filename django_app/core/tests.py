@@ -0,0 +1,239 @@
+from datetime import timedelta
+import json
+import tempfile
+from unittest import mock
+
+from cms.utils.permissions import set_current_user
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.cache import caches
+from django.template.base import Template
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from core.cache import TieredCache
+from core import profiling
+from core.mail import deliver_outbox, MAX_ATTEMPTS
+from core.models import OutgoingEmail
+
+
+@override_settings(EMAIL_BACKEND='core.mail.OutboxEmailBackend',
+                   OUTBOX_DELIVERY_BACKEND='django.core.mail.backends.locmem.EmailBackend')
+class OutboxTests(TestCase):
+    def send_mails(self, count):
+        for i in range(count):
+            message = mail.EmailMultiAlternatives(f"Sujet {i}", "Corps", "orga@example.com", [f"joueur{i}@example.com"])
+            message.attach_alternative("<p>Corps</p>", "text/html")
+            message.send()
+
+    def test_mails_are_queued_then_delivered_in_batch(self):
+        self.send_mails(3)
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(OutgoingEmail.objects.filter(status=OutgoingEmail.Status.PENDING).count(), 3)
+
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.open') as open_connection:
+            self.assertEqual(deliver_outbox(batch_size=10), 3)
+        # Une seule connexion pour tout le lot
+        self.assertEqual(open_connection.call_count, 1)
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(mail.outbox[0].alternatives[0][1], "text/html")
+        self.assertEqual(OutgoingEmail.objects.filter(status=OutgoingEmail.Status.SENT).count(), 3)
+        self.assertEqual(deliver_outbox(batch_size=10), 0)
+
+    def test_failed_delivery_is_retried_with_backoff(self):
+        self.send_mails(1)
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages', side_effect=ConnectionError):
+            deliver_outbox()
+        outgoing = OutgoingEmail.objects.get()
+        self.assertEqual(outgoing.status, OutgoingEmail.Status.PENDING)
+        self.assertGreater(outgoing.next_attempt_at, timezone.now())
+        # Pas de nouvel essai avant la fin du délai
+        self.assertEqual(deliver_outbox(), 0)
+
+        outgoing.next_attempt_at = timezone.now() - timedelta(seconds=1)
+        outgoing.attempts = MAX_ATTEMPTS - 1
+        outgoing.save()
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages', side_effect=ConnectionError):
+            deliver_outbox()
+        outgoing.refresh_from_db()
+        self.assertEqual(outgoing.status, OutgoingEmail.Status.FAILED)
+        self.assertEqual(len(mail.outbox), 0)
+
+
+    def test_sent_mails_survive_a_crash_mid_batch(self):
+        self.send_mails(3)
+        sent = []
+
+        def send_then_crash(messages):
+            if sent:
+                raise SystemExit
+            sent.extend(messages)
+            return 1
+
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages', side_effect=send_then_crash), \
+                mock.patch('django.core.mail.backends.locmem.EmailBackend.close') as close_connection:
+            with self.assertRaises(SystemExit):
+                deliver_outbox(batch_size=10)
+        close_connection.assert_called_once()
+
+        # Le premier mail reste envoyé ; les autres, réservés, ne sont repris qu'après le délai
+        statuses = list(OutgoingEmail.objects.order_by('pk').values_list('status', flat=True))
+        self.assertEqual(statuses, [OutgoingEmail.Status.SENT] + [OutgoingEmail.Status.PENDING] * 2)
+        self.assertEqual(deliver_outbox(batch_size=10), 0)
+        OutgoingEmail.objects.update(next_attempt_at=timezone.now())
+        self.assertEqual(deliver_outbox(batch_size=10), 2)
+        self.assertEqual(len(mail.outbox), 2)
+
+
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'shared': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tiered-tests'},
+})
+class TieredCacheTests(TestCase):
+    def setUp(self):
+        caches['shared'].clear()
+
+    def worker(self, **options):
+        """Un TieredCache par worker, tous devant le même cache partagé"""
+        return TieredCache(None, {'OPTIONS': {'SHARED_ALIAS': 'shared', **options}})
+
+    def test_reads_are_served_locally(self):
+        cache = self.worker()
+        cache.set('menu', ['a', 'b'])
+        with mock.patch.object(caches['shared'], 'get', wraps=caches['shared'].get) as shared_get:
+            for _ in range(10):
+                self.assertEqual(cache.get('menu'), ['a', 'b'])
+        self.assertEqual(shared_get.call_count, 0)
+
+        # Le cache local renvoie une copie
+        cache.get('menu').append('c')
+        self.assertEqual(cache.get('menu'), ['a', 'b'])
+
+    def test_local_tier_is_bounded(self):
+        cache = self.worker(LOCAL_MAX_ENTRIES=2)
+        self.worker().set_many({'k1': 1, 'k2': 2, 'k3': 3})
+        for key in ('k1', 'k2', 'k3'):
+            cache.get(key)
+        self.assertEqual(len(cache._local), 2)
+        self.assertEqual(cache.get('k1'), 1)
+
+        # Valeur écrite sans génération (par exemple sortie du cache partagé) : non gardée localement
+        caches['shared'].set('k4', 4)
+        self.assertEqual(cache.get('k4'), 4)
+        self.assertNotIn(cache.make_key('k4'), cache._local)
+
+    def test_writes_invalidate_other_workers(self):
+        worker1 = self.worker(VERSION_CHECK_INTERVAL=0)
+        worker2 = self.worker(VERSION_CHECK_INTERVAL=0)
+        worker1.set('roster', 1)
+        self.assertEqual(worker2.get('roster'), 1)
+
+        worker1.set('roster', 2)
+        self.assertEqual(worker2.get('roster'), 2)
+        worker1.delete('roster')
+        self.assertIsNone(worker2.get('roster'))
+
+    def test_generation_is_checked_periodically(self):
+        worker1 = self.worker()
+        worker2 = self.worker(VERSION_CHECK_INTERVAL=60)
+        worker1.set('roster', 1)
+        self.assertEqual(worker2.get('roster'), 1)
+        worker1.set('roster', 2)
+        # Valeur locale gardée jusqu'à la prochaine vérification
+        self.assertEqual(worker2.get('roster'), 1)
+        for local_key, entry in worker2._local.items():
+            worker2._local[local_key] = entry[:3] + (entry[3] - 60,)
+        self.assertEqual(worker2.get('roster'), 2)
+
+    def test_writes_only_invalidate_their_key(self):
+        worker1 = self.worker(VERSION_CHECK_INTERVAL=0)
+        worker2 = self.worker(VERSION_CHECK_INTERVAL=0)
+        worker1.set_many({'menu': ['a'], 'pdf': b'%PDF'})
+        worker2.get_many(['menu', 'pdf'])
+
+        worker1.set('roster', 1)
+        worker1.delete('bg_graph')
+        with mock.patch.object(caches['shared'], 'get_many', wraps=caches['shared'].get_many) as shared_get_many:
+            self.assertEqual(worker2.get_many(['menu', 'pdf']), {'menu': ['a'], 'pdf': b'%PDF'})
+        # Seules les générations sont relues, en une fois, et les valeurs restent locales
+        shared_get_many.assert_called_once()
+        self.assertEqual(sorted(shared_get_many.call_args.args[0]), ['tiered_generation:menu', 'tiered_generation:pdf'])
+
+
+@override_settings(PROFILING_ENABLED=True, PROFILING_SAMPLE_RATE=1, PROFILING_DIR=None)
+class ProfilingTests(TestCase):
+    def setUp(self):
+        set_current_user(None)
+        caches['default'].clear()
+        profiling._store = None
+        self.admin = User.objects.create_superuser("admin", password="admin")
+        self.client.force_login(self.admin)
+
+    def tearDown(self):
+        profiling._store = None
+
+    def test_requests_are_recorded_per_view(self):
+        self.client.get(reverse('larp:orga_gn_list'))
+        self.client.get(reverse('larp:orga_gn_list'))
+
+        samples, profiles = profiling.get_store().load_all()
+        self.assertEqual(len(samples['larp:orga_gn_list']), 2)
+        sample = samples['larp:orga_gn_list'][-1]
+        self.assertGreater(sample['queries'], 0)
+        self.assertGreater(sample['template_ms'], 0)
+        self.assertLessEqual(sample['template_ms'], sample['wall_ms'])
+        self.assertIn("cumulative", profiles['larp:orga_gn_list']['stats'])
+
+    def test_template_render_is_only_patched_during_requests(self):
+        original = Template.render
+        self.client.get(reverse('larp:orga_gn_list'))
+        self.assertIs(Template.render, original)
+
+        with profiling.timed_templates():
+            with profiling.timed_templates():
+                self.assertIsNot(Template.render, original)
+            self.assertIsNot(Template.render, original)
+        self.assertIs(Template.render, original)
+
+    def test_duplicate_queries_are_grouped_by_signature(self):
+        recorder = profiling.RequestRecorder()
+        execute = lambda sql, params, many, context: None
+        for pk in range(3):
+            recorder(execute, "SELECT * FROM larp_larp WHERE id = %s", [pk], False, {})
+        recorder(execute, "SELECT * FROM larp_opus WHERE id IN (%s, %s)", [1, 2], False, {})
+        recorder(execute, "SELECT * FROM larp_opus WHERE id IN (%s, %s, %s)", [1, 2, 3], False, {})
+        self.assertEqual(recorder.duplicates(), {
+            "SELECT * FROM larp_larp WHERE id = %s": 3,
+            "SELECT * FROM larp_opus WHERE id IN (...)": 2,
+        })
+
+    @override_settings(PROFILING_ENABLED=False)
+    def test_report_merges_workers_and_sorts(self):
+        with tempfile.TemporaryDirectory() as directory:
+            store = profiling.ProfileStore(directory=directory)
+            store.add('larp:view_pj', {'wall_ms': 10, 'queries': 5, 'sql_ms': 2, 'template_ms': 3, 'duplicates': {}})
+            # Mesures écrites par un autre worker
+            other = {'samples': {'larp:orga_gn': [
+                        {'wall_ms': 500, 'queries': 40, 'sql_ms': 100, 'template_ms': 50, 'duplicates': {"SELECT 1": 3}}]},
+                     'profiles': {}}
+            with open(f"{directory}/1.json", "w") as f:
+                json.dump(other, f)
+            profiling._store = store
+
+            response = self.client.get(reverse('profiling_report'))
+            self.assertEqual([row['view_name'] for row in response.context['rows']], ['larp:orga_gn', 'larp:view_pj'])
+            self.assertContains(response, "SELECT 1")
+
+            response = self.client.get(reverse('profiling_report') + "?o=view_name")
+            self.assertEqual([row['view_name'] for row in response.context['rows']], ['larp:orga_gn', 'larp:view_pj'])
+            response = self.client.get(reverse('profiling_report') + "?o=queries")
+            self.assertEqual(response.context['rows'][0]['view_name'], 'larp:orga_gn')
+
+            self.client.post(reverse('profiling_report'))
+            self.assertEqual(store.load_all(), ({}, {}))
+
+    def test_report_requires_staff(self):
+        self.client.force_login(User.objects.create_user("player"))
+        response = self.client.get(reverse('profiling_report'))
+        self.assertEqual(response.status_code, 302)
@@ -23,6 +23,7 @@ from django_registration.backends.activation.views import RegistrationView
 import core.views as core_views
 
 urlpatterns = [
+    path('admin/profiling/', admin.site.admin_view(core_views.profiling_report), name='profiling_report'),
     path('admin/', admin.site.urls),
     path('filer/', include('filer.urls')),
     path('accounts/logout', core_views.user_logout, name='user_logout'),
@@ -1,8 +1,11 @@
+from django.contrib import admin
 from django.contrib.auth.decorators import login_required
 from django.http import HttpRequest
 from django.shortcuts import redirect, render
 from django.urls import reverse
 
+from core.profiling import build_report, get_store
+
 
 
 @login_required
@@ -29,3 +32,31 @@ def registration_closed(request):
     text = """La création de compte est actuellement fermée, les équipes travaillent pour vous permettre d'accéder à un  
     site fini avec les bonnes fonctionnalités. N'hésitez pas à revenir, et à suivre notre actualité sur les réseaux"""
     return render(request, 'simple_text.html', {title: title, text:text})
+
+
+# Colonnes du rapport de profilage par lesquelles on peut trier
+REPORT_ORDERINGS = ['view_name', 'count', 'total_ms', 'mean_ms', 'p95_ms', 'max_ms', 'queries', 'sql_ms', 'template_ms']
+
+
+def profiling_report(request: HttpRequest):
+    """Rapport de ProfilingMiddleware dans l'admin, trié par défaut par temps cumulé"""
+    store = get_store()
+    if request.method == 'POST':
+        store.clear()
+        return redirect(reverse('profiling_report'))
+
+    ordering = request.GET.get('o', 'total_ms')
+    if ordering not in REPORT_ORDERINGS:
+        ordering = 'total_ms'
+    rows = build_report(*store.load_all())
+    rows.sort(key=lambda row: row[ordering], reverse=ordering != 'view_name')
+    profile_view = request.GET.get('profile')
+
+    context = {
+        **admin.site.each_context(request),
+        'title': "Profilage des requêtes",
+        'rows': rows,
+        'ordering': ordering,
+        'profile_row': next((row for row in rows if row['view_name'] == profile_view), None),
+    }
+    return render(request, 'admin/profiling_report.html', context)
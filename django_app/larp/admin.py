@@ -11,7 +11,7 @@ admin.site.register(models.Profile)
 class FactionAdmin(admin.ModelAdmin):
     # a list of displayed columns name.
     list_select_related = ["larp"]
-    list_display = ['name','larp']
+    list_display = ['name','larp', 'places']
     search_fields = ('name','larp__name')
 
 admin.site.register(models.Faction, FactionAdmin)
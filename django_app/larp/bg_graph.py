@@ -0,0 +1,176 @@
+from collections import defaultdict
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Case, F, When
+from larp import models as larp_models
+
+
+BG_GRAPH_CACHE_TIMEOUT = 60 * 60 * 24
+
+
+def bg_graph_cache_key(faction_id):
+    return f"larp_bg_graph_{faction_id}"
+
+
+def compile_bg_graph(faction_id):
+    """
+    Compile le questionnaire de background d'une faction en 2 requêtes.
+
+    Retourne un dictionnaire :
+    - 'steps' : numéro d'étape -> BgStep
+    - 'choices' : numéro d'étape -> liste des BgChoice de l'étape
+    - 'last_step' : numéro de la dernière étape (0 s'il n'y en a pas)
+    """
+    steps = {s.step: s for s in larp_models.BgStep.objects.filter(faction_id=faction_id).order_by('step')}
+    step_by_id = {s.pk: s.step for s in steps.values()}
+    choices = defaultdict(list)
+    for choice in larp_models.BgChoice.objects.filter(bg_step__faction_id=faction_id).order_by('pk'):
+        choices[step_by_id[choice.bg_step_id]].append(choice)
+
+    return {
+        'steps': steps,
+        'choices': dict(choices),
+        'last_step': max(steps, default=0),
+    }
+
+
+def get_bg_graph(faction_id):
+    key = bg_graph_cache_key(faction_id)
+    graph = cache.get(key)
+    if graph is None:
+        graph = compile_bg_graph(faction_id)
+        cache.set(key, graph, BG_GRAPH_CACHE_TIMEOUT)
+    return graph
+
+
+def invalidate_bg_graph(faction_id):
+    """Appelé par les signaux à chaque modification d'une BgStep ou d'un BgChoice"""
+    cache.delete_many([bg_graph_cache_key(faction_id), bg_analysis_cache_key(faction_id)])
+
+
+def available_choices(graph, step, chosen_choice_ids):
+    """Choix de l'étape sans prérequis, ou dont le prérequis a été choisi"""
+    return [c for c in graph['choices'].get(step, [])
+            if c.requisit_id is None or c.requisit_id in chosen_choice_ids]
+
+
+def is_last_step(graph, step):
+    return step >= graph['last_step']
+
+
+def bg_analysis_cache_key(faction_id):
+    return f"larp_bg_analysis_{faction_id}"
+
+
+def analyse_bg_graph(graph):
+    """
+    Parcourt tous les chemins possibles du questionnaire, étape par étape,
+    comme le ferait complete_bg.
+
+    Un chemin n'est décrit que par les choix dont dépendent les étapes
+    suivantes (les prérequis encore à venir) : les chemins qui ne diffèrent
+    que par des choix sans conséquence sont fusionnés et comptés ensemble.
+    Le coût est donc proportionnel à la taille du graphe multipliée par le
+    nombre d'états distincts, soit linéaire pour des prérequis qui ne portent
+    que sur quelques étapes.
+
+    Retourne un dictionnaire :
+    - 'nb_paths' : nombre de backgrounds complets différents
+    - 'unreachable' : choix qui ne peuvent jamais être proposés
+    - 'dead_ends' : liste de {'step': numéro, 'bg_step': BgStep ou None,
+      'after': choix menant à une étape sans choix possible}
+    """
+    last_step = graph['last_step']
+    choices_by_id = {c.pk: c for choices in graph['choices'].values() for c in choices}
+    step_of_choice = {c.pk: step for step, choices in graph['choices'].items() for c in choices}
+
+    # needed[step] : étapes dont le choix conditionne une étape >= step
+    needed = {last_step + 1: frozenset()}
+    for step in range(last_step, 0, -1):
+        requisit_steps = {step_of_choice[c.requisit_id] for c in graph['choices'].get(step, [])
+                          if c.requisit_id is not None and c.requisit_id in step_of_choice}
+        needed[step] = needed[step + 1] | requisit_steps
+
+    reached = set()
+    dead_ends = {}
+    # état : choix encore utiles (triés), valeur : nombre de chemins menant à cet état
+    states = {(): 1}
+    for step in range(1, last_step + 1):
+        next_states = {}
+        for state, nb_paths in states.items():
+            chosen = set(state)
+            choices = available_choices(graph, step, chosen)
+            if not choices:
+                dead_ends.setdefault((step, state), None)
+                continue
+            for choice in choices:
+                reached.add(choice.pk)
+                new_state = tuple(sorted(
+                    choice_id for choice_id in chosen | {choice.pk}
+                    if step_of_choice[choice_id] in needed[step + 1]))
+                next_states[new_state] = next_states.get(new_state, 0) + nb_paths
+        states = next_states
+
+    return {
+        'nb_paths': sum(states.values()) if last_step else 0,
+        'unreachable': [c for pk, c in sorted(choices_by_id.items()) if pk not in reached],
+        'dead_ends': [
+            {
+                'step': step,
+                'bg_step': graph['steps'].get(step),
+                'after': [choices_by_id[pk] for pk in state],
+            }
+            for step, state in dead_ends
+        ],
+    }
+
+
+def get_bg_analysis(faction_id):
+    key = bg_analysis_cache_key(faction_id)
+    analysis = cache.get(key)
+    if analysis is None:
+        analysis = analyse_bg_graph(get_bg_graph(faction_id))
+        cache.set(key, analysis, BG_GRAPH_CACHE_TIMEOUT)
+    return analysis
+
+
+@transaction.atomic
+def reorder_bg_steps(faction_id, step_ids):
+    """
+    Applique un nouvel ordre complet des étapes d'une faction (step_ids, de la
+    première à la dernière étape) et renumérote les réponses des personnages
+    (Character_Bg_choices.step) en conséquence.
+    Lève ValueError si step_ids ne correspond pas exactement aux étapes de la faction.
+    """
+    steps = {s.pk: s for s in larp_models.BgStep.objects.select_for_update().filter(faction_id=faction_id)}
+    if len(step_ids) != len(steps) or set(step_ids) != set(steps):
+        raise ValueError("L'ordre doit contenir chaque étape de la faction une seule fois")
+
+    new_step_by_id = {}
+    for new_step, step_id in enumerate(step_ids, start=1):
+        if steps[step_id].step != new_step:
+            steps[step_id].step = new_step
+            new_step_by_id[step_id] = new_step
+    if not new_step_by_id:
+        return
+
+    # Une seule requête : la contrainte unique_bg_step_per_faction est
+    # différée, les doublons temporaires ne sont vérifiés qu'au commit
+    larp_models.BgStep.objects.bulk_update([steps[pk] for pk in new_step_by_id], ['step'])
+
+    # La contrainte des réponses (pjInfos, step) n'est pas différée : on passe
+    # par des numéros négatifs pour qu'aucune ligne n'en croise une autre
+    new_step_by_choice = {
+        choice_id: new_step_by_id[bg_step_id]
+        for choice_id, bg_step_id in larp_models.BgChoice.objects.
+            filter(bg_step_id__in=new_step_by_id).values_list('pk', 'bg_step_id')
+    }
+    if new_step_by_choice:
+        answers = larp_models.Character_Bg_choices.objects.filter(bgchoice_id__in=new_step_by_choice)
+        answers.update(step=Case(
+            *[When(bgchoice_id=choice_id, then=-new_step) for choice_id, new_step in new_step_by_choice.items()],
+            default=F('step')))
+        answers.update(step=-F('step'))
+
+    # bulk_update et update n'envoient pas de signaux
+    invalidate_bg_graph(faction_id)
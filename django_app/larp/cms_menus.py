@@ -1,3 +1,6 @@
+from collections import OrderedDict, defaultdict
+import threading
+
 from django.http import HttpRequest
 from django.urls import reverse
 from django.utils.translation import gettext_lazy as _
@@ -7,35 +10,87 @@ from menus.base import NavigationNode, Modifier
 from menus.menu_pool import menu_pool, MenuRenderer
 
 
+# Plans de rattachement déjà calculés, par clé de cache du menu, partagés
+# par les threads du worker : toute lecture ou écriture se fait sous verrou
+LINK_PLANS_MAX_ENTRIES = 256
+_link_plans = OrderedDict()
+_link_plans_lock = threading.Lock()
+
+
+def nodes_signature(nodes):
+    """Ce dont dépend le rattachement des nœuds : s'il change, le plan est recalculé"""
+    return tuple(
+        (n.namespace, n.id, n.parent_id, tuple(n.attr.get("navigation_extenders") or ()),
+         bool(n.attr.get("is_home", False)), n.visible)
+        for n in nodes)
+
+
+def build_link_plan(nodes):
+    """
+    Calcule les rattachements des nœuds des menus étendus (navigation_extenders)
+    à leur nœud parent, en O(n) grâce à un index namespace -> nœuds sans parent.
+
+    Retourne une liste de (indice du nœud, indice du parent ou None), None
+    signifiant que le nœud est détaché (accueil invisible).
+    """
+    home = next((i for i, n in enumerate(nodes) if n.attr.get("is_home", False)), None)
+    orphans_by_namespace = defaultdict(list)
+    for i, node in enumerate(nodes):
+        if not node.parent_id:
+            orphans_by_namespace[node.namespace].append(i)
+
+    plan = []
+    for i, node in enumerate(nodes):
+        for ext in node.attr.get("navigation_extenders", None) or ():
+            orphans = orphans_by_namespace.get(ext)
+            if not orphans:
+                continue
+            if i == home and not node.visible:
+                # si l'accueil a des extensions mais n'est pas visible,
+                # ses nœuds restent sans parent (et rattachables ailleurs)
+                plan.extend((j, None) for j in orphans)
+            else:
+                plan.extend((j, i) for j in orphans)
+                # Une fois rattachés, ces nœuds ont un parent
+                del orphans_by_namespace[ext]
+    return plan
+
+
+def get_link_plan(cache_key, nodes):
+    signature = nodes_signature(nodes)
+    key = (cache_key, signature)
+    with _link_plans_lock:
+        plan = _link_plans.get(key)
+        if plan is not None:
+            _link_plans.move_to_end(key)
+            return plan
+    # Calculé hors verrou : deux threads peuvent calculer le même plan, le résultat est identique
+    plan = build_link_plan(nodes)
+    with _link_plans_lock:
+        _link_plans[key] = plan
+        while len(_link_plans) > LINK_PLANS_MAX_ENTRIES:
+            _link_plans.popitem(last=False)
+    return plan
+
+
 class LarpNavExtender(Modifier):
     def modify(self, request, nodes, namespace, root_id, post_cut, breadcrumb):
         if post_cut:
             return nodes
         # rearrange the parent relations
-        # Find home
         home = next((n for n in nodes if n.attr.get("is_home", False)), None)
-        # Find nodes with NavExtenders
-        exts = []
-        for node in nodes:
-            extenders = node.attr.get("navigation_extenders", None)
-            if extenders:
-                for ext in extenders:
-                    if ext not in exts:
-                        exts.append(ext)
-                    # Link the nodes
-                    for extnode in nodes:
-                        if extnode.namespace == ext and not extnode.parent_id:
-                            # if home has nav extenders but home is not visible
-                            if node == home and not node.visible:
-                                # extnode.parent_id = None
-                                extnode.parent_namespace = None
-                                extnode.parent = None
-                            else:
-                                extnode.parent_id = node.id
-                                extnode.parent_namespace = node.namespace
-                                extnode.parent = node
-                                node.children.append(extnode)
-        removed = []
+        # Link the nodes
+        for child_index, parent_index in get_link_plan(self.renderer.cache_key, nodes):
+            extnode = nodes[child_index]
+            if parent_index is None:
+                extnode.parent_namespace = None
+                extnode.parent = None
+            else:
+                node = nodes[parent_index]
+                extnode.parent_id = node.id
+                extnode.parent_namespace = node.namespace
+                extnode.parent = node
+                node.children.append(extnode)
 
         if breadcrumb:
             # if breadcrumb and home not in navigation add node
@@ -45,11 +100,17 @@ class LarpNavExtender(Modifier):
                     home.selected = True
                 else:
                     home.selected = False
-        # remove all nodes that are nav_extenders and not assigned
-        for node in removed:
-            nodes.remove(node)
         return nodes
 
+def patch_user_nodes(nodes, user):
+    """Complète les nœuds du menu mis en cache avec les valeurs de l'utilisateur"""
+    for node in nodes:
+        if node.attr.get("user_title"):
+            node.title = user.username
+        if node.attr.get("user_profile_url"):
+            node.url = reverse("larp:profile", kwargs={'user_id': user.pk})
+
+
 class LarpMenuRenderer(MenuRenderer):
     def __init__(self, pool, request):
         super(LarpMenuRenderer, self).__init__(pool, request)
@@ -57,19 +118,29 @@ class LarpMenuRenderer(MenuRenderer):
 
     @property
     def cache_key(self):
+        # Les nœuds en cache ne dépendent que du rôle : les valeurs propres
+        # à l'utilisateur sont ajoutées au rendu (patch_user_nodes)
         prefix = 'larp_'
 
         key = f"{prefix}menu_nodes_{self.request_language}_{self.site.pk}"
 
         if self.request.user.is_authenticated:
-            key += f"_{self.request.user.pk}_user"
+            if self.request.session.get('is_orga', False):
+                key += "_orga"
+            else:
+                key += "_member"
 
         if self.edit_or_preview:
             key += ':edit'
         else:
             key += ':public'
         return key
-    
+
+    def _build_nodes(self):
+        nodes = super()._build_nodes()
+        patch_user_nodes(nodes, self.request.user)
+        return nodes
+
     def apply_modifiers(self, nodes, namespace=None, root_id=None, post_cut=False, breadcrumb=False):
         if not post_cut:
             nodes = self._mark_selected(nodes)
@@ -97,19 +168,23 @@ class LarpMenu(CMSAttachMenu):
         """
         nodes = []
 
+        # Titre et URL propres à l'utilisateur : complétés au rendu
+        # (patch_user_nodes), le menu en cache étant partagé par rôle
         node = NavigationNode(
-                title=f"{request.user.username}",
-                url=reverse("larp:profile", kwargs={'user_id': request.user.pk}),
+                title="",
+                url="",
                 id=1,  # unique id for this node within the menu
+                attr={'user_title': True, 'user_profile_url': True},
             )
         node.level = 0
         nodes.append(node)
 
         node = NavigationNode(
                 title='Mon profil',
-                url=reverse("larp:profile", kwargs={'user_id': request.user.pk}),
+                url="",
                 id=2,  # unique id for this node within the menu
-                parent_id=1
+                parent_id=1,
+                attr={'user_profile_url': True},
             )
         nodes.append(node)
 
@@ -0,0 +1,186 @@
+"""
+Jeu de données synthétique (GN, opus, factions, joueurs, fiches...) pour
+les tests de budget de requêtes et les mesures de performance.
+Les objets sont créés par lots (bulk_create) : quelques dizaines de
+requêtes, quel que soit le volume demandé.
+"""
+from datetime import date
+import random
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import transaction
+
+from larp import models as larp_models
+from larp.signals import inscriptions_created
+from payments.analytics import purchase_article, purchases_created
+from payments.models import Purchase
+
+
+ACCESS_TYPE_WEIGHTS = [
+    (larp_models.AccessType.PJ, 70),
+    (larp_models.AccessType.PNJF, 20),
+    (larp_models.AccessType.PNJV, 10),
+]
+
+# Taille des lots d'INSERT : reste sous max_allowed_packet de MySQL
+# pour des dizaines de milliers de lignes
+BATCH_SIZE = 1000
+
+
+def with_pks(objs, queryset, key):
+    """
+    MySQL ne renvoie pas les clés primaires des objets créés par bulk_create :
+    on relit alors les objets, retrouvés par key (valeurs uniques)
+    """
+    if not objs or objs[0].pk is not None:
+        return objs
+    by_key = {key(o): o for o in queryset}
+    return [by_key[key(o)] for o in objs]
+
+
+@transaction.atomic
+def seed_dataset(seed=0, nb_larps=2, nb_opus=2, nb_factions=4, nb_players=100,
+                 nb_steps=5, nb_choices=4, prefix="seed", password=None):
+    """
+    Crée nb_larps GN de nb_opus opus et nb_factions factions chacun, et
+    nb_players joueurs inscrits à tous les opus (PJ, PNJF ou PNJV selon
+    ACCESS_TYPE_WEIGHTS), avec leurs fiches, leurs réponses au questionnaire
+    de background (nb_steps étapes de nb_choices choix) et leurs achats.
+    Un même seed donne toujours le même jeu de données.
+    Sans password, les comptes créés ne peuvent pas se connecter par mot de passe.
+
+    Retourne un dictionnaire avec les objets utiles aux tests :
+    'larps', 'orga' (orga de tous les GN), 'player' (un joueur PJ du premier GN)...
+    """
+    rand = random.Random(seed)
+    access_types = [a for a, _ in ACCESS_TYPE_WEIGHTS]
+    weights = [w for _, w in ACCESS_TYPE_WEIGHTS]
+
+    # Les GN passent par save() : le signal pre_save leur crée un groupe orga
+    larps = [larp_models.Larp.objects.create(name=f"{prefix} GN {i}", factions_name="Faction",
+                                             sheet_creation_opened=True)
+             for i in range(nb_larps)]
+    # Un seul hachage pour tous les comptes : make_password est volontairement lent
+    password_hash = make_password(password)
+    orga = User.objects.create_user(f"{prefix}-orga", email=f"{prefix}-orga@example.com")
+    orga.password = password_hash
+    orga.save(update_fields=['password'])
+    orga.groups.add(*[larp.orga_group for larp in larps])
+
+    opus_list = larp_models.Opus.objects.bulk_create([
+        larp_models.Opus(larp=larp, name=f"{larp.name} - Opus {i}", date=date(2020 + i, 6, 1))
+        for larp in larps for i in range(nb_opus)])
+    opus_list = with_pks(opus_list, larp_models.Opus.objects.filter(larp__in=larps), lambda o: o.name)
+    factions = larp_models.Faction.objects.bulk_create([
+        larp_models.Faction(larp=larp, name=f"{larp.name} - Faction {i}", orga=orga,
+                            orga_contact=f"{prefix}-orga@example.com")
+        for larp in larps for i in range(nb_factions)])
+    factions = with_pks(factions, larp_models.Faction.objects.filter(larp__in=larps), lambda f: f.name)
+    tickets = larp_models.Ticket.objects.bulk_create([
+        larp_models.Ticket(opus=opus, access_type=access_type, price=50 + 10 * i)
+        for opus in opus_list for i, access_type in enumerate(access_types)])
+    tickets = with_pks(tickets, larp_models.Ticket.objects.filter(opus__in=opus_list), lambda t: (t.opus_id, t.access_type))
+    ticket_by_key = {(t.opus_id, t.access_type): t for t in tickets}
+
+    # Questionnaire de background : le premier choix de chaque étape
+    # dépend du premier choix de l'étape précédente
+    steps = larp_models.BgStep.objects.bulk_create([
+        larp_models.BgStep(faction=faction, step=step, short_name=f"Étape {step}",
+                           question=f"Question {step} ?")
+        for faction in factions for step in range(1, nb_steps + 1)])
+    steps = with_pks(steps, larp_models.BgStep.objects.filter(faction__in=factions), lambda s: (s.faction_id, s.step))
+    choices = larp_models.BgChoice.objects.bulk_create([
+        larp_models.BgChoice(bg_step=bg_step, short_name=f"Choix {i}", text=f"Réponse {bg_step.step}-{i}")
+        for bg_step in steps for i in range(nb_choices)])
+    choices = with_pks(choices, larp_models.BgChoice.objects.filter(bg_step__in=steps), lambda c: (c.bg_step_id, c.short_name))
+    choices_by_step = {}
+    for choice in choices:
+        choices_by_step.setdefault(choice.bg_step_id, []).append(choice)
+    step_by_number = {(s.faction_id, s.step): s for s in steps}
+    with_requisit = []
+    for bg_step in steps:
+        previous = step_by_number.get((bg_step.faction_id, bg_step.step - 1))
+        if previous is not None:
+            choice = choices_by_step[bg_step.pk][0]
+            choice.requisit = choices_by_step[previous.pk][0]
+            with_requisit.append(choice)
+    larp_models.BgChoice.objects.bulk_update(with_requisit, ['requisit'])
+
+    users = User.objects.bulk_create([
+        User(username=f"{prefix}-player{i}", first_name=f"Prénom{i}", last_name=f"Nom{i}",
+             email=f"{prefix}-player{i}@example.com", password=password_hash)
+        for i in range(nb_players)], batch_size=BATCH_SIZE)
+    users = with_pks(users, User.objects.filter(username__startswith=f"{prefix}-player"), lambda u: u.username)
+    # bulk_create n'envoie pas post_save : on crée les profils ici
+    larp_models.Profile.objects.bulk_create([
+        larp_models.Profile(user=user, pseudos=user.username, birthdate=date(1990, 1, 1),
+                            xp_gn=larp_models.Profile.XP_GN.TWO.name, activated=True,
+                            emergency_contact="06 00 00 00 00")
+        for user in users], batch_size=BATCH_SIZE)
+
+    inscriptions = []
+    pj_infos = []
+    for larp in larps:
+        larp_factions = [f for f in factions if f.larp_id == larp.pk]
+        larp_opus = [o for o in opus_list if o.larp_id == larp.pk]
+        for user in users:
+            access_type = rand.choices(access_types, weights)[0]
+            faction = rand.choice(larp_factions) if access_type != larp_models.AccessType.PNJV else None
+            for opus in larp_opus:
+                inscriptions.append(larp_models.Inscription(
+                    user=user, opus=opus, access_type=access_type, faction=faction))
+            if faction is not None:
+                pj_infos.append(larp_models.PjInfos(
+                    user=user, larp=larp, faction=faction, name=f"Perso {user.username} ({larp.name})",
+                    skills="Escrime\nHerboristerie"))
+
+    inscriptions = larp_models.Inscription.objects.bulk_create(inscriptions, batch_size=BATCH_SIZE)
+    inscriptions = with_pks(inscriptions, larp_models.Inscription.objects.filter(opus__in=opus_list),
+                            lambda i: (i.user_id, i.opus_id))
+    # Fiches PNJ des PNJF/PNJV, invalidation des rosters et synthèse des ventes, comme les signaux
+    inscriptions_created(inscriptions)
+    pj_infos = larp_models.PjInfos.objects.bulk_create(pj_infos, batch_size=BATCH_SIZE)
+    pj_infos = with_pks(pj_infos, larp_models.PjInfos.objects.filter(larp__in=larps), lambda p: (p.user_id, p.larp_id))
+    # Un achat du billet correspondant par inscription
+    opus_by_id = {opus.pk: opus for opus in opus_list}
+    purchases = []
+    for inscription in inscriptions:
+        ticket = ticket_by_key[(inscription.opus_id, inscription.access_type)]
+        purchases.append(Purchase(
+            user_id=inscription.user_id, price=ticket.price, amount_cents=round(ticket.price * 100),
+            article=purchase_article(inscription.access_type, opus_by_id[inscription.opus_id].name),
+            ticket=ticket, opus_id=inscription.opus_id, access_type=inscription.access_type,
+            inscription=inscription))
+    Purchase.objects.bulk_create(purchases, batch_size=BATCH_SIZE)
+    purchases_created(purchases)
+
+    # Réponses au questionnaire : chaque personnage répond à une partie des étapes,
+    # en suivant les prérequis
+    steps_by_faction = {}
+    for bg_step in steps:
+        steps_by_faction.setdefault(bg_step.faction_id, []).append(bg_step)
+    answers = []
+    for character in pj_infos:
+        chosen = set()
+        for bg_step in steps_by_faction[character.faction_id][:rand.randint(0, nb_steps)]:
+            available = [c for c in choices_by_step[bg_step.pk] if c.requisit_id is None or c.requisit_id in chosen]
+            choice = rand.choice(available)
+            chosen.add(choice.pk)
+            answers.append(larp_models.Character_Bg_choices(
+                pjInfos=character, bgchoice=choice, step=bg_step.step, player_text="Texte libre"))
+    larp_models.Character_Bg_choices.objects.bulk_create(answers, batch_size=BATCH_SIZE)
+
+    first_larp_opus_ids = {o.pk for o in opus_list if o.larp_id == larps[0].pk}
+    first_larp_pj = next(i for i in inscriptions
+                         if i.access_type == larp_models.AccessType.PJ and i.opus_id in first_larp_opus_ids)
+    return {
+        'larps': larps,
+        'opus': opus_list,
+        'factions': factions,
+        'orga': orga,
+        'users': users,
+        'player': first_larp_pj.user,
+        'inscriptions': inscriptions,
+        'pj_infos': pj_infos,
+    }
@@ -1,5 +1,5 @@
 from django import forms
-from larp.utils import has_orga_permission
+from larp.utils import is_orga_for
 from django.utils.safestring import mark_safe
 from larp import models as larp_models
 from bootstrap_datepicker_plus.widgets import DatePickerInput
@@ -72,9 +72,9 @@ class PnjInfosForm(forms.ModelForm):
         }
 
     def __init__(self, *args, **kwargs):
-        larp = kwargs['instance'].larp
+        larp_id = kwargs['instance'].larp_id
         user = kwargs.pop('user')
-        orga = has_orga_permission(user, larp, False)
+        orga = is_orga_for(user, larp_id)
         super(PnjInfosForm, self).__init__(*args, **kwargs)
         if not orga:
             self.fields['info_orga'].disabled = True
@@ -96,7 +96,7 @@ class PjInfosForm(forms.ModelForm):
             larp = kwargs.pop('larp')
         user = kwargs.pop('user')
 
-        orga = has_orga_permission(user, larp, False)
+        orga = is_orga_for(user, larp.pk)
         already_existing = True if 'instance' in kwargs else False
         super(PjInfosForm, self).__init__(*args, **kwargs)
         if not orga:
@@ -0,0 +1,72 @@
+import tempfile
+import time
+
+from cms.toolbar.toolbar import CMSToolbar
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.sessions.backends.cache import SessionStore
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.template import Context, Template
+from django.db import connection
+from django.test import RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+
+
+MENU_TEMPLATE = Template(
+    "{% load menu_tags larp_menu %}"
+    "{% show_menu 0 100 100 100 'bootstrap5/menu.html' %}"
+    "{% show_larp_menu 0 100 100 100 'larp/bootstrap5/larp_menu.html' %}"
+)
+
+
+class Command(BaseCommand):
+    help = "Compare le temps de rendu des menus avec l'ancien cache en base et le cache à deux niveaux"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=200, help="Nombre de rendus par mesure")
+        parser.add_argument('--username', required=True, help="Utilisateur connecté pour lequel les menus sont rendus")
+
+    def make_request(self, user):
+        request = RequestFactory().get('/')
+        request.user = user
+        request.session = SessionStore()
+        request.session['is_orga'] = True
+        request.current_page = None
+        request.toolbar = CMSToolbar(request)
+        return request
+
+    def measure(self, count, request):
+        context = Context({'request': request})
+        # Premier rendu : remplit le cache
+        MENU_TEMPLATE.render(context)
+        with CaptureQueriesContext(connection) as queries:
+            MENU_TEMPLATE.render(Context({'request': request}))
+        start = time.perf_counter()
+        for _ in range(count):
+            MENU_TEMPLATE.render(Context({'request': request}))
+        return (time.perf_counter() - start) / count * 1000, len(queries)
+
+    def handle(self, *args, **options):
+        count = options['count']
+        user = User.objects.get(username=options['username'])
+        request = self.make_request(user)
+
+        database_cache = {
+            'default': {
+                'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+                'LOCATION': 'default_cache_table',
+            },
+        }
+        with override_settings(CACHES=database_cache):
+            call_command('createcachetable', verbosity=0)
+            before = self.measure(count, request)
+
+        with tempfile.TemporaryDirectory() as location:
+            tiered_cache = dict(settings.CACHES)
+            tiered_cache['shared'] = {**tiered_cache['shared'], 'LOCATION': location}
+            with override_settings(CACHES=tiered_cache):
+                after = self.measure(count, request)
+
+        self.stdout.write(f"DatabaseCache        : {before[0]:.2f} ms / rendu, {before[1]} requêtes SQL")
+        self.stdout.write(f"Cache à deux niveaux : {after[0]:.2f} ms / rendu, {after[1]} requêtes SQL")
@@ -0,0 +1,85 @@
+import time
+
+from django.core.management.base import BaseCommand
+from menus.base import NavigationNode
+
+from larp import cms_menus
+
+
+def legacy_link(nodes):
+    """Ancien rattachement de LarpNavExtender : boucle sur tous les nœuds pour chaque extension"""
+    home = next((n for n in nodes if n.attr.get("is_home", False)), None)
+    for node in nodes:
+        extenders = node.attr.get("navigation_extenders", None)
+        if extenders:
+            for ext in extenders:
+                for extnode in nodes:
+                    if extnode.namespace == ext and not extnode.parent_id:
+                        if node == home and not node.visible:
+                            extnode.parent_namespace = None
+                            extnode.parent = None
+                        else:
+                            extnode.parent_id = node.id
+                            extnode.parent_namespace = node.namespace
+                            extnode.parent = node
+                            node.children.append(extnode)
+    return nodes
+
+
+def synthetic_nodes(count):
+    """
+    Arbre de pages CMS dont une page sur dix est étendue par un menu
+    d'application (un namespace par page), les autres nœuds étant
+    répartis dans ces menus
+    """
+    nodes = []
+    nb_pages = max(count // 10, 1)
+    for i in range(nb_pages):
+        node = NavigationNode(f"Page {i}", f"/page-{i}/", i + 1,
+                              attr={'navigation_extenders': [f"Opus{i}"], 'is_home': i == 0})
+        node.namespace = 'CMSMenu'
+        nodes.append(node)
+    for i in range(count - nb_pages):
+        node = NavigationNode(f"Entrée {i}", f"/opus/{i}/", i + 1)
+        node.namespace = f"Opus{i % nb_pages}"
+        nodes.append(node)
+    return nodes
+
+
+class FakeRenderer:
+    def __init__(self, cache_key):
+        self.cache_key = cache_key
+
+
+class Command(BaseCommand):
+    help = "Mesure le rattachement des nœuds de menu (LarpNavExtender) sur des arbres de 100 à 5000 nœuds"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[100, 500, 1000, 2000, 5000])
+        parser.add_argument('--repeat', type=int, default=5, help="Nombre de mesures par taille")
+
+    def measure(self, repeat, size, link):
+        total = 0
+        for _ in range(repeat):
+            nodes = synthetic_nodes(size)
+            start = time.perf_counter()
+            link(nodes)
+            total += time.perf_counter() - start
+        return total / repeat * 1000
+
+    def handle(self, *args, **options):
+        repeat = options['repeat']
+        self.stdout.write(f"{'nœuds':>6} {'ancien':>10} {'indexé':>10} {'mémorisé':>10}")
+        for size in options['sizes']:
+            def indexed(nodes):
+                cms_menus._link_plans.clear()
+                cms_menus.LarpNavExtender(FakeRenderer('benchmark')).modify(None, nodes, None, None, False, False)
+
+            def memoized(nodes):
+                cms_menus.LarpNavExtender(FakeRenderer('benchmark')).modify(None, nodes, None, None, False, False)
+
+            legacy = self.measure(repeat, size, legacy_link)
+            after = self.measure(repeat, size, indexed)
+            memoized(synthetic_nodes(size))
+            cached = self.measure(repeat, size, memoized)
+            self.stdout.write(f"{size:>6} {legacy:>8.2f}ms {after:>8.2f}ms {cached:>8.2f}ms")
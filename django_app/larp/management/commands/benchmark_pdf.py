@@ -0,0 +1,72 @@
+from io import BytesIO
+import time
+
+from django.core.management.base import BaseCommand
+
+from larp import pdf
+
+
+class Command(BaseCommand):
+    help = "Mesure le temps de génération d'une fiche PDF, avec et sans les styles précalculés"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=50, help="Nombre de PDF générés par mesure")
+
+    def sample_sheet(self):
+        blocks = [
+            ('title', "Fiche Personnage: Benchmark"),
+            ('heading', "Contact Orga"),
+            ('indent', pdf.multiline("Orga faction\norga@example.com")),
+            ('heading', "Informations générales"),
+            ('table', [
+                ['Joueur :', "Jean Dupont"],
+                ["Nom d'utilisateur :", "jdupont"],
+                ['Faction', "Faction test"],
+                ['Préférence émotionnelle :', "Modéré"],
+            ]),
+            ('spacer', 20),
+            ('heading', "Compétences"),
+            ('text', "<b>Compétences actuelles:</b>"),
+            ('indent', pdf.multiline("Escrime\nHerboristerie\nCrochetage")),
+            ('spacer', 20),
+            ('heading', "Choix de background"),
+        ]
+        for step in range(1, 11):
+            blocks += [
+                ('text', f"<b>Étape {step}: </b><i>Question de background {step} ?</i>"),
+                ('spacer', 6),
+                ('text', "Réponse choisie par le joueur " * 5),
+                ('spacer', 15),
+            ]
+        return blocks
+
+    def measure(self, count, render):
+        start = time.perf_counter()
+        for _ in range(count):
+            render()
+        return (time.perf_counter() - start) / count * 1000
+
+    def handle(self, *args, **options):
+        count = options['count']
+        blocks = self.sample_sheet()
+
+        def legacy_render():
+            # Ancien fonctionnement : styles reconstruits et PDF recopié à chaque fiche
+            pdf.get_paragraph_styles.cache_clear()
+            buffer = BytesIO()
+            pdf.build_pdf(blocks, buffer)
+            buffer.getvalue()
+            buffer.close()
+
+        def render():
+            buffer = BytesIO()
+            pdf.build_pdf(blocks, buffer)
+            buffer.seek(0)
+
+        # Échauffement (imports et polices reportlab)
+        render()
+        before = self.measure(count, legacy_render)
+        after = self.measure(count, render)
+
+        self.stdout.write(f"Styles reconstruits à chaque fiche : {before:.2f} ms / PDF")
+        self.stdout.write(f"Styles précalculés                 : {after:.2f} ms / PDF")
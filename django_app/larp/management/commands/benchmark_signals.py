@@ -0,0 +1,75 @@
+import time
+
+from cms.models import CMSPlugin
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save
+from filer.models import Folder
+
+from larp import models as larp_models
+
+
+# Anciens récepteurs globaux (sans sender) : appelés pour toutes les
+# sauvegardes du site, quel que soit le modèle
+def legacy_on_pre_save(sender, instance, **kwargs):
+    if sender == larp_models.Larp and not instance.pk:
+        pass
+    if sender == larp_models.Inscription and not instance.pk:
+        pass
+
+
+def legacy_on_post_save(sender, instance, created, **kwargs):
+    if sender == User and created:
+        pass
+
+
+class Command(BaseCommand):
+    help = "Mesure le coût des signaux larp sur la sauvegarde de plugins CMS et de dossiers filer"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=500, help="Nombre d'objets sauvegardés par mesure")
+
+    def save_batch(self, count):
+        """Sauvegarde count plugins CMS et count dossiers filer, puis annule tout"""
+        with transaction.atomic():
+            start = time.perf_counter()
+            for i in range(count):
+                CMSPlugin(plugin_type='TextPlugin', language='fr', position=i).save()
+                Folder(name=f"benchmark-{i}").save()
+            elapsed = time.perf_counter() - start
+            transaction.set_rollback(True)
+        return elapsed / (2 * count) * 1000 * 1000
+
+    def dispatch_batch(self, count):
+        """Coût du seul envoi des signaux, sans accès à la base"""
+        plugin = CMSPlugin(plugin_type='TextPlugin', language='fr')
+        folder = Folder(name="benchmark")
+        start = time.perf_counter()
+        for _ in range(count):
+            for instance in (plugin, folder):
+                pre_save.send(sender=type(instance), instance=instance, raw=False, using='default', update_fields=None)
+                post_save.send(sender=type(instance), instance=instance, created=False, raw=False, using='default', update_fields=None)
+        return (time.perf_counter() - start) / (2 * count) * 1000 * 1000
+
+    def handle(self, *args, **options):
+        count = options['count']
+
+        # Échauffement (connexion, caches de requêtes)
+        self.save_batch(10)
+        after_save = self.save_batch(count)
+        after_dispatch = self.dispatch_batch(count * 10)
+
+        pre_save.connect(legacy_on_pre_save, dispatch_uid='benchmark_legacy_pre_save')
+        post_save.connect(legacy_on_post_save, dispatch_uid='benchmark_legacy_post_save')
+        try:
+            before_save = self.save_batch(count)
+            before_dispatch = self.dispatch_batch(count * 10)
+        finally:
+            pre_save.disconnect(dispatch_uid='benchmark_legacy_pre_save')
+            post_save.disconnect(dispatch_uid='benchmark_legacy_post_save')
+
+        self.stdout.write(f"Sauvegarde, récepteurs globaux      : {before_save:.1f} µs / objet")
+        self.stdout.write(f"Sauvegarde, récepteurs par sender   : {after_save:.1f} µs / objet")
+        self.stdout.write(f"Signaux seuls, récepteurs globaux   : {before_dispatch:.2f} µs / objet")
+        self.stdout.write(f"Signaux seuls, récepteurs par sender : {after_dispatch:.2f} µs / objet")
@@ -0,0 +1,41 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from larp.dataset import seed_dataset
+
+
+class Command(BaseCommand):
+    help = ("Génère un jeu de données synthétique et reproductible (GN, opus, factions, questionnaires, "
+            "joueurs, inscriptions, fiches, achats) pour les mesures de performance")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=0, help="Graine du générateur : même graine, même jeu de données")
+        parser.add_argument('--larps', type=int, default=3, help="Nombre de GN")
+        parser.add_argument('--opus', type=int, default=3, help="Nombre d'opus par GN")
+        parser.add_argument('--factions', type=int, default=6, help="Nombre de factions par GN")
+        parser.add_argument('--players', type=int, default=2000, help="Nombre de joueurs, inscrits à tous les opus")
+        parser.add_argument('--steps', type=int, default=8, help="Nombre d'étapes du questionnaire de chaque faction")
+        parser.add_argument('--choices', type=int, default=4, help="Nombre de choix par étape")
+        parser.add_argument('--prefix', default="seed", help="Préfixe des noms de GN et d'utilisateurs")
+        parser.add_argument('--password', help="Mot de passe de tous les comptes créés (par défaut, aucune connexion possible)")
+
+    def handle(self, *args, **options):
+        prefix = options['prefix']
+        if User.objects.filter(username__startswith=f"{prefix}-").exists():
+            raise CommandError(f"Des utilisateurs « {prefix}-… » existent déjà : choisissez un autre --prefix")
+
+        start = time.perf_counter()
+        dataset = seed_dataset(seed=options['seed'], nb_larps=options['larps'], nb_opus=options['opus'],
+                               nb_factions=options['factions'], nb_players=options['players'],
+                               nb_steps=options['steps'], nb_choices=options['choices'],
+                               prefix=prefix, password=options['password'])
+        elapsed = time.perf_counter() - start
+
+        self.stdout.write(f"{len(dataset['larps'])} GN, {len(dataset['opus'])} opus, {len(dataset['factions'])} factions")
+        self.stdout.write(f"{len(dataset['users'])} joueurs, {len(dataset['inscriptions'])} inscriptions, "
+                          f"{len(dataset['pj_infos'])} fiches PJ")
+        self.stdout.write(f"Orga de tous les GN : {dataset['orga'].username}, "
+                          f"joueur PJ : {dataset['player'].username}")
+        self.stdout.write(self.style.SUCCESS(f"Jeu de données créé en {elapsed:.1f} s"))
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.2 on 2026-10-18 08:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('larp', '0019_larp_sheet_creation_opened'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='inscription',
+            index=models.Index(fields=['opus', 'access_type', 'faction', 'user'], name='inscription_opus_type_faction'),
+        ),
+        migrations.AddIndex(
+            model_name='inscription',
+            index=models.Index(fields=['user', 'created_at'], name='inscription_user_created'),
+        ),
+        migrations.AddIndex(
+            model_name='pnjinfos',
+            index=models.Index(fields=['user', 'larp'], name='pnjinfos_user_larp'),
+        ),
+    ]
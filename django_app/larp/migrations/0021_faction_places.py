@@ -0,0 +1,18 @@
+# Generated by Django 5.2.2 on 2026-10-18 08:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('larp', '0020_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='faction',
+            name='places',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='Nombre de places PJ'),
+        ),
+    ]
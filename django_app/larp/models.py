@@ -99,6 +99,7 @@ class Faction(models.Model):
     name    = models.CharField(max_length=70, unique=True, verbose_name="Nom")
     orga    = models.ForeignKey(User, blank=True, null=True, on_delete=models.DO_NOTHING)
     orga_contact = models.TextField(default="", blank=True, verbose_name="Info de contact orga")
+    places  = models.PositiveIntegerField(null=True, blank=True, verbose_name="Nombre de places PJ")
 
 
     def __str__(self):
@@ -109,6 +110,10 @@ class Faction(models.Model):
 class PnjInfos(models.Model):
     class Meta:
         verbose_name = "Infos PNJ"
+        indexes = [
+            # Fiches PNJ d'un utilisateur pour un GN (roster, mes inscriptions)
+            models.Index(fields=["user", "larp"], name="pnjinfos_user_larp"),
+        ]
 
     class TIME_PREFERENCE(Enum):
         EARLY = "Première tâche 6h30"
@@ -172,6 +177,13 @@ class Inscription(models.Model):
         constraints = [
             models.UniqueConstraint(fields=["user", "opus"], name="unique_inscription")
         ]
+        indexes = [
+            # Roster d'un opus : inscriptions par type et faction, user inclus
+            # pour que la liste des joueurs soit lue dans l'index seul
+            models.Index(fields=["opus", "access_type", "faction", "user"], name="inscription_opus_type_faction"),
+            # Dernière inscription d'un utilisateur (à un GN) sans tri
+            models.Index(fields=["user", "created_at"], name="inscription_user_created"),
+        ]
 
     user = models.ForeignKey(User, on_delete=models.CASCADE, verbose_name="Utilisateur")
     opus = models.ForeignKey(Opus, on_delete=models.CASCADE, verbose_name="Opus")
@@ -0,0 +1,380 @@
+"""
+Une fiche PDF est décrite par une liste de blocs (type, valeur) :
+    ('title', texte), ('heading', texte), ('text', texte), ('indent', texte),
+    ('spacer', hauteur), ('table', lignes)
+Ces blocs ne contiennent que des données simples, ce qui permet de générer
+les PDF dans d'autres processus (export ZIP des fiches d'un opus).
+"""
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+import functools
+import hashlib
+import json
+import multiprocessing
+import os
+import threading
+import zipfile
+
+from django.core.cache import cache
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_cache_control
+from django.utils.http import parse_etags
+
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
+from reportlab.lib.units import mm
+
+
+# Nombre de processus pour l'export des fiches (None : un par coeur)
+PDF_EXPORT_MAX_WORKERS = None
+
+# À incrémenter quand la mise en page change, pour invalider les PDF en cache
+PDF_LAYOUT_VERSION = 1
+PDF_CACHE_TIMEOUT = 60 * 60 * 24 * 30
+
+
+def multiline(text):
+    return text.replace('\n', '<br/>')
+
+
+# Mise en page commune à toutes les fiches
+PAGE_LAYOUT = {
+    'pagesize': A4,
+    'rightMargin': 72,
+    'leftMargin': 72,
+    'topMargin': 72,
+    'bottomMargin': 18,
+}
+TABLE_COL_WIDTHS = [60*mm, 100*mm]
+
+PDF_TABLE_STYLE = TableStyle([
+        ('BACKGROUND', (0, 0), (0, -1), colors.lightgrey),
+        ('TEXTCOLOR', (0, 0), (-1, -1), colors.black),
+        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+        ('FONTNAME', (0, 0), (-1, -1), 'Helvetica'),
+        ('FONTSIZE', (0, 0), (-1, -1), 10),
+        ('BOTTOMPADDING', (0, 0), (-1, -1), 12),
+        ('BACKGROUND', (1, 0), (1, -1), colors.beige),
+        ('GRID', (0, 0), (-1, -1), 1, colors.black)
+    ])
+
+
+@functools.cache
+def get_paragraph_styles():
+    """Styles des paragraphes par type de bloc, construits une fois par processus"""
+    generic_styles = getSampleStyleSheet()
+    title_style = ParagraphStyle(
+        'CustomTitle',
+        parent=generic_styles['Heading1'],
+        fontSize=18,
+        spaceAfter=30,
+        alignment=1,  # Center alignment
+    )
+    heading_style = ParagraphStyle(
+        'CustomHeading',
+        parent=generic_styles['Heading2'],
+        fontSize=14,
+        spaceAfter=12,
+        spaceBefore=20,
+    )
+    indent_style = ParagraphStyle(
+        'CustomIndentedParagraph',
+        parent=generic_styles['Normal'],
+        leftIndent=8
+    )
+    return {
+        'title': title_style,
+        'heading': heading_style,
+        'text': generic_styles['Normal'],
+        'indent': indent_style,
+    }
+
+
+def build_pdf(blocks, buffer):
+    """Écrit dans buffer le PDF d'une fiche décrite par ses blocs"""
+    doc = SimpleDocTemplate(buffer, **PAGE_LAYOUT)
+    paragraph_styles = get_paragraph_styles()
+
+    story = []
+    for kind, value in blocks:
+        if kind == 'spacer':
+            story.append(Spacer(1, value))
+        elif kind == 'table':
+            table = Table(value, colWidths=TABLE_COL_WIDTHS)
+            table.setStyle(PDF_TABLE_STYLE)
+            story.append(table)
+        else:
+            story.append(Paragraph(value, paragraph_styles[kind]))
+
+    doc.build(story)
+
+
+def render_pdf(blocks) -> bytes:
+    buffer = BytesIO()
+    build_pdf(blocks, buffer)
+    return buffer.getvalue()
+
+
+def sheet_digest(blocks) -> str:
+    """
+    Empreinte d'une fiche. Les blocs reprennent toutes les données sources
+    (fiche, choix de BG, contact orga, profil, triggers...) : l'empreinte
+    change dès que l'une d'elles est modifiée.
+    """
+    data = json.dumps([PDF_LAYOUT_VERSION, blocks], ensure_ascii=False)
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+def cached_pdf_buffer(blocks, digest=None) -> BytesIO:
+    key = f"larp_pdf_{digest or sheet_digest(blocks)}"
+    pdf_content = cache.get(key)
+    if pdf_content is not None:
+        return BytesIO(pdf_content)
+
+    buffer = BytesIO()
+    build_pdf(blocks, buffer)
+    cache.set(key, buffer.getvalue(), PDF_CACHE_TIMEOUT)
+    buffer.seek(0)
+    return buffer
+
+
+def pdf_response(request, blocks, filename) -> HttpResponse:
+    """Réponse PDF servie depuis le cache, avec gestion de l'ETag (304 Not Modified)"""
+    digest = sheet_digest(blocks)
+    etag = f'"{digest}"'
+    if etag in parse_etags(request.headers.get('If-None-Match', '')):
+        response = HttpResponseNotModified()
+    else:
+        response = FileResponse(cached_pdf_buffer(blocks, digest),
+                                as_attachment=True,
+                                filename=filename,
+                                content_type='application/pdf')
+    response['ETag'] = etag
+    # Fiches personnelles : le navigateur peut garder le PDF mais doit le revalider
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def pj_sheet(pj_infos, bg_choices):
+    """pj_infos doit avoir faction, larp et user chargés (select_related)"""
+    blocks = [
+        ('title', f"Fiche Personnage: {pj_infos.name}"),
+        # Contact Orga
+        ('heading', "Contact Orga"),
+        ('indent', multiline(pj_infos.faction.orga_contact)),
+        # General Information
+        ('heading', "Informations générales"),
+        ('table', [
+            ['Joueur :', f"{pj_infos.user.first_name} {pj_infos.user.last_name}"],
+            ["Nom d'utilisateur :", f"{pj_infos.user.username}"],
+            [pj_infos.larp.factions_name, pj_infos.faction.name],
+            ['Préférence émotionnelle :', pj_infos.get_emotions_display()],
+        ]),
+        ('spacer', 20),
+        # Skills
+        ('heading', "Compétences"),
+        ('text', "<b>Compétences actuelles:</b>"),
+        ('indent', multiline(pj_infos.skills)),
+    ]
+
+    if pj_infos.last_learned:
+        blocks.append(('spacer', 12))
+        blocks.append(('text', f"<b>Dernière compétence apprise:</b> {pj_infos.last_learned}"))
+
+    blocks.append(('spacer', 20))
+
+    # Objectives
+    if pj_infos.objectives:
+        blocks.append(('heading', "Objectifs de jeu"))
+        blocks.append(('indent', multiline(pj_infos.objectives)))
+        blocks.append(('spacer', 20))
+
+    # Background Choices
+    if bg_choices:
+        blocks.append(('heading', "Choix de background"))
+
+        for bg_choice in bg_choices:
+            blocks.append(('text', f"<b>Étape {bg_choice.step}: </b><i>{bg_choice.bgchoice.bg_step.question}</i>"))
+            blocks.append(('spacer', 6))
+
+            choice_text = bg_choice.bgchoice.text or bg_choice.bgchoice.short_name
+            blocks.append(('text', f"{choice_text}"))
+
+            if bg_choice.player_text:
+                blocks.append(('spacer', 6))
+                blocks.append(('text', "<b>Commentaire du joueur:</b>"))
+                blocks.append(('indent', multiline(bg_choice.player_text)))
+
+            blocks.append(('spacer', 15))
+
+    return blocks
+
+
+def pnj_sheet(pnj_infos, inscription):
+    """pnj_infos doit avoir larp et user chargés, inscription sa faction"""
+    # Sans faction attribuée, le contact est celui des PNJ volants
+    if inscription.access_type == 'PNJV' or inscription.faction is None:
+        infos_orga = pnj_infos.larp.pnjv_orga_contact
+    else:
+        infos_orga = inscription.faction.orga_contact
+
+    blocks = [
+        ('title', f"Fiche PNJ: {pnj_infos.user.first_name} {pnj_infos.user.last_name}"),
+        # Contact Orga
+        ('heading', "Contact Orga"),
+        ('indent', multiline(infos_orga)),
+        # General Information
+        ('heading', "Informations générales"),
+        ('table', [
+            ['Joueur :', f"{pnj_infos.user.first_name} {pnj_infos.user.last_name}"],
+            ["Nom d'utilisateur :", f"{pnj_infos.user.username}"],
+            ['Préférence horaire :', pnj_infos.get_prefered_time_display() if pnj_infos.prefered_time else 'Non spécifié'],
+            ['Action de nuit :', 'Oui' if pnj_infos.nigth_action else 'Non' if pnj_infos.nigth_action is not None else 'Non spécifié'],
+        ]),
+        ('spacer', 20),
+        # Preferences
+        ('heading', "Préférences de jeu"),
+        ('table', [
+            ['Logistique (0) vs Rôles (5) :', pnj_infos.get_logistic_or_role_display() if pnj_infos.logistic_or_role is not None else 'Non spécifié'],
+            ['Niveau d\'importance (0-5) :', pnj_infos.get_importance_display() if pnj_infos.importance is not None else 'Non spécifié'],
+        ]),
+        ('spacer', 20),
+    ]
+
+    # Talents
+    if pnj_infos.talent:
+        blocks.append(('heading', "Talents particuliers"))
+        blocks.append(('indent', multiline(pnj_infos.talent)))
+        blocks.append(('spacer', 20))
+
+    # Organizer Information
+    if pnj_infos.info_orga:
+        blocks.append(('heading', "Informations pour l'organisation"))
+        blocks.append(('indent', multiline(pnj_infos.info_orga)))
+        blocks.append(('spacer', 20))
+
+    return blocks
+
+
+def profile_sheet(user, profile, triggers):
+    birthdate = profile.birthdate.strftime("%d / %m / %Y")
+    xp_gn = profile.XP_GN[profile.xp_gn].value
+
+    return [
+        ('title', f"Fiche Sécurité : {user.first_name} {user.last_name}"),
+        # General Information
+        ('heading', "Profil utilisateur"),
+        ('text', f"<b>Date de naissance : </b> {birthdate}"),
+        ('spacer', 12),
+        ('text', "<b>Pseudo sur les réseaux sociaux : </b>"),
+        ('indent', multiline(profile.pseudos)),
+        ('spacer', 20),
+        # Security informations
+        ('heading', "Informations de sécurité"),
+        ('text', "<b>Régime alimentaire, allergie ou autre élément de santé : </b>"),
+        ('indent', multiline(profile.food)),
+        ('spacer', 12),
+        ('text', "<b>Personnes avec qui je ne souhaite pas jouer : </b>"),
+        ('indent', multiline(profile.unwanted_people)),
+        ('spacer', 12),
+        ('text', f"<b>Expérience GNistique : </b> {xp_gn}"),
+        ('spacer', 12),
+        ('text', "<b>Phobies : </b>"),
+        ('indent', multiline(profile.fears)),
+        ('spacer', 12),
+        ('text', "<b>Désirs de non jeu / triggers : </b>"),
+        ('indent', '<br/>'.join(str(t) for t in triggers)),
+        ('spacer', 20),
+        ('heading', "Contacts d'urgence"),
+        ('indent', multiline(profile.emergency_contact)),
+    ]
+
+
+_pdf_executor = None
+_pdf_executor_lock = threading.Lock()
+
+
+def get_pdf_executor():
+    """
+    Pool de processus de l'export des fiches, partagé par les requêtes du worker.
+    Ses processus sont lancés par « spawn » : ils ne reçoivent pas de copie des
+    connexions à la base ni des threads du serveur, ce que ferait un fork.
+    """
+    global _pdf_executor
+    with _pdf_executor_lock:
+        if _pdf_executor is None:
+            _pdf_executor = ProcessPoolExecutor(max_workers=PDF_EXPORT_MAX_WORKERS or os.cpu_count() or 1,
+                                                mp_context=multiprocessing.get_context('spawn'))
+        return _pdf_executor
+
+
+def discard_pdf_executor(executor):
+    """
+    Oublie un pool cassé (processus tué, par exemple faute de mémoire) :
+    l'export suivant en crée un nouveau au lieu d'échouer jusqu'au redémarrage
+    """
+    global _pdf_executor
+    with _pdf_executor_lock:
+        # Une autre requête l'a peut-être déjà remplacé
+        if _pdf_executor is executor:
+            _pdf_executor = None
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+def render_pdfs(sheets):
+    """
+    Génère en parallèle les PDF d'un itérable de (nom de fichier, blocs).
+    Les PDF sont renvoyés dans l'ordre, et seule une fenêtre de quelques
+    fiches par processus est gardée en mémoire.
+    """
+    executor = get_pdf_executor()
+    window = (PDF_EXPORT_MAX_WORKERS or os.cpu_count() or 1) * 4
+    pending = deque()
+    try:
+        for filename, blocks in sheets:
+            pending.append((filename, executor.submit(render_pdf, blocks)))
+            if len(pending) >= window:
+                filename, future = pending.popleft()
+                yield filename, future.result()
+        while pending:
+            filename, future = pending.popleft()
+            yield filename, future.result()
+    except BrokenProcessPool:
+        discard_pdf_executor(executor)
+        raise
+    finally:
+        # Téléchargement interrompu : les fiches pas encore commencées sont abandonnées
+        for _, future in pending:
+            future.cancel()
+
+
+class _ZipStream:
+    """Sortie non seekable de zipfile, vidée après chaque fichier ajouté"""
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def pop(self) -> bytes:
+        data = b''.join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def stream_zip(files):
+    """Écrit au fil de l'eau un ZIP à partir d'un itérable de (nom, contenu)"""
+    stream = _ZipStream()
+    with zipfile.ZipFile(stream, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for filename, content in files:
+            archive.writestr(filename, content)
+            yield stream.pop()
+    yield stream.pop()
@@ -0,0 +1,165 @@
+from collections import defaultdict
+import uuid
+
+from django.core.cache import cache
+from django.db.models import Q
+from larp import models as larp_models
+
+
+def build_roster(larp: larp_models.Larp, opus: larp_models.Opus, factions, with_pnjv=True):
+    """
+    Construit la vue orga d'un opus (PJ, PNJF par faction et PNJV) en un
+    nombre fixe de requêtes, quel que soit le nombre de factions ou de joueurs.
+    Avec with_pnjv=False, les PNJV ne sont pas chargés (pnjv_list est vide).
+
+    Retourne un dictionnaire {'faction_data': [...], 'pnjv_list': [...]}
+    avec la même structure que celle attendue par larp/orga/orga_gn.html
+    """
+    factions = list(factions)
+    faction_ids = [f.pk for f in factions]
+    played_types = [larp_models.AccessType.PJ, larp_models.AccessType.PNJF]
+
+    # 1 requête : les inscriptions de l'opus pour les factions traitées (et les PNJV)
+    inscription_filter = Q(faction_id__in=faction_ids)
+    if with_pnjv:
+        inscription_filter |= Q(access_type=larp_models.AccessType.PNJV)
+    inscriptions = list(larp_models.Inscription.objects
+                        .filter(inscription_filter, opus=opus)
+                        .select_related('user')
+                        .order_by('user_id'))
+
+    pj_users = defaultdict(list)
+    pnjf_users = defaultdict(list)
+    pnjv_user_ids = []
+    for inscription in inscriptions:
+        if inscription.access_type == larp_models.AccessType.PNJV:
+            pnjv_user_ids.append(inscription.user_id)
+        elif inscription.faction_id in faction_ids:
+            if inscription.access_type == larp_models.AccessType.PJ:
+                pj_users[inscription.faction_id].append(inscription.user)
+            elif inscription.access_type == larp_models.AccessType.PNJF:
+                pnjf_users[inscription.faction_id].append(inscription.user)
+
+    # 1 requête : les fiches PJ des joueurs PJ/PNJF des factions traitées
+    pj_infos_by_key = defaultdict(list)
+    if pj_users or pnjf_users:
+        played_user_ids = larp_models.Inscription.objects.filter(
+            opus=opus,
+            faction_id__in=faction_ids,
+            access_type__in=played_types).values('user_id')
+        pj_infos_qs = larp_models.PjInfos.objects.filter(
+            larp=larp,
+            faction_id__in=faction_ids,
+            user_id__in=played_user_ids).order_by('pk')
+        for pj_infos in pj_infos_qs:
+            pj_infos_by_key[(pj_infos.faction_id, pj_infos.user_id)].append(pj_infos)
+
+    # 1 requête : les fiches PNJ des PNJF et des PNJV
+    pnj_infos_by_user = {}
+    pnjf_user_ids = [u.pk for users in pnjf_users.values() for u in users]
+    if pnjf_user_ids or pnjv_user_ids:
+        pnj_infos_qs = larp_models.PnjInfos.objects.filter(
+            larp=larp,
+            user_id__in=pnjf_user_ids + pnjv_user_ids
+        ).select_related('user').order_by('user__last_name', 'user__first_name')
+        for pnj_infos in pnj_infos_qs:
+            pnj_infos_by_user[pnj_infos.user_id] = pnj_infos
+
+    faction_data = []
+    for faction in factions:
+        pj_ordered_list = []
+        for user in pj_users[faction.pk]:
+            pj_infos = pj_infos_by_key[(faction.pk, user.pk)]
+            pj_ordered_list.append({
+                'user': user,
+                'pj1': pj_infos[0] if len(pj_infos) > 0 else None,
+                'pj2': pj_infos[1] if len(pj_infos) > 1 else None
+            })
+
+        pnjf_list = []
+        for user in pnjf_users[faction.pk]:
+            pnj_infos = pnj_infos_by_user.get(user.pk)
+            if pnj_infos is None:
+                # On ignore les PNJF sans fiche PNJ
+                continue
+            pnjf_list.append({
+                'user': user,
+                'pj_infos': pj_infos_by_key[(faction.pk, user.pk)],
+                'pnj_infos': pnj_infos
+            })
+
+        faction_data.append({
+            'faction': faction,
+            'pj_list': pj_ordered_list,
+            'pnjf_list': pnjf_list
+        })
+
+    # PNJV : les PNJ volants n'ont pas de faction
+    pnjv_user_ids = set(pnjv_user_ids)
+    pnjv_list = [p for p in pnj_infos_by_user.values() if p.user_id in pnjv_user_ids]
+
+    return {
+        'faction_data': faction_data,
+        'pnjv_list': pnjv_list,
+    }
+
+
+ROSTER_CACHE_TIMEOUT = 60 * 60
+
+
+def roster_version_key(scope, pk):
+    """scope vaut 'larp' (fiches et factions du GN) ou 'opus' (inscriptions de l'opus)"""
+    return f"larp_roster_version_{scope}_{pk}"
+
+
+def roster_version(larp_id, opus_id):
+    """
+    Version des rosters d'un opus : elle change dès qu'une version de son GN
+    ou de l'opus est renouvelée. Une version absente (jamais créée ou sortie
+    du cache) est recréée : les rosters antérieurs ne sont alors plus lus.
+    """
+    keys = [roster_version_key('larp', larp_id), roster_version_key('opus', opus_id)]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            version = uuid.uuid4().hex
+            versions[key] = version if cache.add(key, version, None) else cache.get(key)
+    return "-".join(versions[key] for key in keys)
+
+
+def roster_cache_key(larp_id, opus_id, faction_id):
+    """faction_id vaut 'pnjv' pour la liste des PNJ volants"""
+    return f"larp_roster_{larp_id}_{opus_id}_{faction_id}_{roster_version(larp_id, opus_id)}"
+
+
+def get_faction_roster(larp: larp_models.Larp, opus: larp_models.Opus, faction: larp_models.Faction):
+    key = roster_cache_key(larp.pk, opus.pk, faction.pk)
+    faction_info = cache.get(key)
+    if faction_info is None:
+        faction_info = build_roster(larp, opus, [faction], with_pnjv=False)['faction_data'][0]
+        cache.set(key, faction_info, ROSTER_CACHE_TIMEOUT)
+    return faction_info
+
+
+def get_pnjv_roster(larp: larp_models.Larp, opus: larp_models.Opus):
+    key = roster_cache_key(larp.pk, opus.pk, 'pnjv')
+    pnjv_list = cache.get(key)
+    if pnjv_list is None:
+        pnjv_list = build_roster(larp, opus, [])['pnjv_list']
+        cache.set(key, pnjv_list, ROSTER_CACHE_TIMEOUT)
+    return pnjv_list
+
+
+def invalidate_roster(larp_id):
+    """
+    Renouvelle la version des rosters (opus x faction, et PNJV) d'un GN, sans
+    requête : les rosters de l'ancienne version expirent d'eux-mêmes.
+    Appelé par les signaux dès qu'une PjInfos, PnjInfos ou Faction de ce GN
+    est modifiée ou supprimée.
+    """
+    cache.set(roster_version_key('larp', larp_id), uuid.uuid4().hex, None)
+
+
+def invalidate_opus_roster(opus_id):
+    """Comme invalidate_roster, pour les rosters d'un seul opus (modification d'une Inscription)"""
+    cache.set(roster_version_key('opus', opus_id), uuid.uuid4().hex, None)
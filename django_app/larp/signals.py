@@ -1,47 +1,151 @@
-from django.db.models.signals import pre_save, post_save
+from django.db.models.signals import pre_save, post_init, post_save, post_delete, m2m_changed
 from django.contrib.auth.signals import user_logged_in
-from django.dispatch import receiver
+from django.dispatch import receiver, Signal
 from larp import models as larp_models
 from django.contrib.auth.models import Group, User
+from larp.roster import invalidate_opus_roster, invalidate_roster
+from larp.bg_graph import invalidate_bg_graph
+from larp.utils import clear_orga_larp_ids, get_orga_larp_ids
 
 
-@receiver(pre_save)
-def on_pre_save(sender, instance, **kwargs):
+PNJ_ACCESS_TYPES = (larp_models.AccessType.PNJF, larp_models.AccessType.PNJV)
+# Champs d'une inscription mémorisés à son chargement (remember_loaded_inscription)
+LOADED_FIELDS = ('opus_id', 'access_type', 'faction_id', 'created_at')
+
+
+def create_missing_pnj_infos(inscriptions):
+    """
+    Si l'inscription est pour un PNJ, on lui crée une fiche PNJ pour ce GN.
+    Fonctionne par lot, en un nombre fixe de requêtes.
+    """
+    inscriptions = [i for i in inscriptions if i.access_type in PNJ_ACCESS_TYPES]
+    if not inscriptions:
+        return
+    larp_by_opus = dict(larp_models.Opus.objects.
+                        filter(pk__in={i.opus_id for i in inscriptions}).
+                        values_list('pk', 'larp_id'))
+    wanted = {(i.user_id, larp_by_opus[i.opus_id]) for i in inscriptions}
+    existing = set(larp_models.PnjInfos.objects.
+                    filter(user_id__in={user_id for user_id, _ in wanted},
+                           larp_id__in={larp_id for _, larp_id in wanted}).
+                    values_list('user_id', 'larp_id'))
+    larp_models.PnjInfos.objects.bulk_create([
+        larp_models.PnjInfos(user_id=user_id, larp_id=larp_id)
+        for user_id, larp_id in wanted - existing
+    ])
+
+
+# Envoyé par inscriptions_created (argument inscriptions) : les autres applications
+# (synthèse des ventes de payments) y traitent le lot comme post_save une inscription
+inscriptions_bulk_created = Signal()
+
+
+def inscriptions_created(inscriptions):
+    """
+    bulk_create n'envoie pas les signaux post_save : à appeler après un
+    bulk_create d'inscriptions pour appliquer les mêmes traitements
+    (fiches PNJ, invalidation du roster orga, synthèse des ventes)
+    """
+    create_missing_pnj_infos(inscriptions)
+    for opus_id in {i.opus_id for i in inscriptions}:
+        invalidate_opus_roster(opus_id)
+    inscriptions_bulk_created.send(sender=larp_models.Inscription, inscriptions=inscriptions)
+
+
+# Les récepteurs sont limités à leur modèle (sender) : les autres
+# sauvegardes du site (plugins CMS, filer, sessions...) ne passent pas par ici
+@receiver(pre_save, sender=larp_models.Larp)
+def create_orga_group(sender, instance, **kwargs):
     # On crée un groupe d'orga pour chaque GN créée
-    if sender == larp_models.Larp and not instance.pk:
+    if not instance.pk:
         orga_group = Group.objects.create(name=f"Orgas - {instance.name}")
         instance.orga_group = orga_group
 
-    # Si l'inscription est pour un PNJ, on lui crée une fiche PNJ pour ce GN
-    if sender == larp_models.Inscription and not instance.pk:
-        access_type = instance.access_type
-        if access_type == larp_models.AccessType.PNJF or \
-            access_type == larp_models.AccessType.PNJV:
-            defaults = {
-                'user': instance.user,
-                'larp': instance.opus.larp
-            }
-            larp_models.PnjInfos.objects.get_or_create(
-                defaults=defaults,
-                user=instance.user,
-                larp=instance.opus.larp)
-            
-
-@receiver(post_save)
-def on_post_save(sender, instance, created, **kwargs):
-    if sender == User and created:
-        profile = larp_models.Profile.objects.create(user=instance)
-        profile.save()
-    
-
-        
+
+@receiver(post_save, sender=larp_models.Inscription)
+def create_pnj_infos(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        create_missing_pnj_infos([instance])
+
+
+@receiver(post_save, sender=User)
+def create_profile(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        larp_models.Profile.objects.create(user=instance)
+
+
+def inscription_values(instance):
+    return {name: getattr(instance, name) for name in LOADED_FIELDS}
+
+
+# L'état d'une inscription lu en base est mémorisé à son chargement : à la
+# sauvegarde, _previous_values donne l'ancien opus (roster) et l'ancienne clé de
+# synthèse des ventes (payments) sans relire l'inscription
+@receiver(post_init, sender=larp_models.Inscription)
+def remember_loaded_inscription(sender, instance, **kwargs):
+    loaded = instance.pk is not None and all(name in instance.__dict__ for name in LOADED_FIELDS)
+    instance._loaded_values = inscription_values(instance) if loaded else None
+
+
+@receiver(pre_save, sender=larp_models.Inscription)
+def remember_previous_inscription(sender, instance, raw=False, **kwargs):
+    previous = getattr(instance, '_loaded_values', None)
+    if previous is None and instance.pk is not None and not raw:
+        # Inscription construite à la main ou chargée avec des champs différés
+        previous = larp_models.Inscription.objects.filter(pk=instance.pk).values(*LOADED_FIELDS).first()
+    instance._previous_values = previous
+
+
+@receiver(post_save, sender=larp_models.Inscription)
+def remember_saved_inscription(sender, instance, **kwargs):
+    # Les récepteurs post_save lisent _previous_values : l'ordre n'importe pas
+    instance._loaded_values = inscription_values(instance)
+
+
+# Le roster orga mis en cache (larp.roster) est invalidé à chaque
+# modification d'une inscription, fiche ou faction du GN
+@receiver([post_save, post_delete], sender=larp_models.Inscription)
+def invalidate_roster_on_inscription(sender, instance, **kwargs):
+    invalidate_opus_roster(instance.opus_id)
+    previous = getattr(instance, '_previous_values', None)
+    if previous and previous['opus_id'] != instance.opus_id:
+        invalidate_opus_roster(previous['opus_id'])
+
+
+@receiver([post_save, post_delete], sender=larp_models.PjInfos)
+@receiver([post_save, post_delete], sender=larp_models.PnjInfos)
+@receiver([post_save, post_delete], sender=larp_models.Faction)
+def invalidate_roster_on_larp_change(sender, instance, **kwargs):
+    invalidate_roster(instance.larp_id)
+
+
+# Le questionnaire de background compilé (larp.bg_graph) est invalidé
+# à chaque modification d'une étape ou d'un choix de la faction
+@receiver([post_save, post_delete], sender=larp_models.BgStep)
+def invalidate_bg_graph_on_step_change(sender, instance, **kwargs):
+    invalidate_bg_graph(instance.faction_id)
+
+
+@receiver([post_save, post_delete], sender=larp_models.BgChoice)
+def invalidate_bg_graph_on_choice_change(sender, instance, **kwargs):
+    # Lors d'une suppression en cascade, l'étape peut déjà être supprimée :
+    # son propre signal invalide alors le questionnaire
+    faction_id = larp_models.BgStep.objects.filter(pk=instance.bg_step_id).values_list('faction_id', flat=True).first()
+    if faction_id is not None:
+        invalidate_bg_graph(faction_id)
+
+
+# Les GN orga mémorisés sur l'utilisateur (larp.utils.get_orga_larp_ids)
+# sont oubliés dès que ses groupes changent
+@receiver(m2m_changed, sender=User.groups.through)
+def on_user_groups_changed(sender, instance, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear') and isinstance(instance, User):
+        clear_orga_larp_ids(instance)
+
+
 @receiver(user_logged_in)
 def check_if_orga(sender, user : User, request, **kwargs):
     if user.is_superuser:
         request.session['is_orga'] = True
         return
-    user_groups_id = user.groups.all().values_list('pk')
-    user_orga_larps = larp_models.Larp.objects.filter(orga_group_id__in=user_groups_id)
-    is_orga = True if user_orga_larps.count() > 0 else False
-    request.session['is_orga'] = is_orga
-
+    request.session['is_orga'] = len(get_orga_larp_ids(user)) > 0
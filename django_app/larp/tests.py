@@ -1,3 +1,896 @@
-from django.test import TestCase
+from collections import OrderedDict, defaultdict
+from concurrent.futures.process import BrokenProcessPool
+from datetime import date
+from io import BytesIO, StringIO
+import json
+import os
+import re
+import threading
+import time
+import unittest
+from unittest import mock
+import zipfile
+from cms.toolbar.toolbar import CMSToolbar
+from cms.utils.permissions import set_current_user
+from django.contrib.sessions.backends.cache import SessionStore
+from django.template import Context, Template
+from menus.menu_pool import menu_pool
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import PermissionDenied
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.db.models import OuterRef, Q, Subquery
+from django.test import RequestFactory, SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils.http import content_disposition_header
 
-# Create your tests here.
+from larp import models as larp_models
+from larp import pdf as larp_pdf
+from larp.cms_menus import LarpMenuRenderer, LarpNavExtender, build_link_plan, get_link_plan, nodes_signature
+from larp.management.commands.benchmark_nav_extender import FakeRenderer, legacy_link, synthetic_nodes
+from larp.roster import build_roster, get_faction_roster, get_pnjv_roster
+from larp.signals import inscriptions_created
+from larp.dataset import seed_dataset
+from larp.bg_graph import analyse_bg_graph, compile_bg_graph, get_bg_analysis, get_bg_graph
+from larp.utils import has_orga_permission, is_orga_for, only_last_inscriptions
+
+
+class OrgaRosterTests(TestCase):
+    def setUp(self):
+        # Le middleware CMS garde l'utilisateur de la dernière requête de test,
+        # qui serait sinon utilisé comme créateur du groupe orga du GN
+        set_current_user(None)
+        # Le cache n'est pas dans la base de test : on repart d'un cache vide
+        cache.clear()
+        self.larp = larp_models.Larp.objects.create(name="GN test", factions_name="Faction")
+        self.opus = larp_models.Opus.objects.create(larp=self.larp, name="Opus 1")
+        self.orga = User.objects.create_user("orga", password="orga")
+        self.orga.groups.add(self.larp.orga_group)
+        self.nb_users = 0
+
+    def _populate(self, nb_factions, nb_players):
+        for f in range(nb_factions):
+            faction = larp_models.Faction.objects.create(larp=self.larp, name=f"Faction {self.larp.pk}-{f}-{self.nb_users}")
+            for p in range(nb_players):
+                for access_type in (larp_models.AccessType.PJ, larp_models.AccessType.PNJF):
+                    self.nb_users += 1
+                    user = User.objects.create_user(f"user{self.nb_users}")
+                    larp_models.Inscription.objects.create(user=user, opus=self.opus, faction=faction, access_type=access_type)
+                    larp_models.PjInfos.objects.create(user=user, larp=self.larp, faction=faction, name=f"Perso {self.nb_users}")
+            self.nb_users += 1
+            user = User.objects.create_user(f"user{self.nb_users}")
+            larp_models.Inscription.objects.create(user=user, opus=self.opus, access_type=larp_models.AccessType.PNJV)
+
+    def _factions(self):
+        return larp_models.Faction.objects.filter(larp=self.larp).order_by('name')
+
+    def test_roster_structure(self):
+        self._populate(2, 3)
+        roster = build_roster(self.larp, self.opus, self._factions())
+
+        self.assertEqual(len(roster['faction_data']), 2)
+        self.assertEqual(len(roster['pnjv_list']), 2)
+        for faction_info in roster['faction_data']:
+            self.assertEqual(len(faction_info['pj_list']), 3)
+            self.assertEqual(len(faction_info['pnjf_list']), 3)
+            for pj in faction_info['pj_list']:
+                self.assertEqual(pj['pj1'].user, pj['user'])
+                self.assertIsNone(pj['pj2'])
+            for pnjf in faction_info['pnjf_list']:
+                self.assertEqual(pnjf['pnj_infos'].user, pnjf['user'])
+                self.assertEqual(len(pnjf['pj_infos']), 1)
+
+    def test_roster_query_count_is_constant(self):
+        self._populate(1, 1)
+        factions = list(self._factions())
+        with self.assertNumQueries(3):
+            build_roster(self.larp, self.opus, factions)
+
+        self._populate(5, 20)
+        factions = list(self._factions())
+        with self.assertNumQueries(3):
+            build_roster(self.larp, self.opus, factions)
+
+    def _assert_flat_query_count(self, get_url):
+        self.client.force_login(self.orga)
+
+        self._populate(1, 1)
+        # Un premier appel remplit les caches (menus CMS, session...)
+        self.client.get(get_url())
+        with CaptureQueriesContext(connection) as small:
+            response = self.client.get(get_url())
+        self.assertEqual(response.status_code, 200)
+
+        self._populate(4, 10)
+        self.client.get(get_url())
+        with CaptureQueriesContext(connection) as large:
+            response = self.client.get(get_url())
+        self.assertEqual(response.status_code, 200)
+
+        self.assertEqual(len(small), len(large))
+        return response
+
+    def test_orga_gn_query_count_is_flat(self):
+        url = reverse('larp:orga_gn', kwargs={'larp_id': self.larp.pk})
+        response = self._assert_flat_query_count(lambda: url)
+        self.assertContains(response, reverse('larp:orga_gn_pnjv', kwargs={'larp_id': self.larp.pk}))
+
+    def test_orga_gn_faction_query_count_is_flat(self):
+        def get_url():
+            faction = self._factions().last()
+            return reverse('larp:orga_gn_faction', kwargs={'larp_id': self.larp.pk, 'faction_id': faction.pk})
+        response = self._assert_flat_query_count(get_url)
+        self.assertContains(response, "PNJF (PNJ de Faction)")
+        self.assertNotContains(response, "<html")
+
+    def test_orga_gn_pnjv_partial(self):
+        self._populate(2, 1)
+        self.client.force_login(self.orga)
+        response = self.client.get(reverse('larp:orga_gn_pnjv', kwargs={'larp_id': self.larp.pk}))
+        pnjv_infos = larp_models.PnjInfos.objects.filter(user__inscription__access_type=larp_models.AccessType.PNJV)
+        self.assertEqual(len(pnjv_infos), 2)
+        for pnj_infos in pnjv_infos:
+            self.assertContains(response, reverse('larp:pnj_form', kwargs={'pk': pnj_infos.pk}))
+
+    def test_orga_gn_requires_orga(self):
+        self._populate(1, 1)
+        player = User.objects.create_user("player")
+        self.client.force_login(player)
+        faction = self._factions().first()
+        response = self.client.get(reverse('larp:orga_gn_faction', kwargs={'larp_id': self.larp.pk, 'faction_id': faction.pk}))
+        self.assertEqual(response.status_code, 403)
+
+    def test_faction_roster_is_cached_until_larp_change(self):
+        self._populate(1, 2)
+        faction = self._factions().first()
+
+        faction_info = get_faction_roster(self.larp, self.opus, faction)
+        self.assertEqual(len(faction_info['pj_list']), 2)
+        with self.assertNumQueries(0):
+            # Lu dans le cache local du worker, sans recalcul ni requête
+            get_faction_roster(self.larp, self.opus, faction)
+
+        user = User.objects.create_user("late_player")
+        larp_models.Inscription.objects.create(user=user, opus=self.opus, faction=faction, access_type=larp_models.AccessType.PJ)
+        faction_info = get_faction_roster(self.larp, self.opus, faction)
+        self.assertEqual(len(faction_info['pj_list']), 3)
+
+        pj_infos = larp_models.PjInfos.objects.create(user=user, larp=self.larp, faction=faction, name="Retardataire")
+        faction_info = get_faction_roster(self.larp, self.opus, faction)
+        self.assertEqual(faction_info['pj_list'][-1]['pj1'], pj_infos)
+
+    def test_inscription_change_invalidates_roster_without_lookup(self):
+        self._populate(2, 1)
+        faction, other_faction = self._factions()
+        sizes = [len(get_faction_roster(self.larp, self.opus, f)['pj_list']) for f in (faction, other_faction)]
+        inscription = larp_models.Inscription.objects.get(faction=faction, access_type=larp_models.AccessType.PJ)
+
+        inscription.faction = other_faction
+        with CaptureQueriesContext(connection) as queries:
+            inscription.save()
+        # L'UPDATE de l'inscription et ceux de la synthèse des ventes, sans relecture
+        self.assertFalse([q['sql'] for q in queries if q['sql'].startswith("SELECT")])
+        self.assertEqual([len(get_faction_roster(self.larp, self.opus, f)['pj_list']) for f in (faction, other_faction)],
+                         [sizes[0] - 1, sizes[1] + 1])
+
+    def test_pnjv_roster_is_invalidated_on_pnj_infos_change(self):
+        self._populate(1, 1)
+        pnjv_list = get_pnjv_roster(self.larp, self.opus)
+        self.assertFalse(pnjv_list[0].completed)
+
+        pnj_infos = larp_models.PnjInfos.objects.get(pk=pnjv_list[0].pk)
+        pnj_infos.completed = True
+        pnj_infos.save()
+        self.assertTrue(get_pnjv_roster(self.larp, self.opus)[0].completed)
+
+    def test_export_pdf_zip(self):
+        self._populate(2, 2)
+        self.client.force_login(self.orga)
+        url = reverse('larp:orga_export_pdf', kwargs={'larp_id': self.larp.pk})
+
+        response = self.client.get(url)
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        archive = zipfile.ZipFile(BytesIO(b''.join(response.streaming_content)))
+        names = archive.namelist()
+        # Par faction : 2 PJ, 2 PNJF avec fiche PJ et fiche PNJ ; plus 2 PNJV
+        self.assertEqual(len(names), 2 * (2 + 2 * 2) + 2)
+        self.assertEqual(len([n for n in names if n.startswith('PNJV/')]), 2)
+        for name in names:
+            self.assertTrue(archive.read(name).startswith(b'%PDF'))
+
+        faction = self._factions().first()
+        response = self.client.get(url, {'faction': faction.pk})
+        archive = zipfile.ZipFile(BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual(len(archive.namelist()), 2 + 2 * 2)
+        self.assertTrue(all(n.startswith(f"{faction.name}/") for n in archive.namelist()))
+
+    def test_export_pdf_zip_without_faction(self):
+        self._populate(1, 1)
+        self.opus.name = 'Opus "Été"'
+        self.opus.save()
+        # PNJF dont la faction n'est pas encore attribuée
+        larp_models.Inscription.objects.filter(access_type=larp_models.AccessType.PNJF).update(faction=None)
+        self.client.force_login(self.orga)
+
+        response = self.client.get(reverse('larp:orga_export_pdf', kwargs={'larp_id': self.larp.pk}))
+        self.assertEqual(response['Content-Disposition'], content_disposition_header(True, 'fiches_Opus "Été".zip'))
+        archive = zipfile.ZipFile(BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual(len([n for n in archive.namelist() if n.startswith("Sans faction/pnj_")]), 1)
+
+    def test_broken_pdf_pool_is_replaced(self):
+        # Processus du pool tué pendant un export
+        broken = mock.Mock(submit=mock.Mock(side_effect=BrokenProcessPool("processus tué")))
+        with mock.patch('larp.pdf._pdf_executor', broken):
+            with self.assertRaises(BrokenProcessPool):
+                list(larp_pdf.render_pdfs([("fiche.pdf", [('title', "Fiche")])]))
+            self.assertIsNone(larp_pdf._pdf_executor)
+        broken.shutdown.assert_called_once_with(wait=False, cancel_futures=True)
+
+    def test_character_pdf_views(self):
+        self._populate(1, 1)
+        pnjf = larp_models.Inscription.objects.get(access_type=larp_models.AccessType.PNJF)
+        profile = pnjf.user.profile
+        profile.birthdate = date(2000, 1, 1)
+        profile.xp_gn = larp_models.Profile.XP_GN.ONE.name
+        profile.save()
+        self.client.force_login(pnjf.user)
+
+        urls = [
+            reverse('larp:view_pj_pdf', kwargs={'pjinfos_id': pnjf.user.pjinfos_set.get().pk}),
+            reverse('larp:view_pnj_pdf', kwargs={'pnjinfos_id': pnjf.user.pnjinfos_set.get().pk}),
+            reverse('larp:view_profile_pdf', kwargs={'user_id': pnjf.user.pk}),
+        ]
+        for url in urls:
+            response = self.client.get(url)
+            self.assertEqual(response['Content-Type'], 'application/pdf')
+            self.assertTrue(response.getvalue().startswith(b'%PDF'))
+
+    def test_character_pdf_etag(self):
+        self._populate(1, 1)
+        pj_infos = larp_models.PjInfos.objects.first()
+        self.client.force_login(pj_infos.user)
+        url = reverse('larp:view_pj_pdf', kwargs={'pjinfos_id': pj_infos.pk})
+
+        response = self.client.get(url)
+        etag = response['ETag']
+        response = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+
+        pj_infos.skills = "Escrime"
+        pj_infos.save()
+        response = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_bulk_created_inscriptions(self):
+        self._populate(1, 1)
+        faction = self._factions().first()
+        get_faction_roster(self.larp, self.opus, faction)
+
+        users = [User.objects.create_user(f"bulk{i}") for i in range(4)]
+        inscriptions = larp_models.Inscription.objects.bulk_create([
+            larp_models.Inscription(user=users[0], opus=self.opus, faction=faction, access_type=larp_models.AccessType.PJ),
+            larp_models.Inscription(user=users[1], opus=self.opus, faction=faction, access_type=larp_models.AccessType.PNJF),
+            larp_models.Inscription(user=users[2], opus=self.opus, access_type=larp_models.AccessType.PNJV),
+            larp_models.Inscription(user=users[3], opus=self.opus, access_type=larp_models.AccessType.PNJV),
+        ])
+        larp_models.PnjInfos.objects.create(user=users[3], larp=self.larp)
+        inscriptions_created(inscriptions)
+
+        self.assertEqual(larp_models.PnjInfos.objects.filter(user__in=users).count(), 3)
+        self.assertFalse(larp_models.PnjInfos.objects.filter(user=users[0]).exists())
+        self.assertEqual(len(get_faction_roster(self.larp, self.opus, faction)['pj_list']), 2)
+
+
+class OrgaPermissionTests(TestCase):
+    def setUp(self):
+        set_current_user(None)
+        self.larp = larp_models.Larp.objects.create(name="GN test", factions_name="Faction")
+        self.other_larp = larp_models.Larp.objects.create(name="Autre GN", factions_name="Faction")
+        self.user = User.objects.create_user("orga")
+
+    def test_orga_larps_are_loaded_once(self):
+        self.user.groups.add(self.larp.orga_group)
+        with self.assertNumQueries(1):
+            self.assertTrue(is_orga_for(self.user, self.larp.pk))
+            self.assertFalse(is_orga_for(self.user, self.other_larp.pk))
+            self.assertTrue(has_orga_permission(self.user, self.larp.pk))
+        with self.assertRaises(PermissionDenied):
+            has_orga_permission(self.user, self.other_larp.pk)
+
+    def test_group_change_clears_orga_larps(self):
+        self.assertFalse(is_orga_for(self.user, self.larp.pk))
+        self.user.groups.add(self.larp.orga_group)
+        self.assertTrue(is_orga_for(self.user, self.larp.pk))
+        self.user.groups.remove(self.larp.orga_group)
+        self.assertFalse(is_orga_for(self.user, self.larp.pk))
+
+    def test_pnj_form_checks_orga_once(self):
+        pnj_user = User.objects.create_user("pnj")
+        pnj_infos = larp_models.PnjInfos.objects.create(user=pnj_user, larp=self.larp)
+        self.user.groups.add(self.larp.orga_group)
+        self.client.force_login(self.user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('larp:pnj_form', kwargs={'pk': pnj_infos.pk}))
+        self.assertEqual(response.status_code, 200)
+        orga_queries = [q for q in queries if 'FROM "larp_larp" INNER JOIN "auth_group"' in q['sql']]
+        self.assertEqual(len(orga_queries), 1)
+
+
+class LarpNavExtenderTests(SimpleTestCase):
+    def link(self, nodes):
+        return LarpNavExtender(FakeRenderer('test')).modify(None, nodes, None, None, False, False)
+
+    def parents(self, nodes):
+        return [(n.namespace, n.id, n.parent.id if n.parent else None, [c.id for c in n.children]) for n in nodes]
+
+    def test_same_links_as_legacy(self):
+        for hidden_home in (False, True):
+            legacy_nodes = synthetic_nodes(200)
+            nodes = synthetic_nodes(200)
+            legacy_nodes[0].visible = nodes[0].visible = not hidden_home
+            self.assertEqual(self.parents(self.link(nodes)), self.parents(legacy_link(legacy_nodes)))
+            # Second passage : plan mémorisé appliqué à de nouveaux nœuds
+            nodes = synthetic_nodes(200)
+            nodes[0].visible = not hidden_home
+            self.assertEqual(self.parents(self.link(nodes)), self.parents(legacy_nodes))
+
+
+    def test_link_plans_are_shared_safely_between_threads(self):
+        nodes = synthetic_nodes(20)
+        errors = []
+
+        def render_menu(cache_key):
+            try:
+                get_link_plan(cache_key, nodes)
+            except Exception as e:
+                errors.append(e)
+
+        other_menu = threading.Thread(target=render_menu, args=("autre",))
+
+        class InterleavedPlans(OrderedDict):
+            """Un autre thread rend son menu (et évince la première clé) juste après la lecture du plan"""
+            def get(self, key, default=None):
+                plan = super().get(key, default)
+                if other_menu.ident is None:
+                    other_menu.start()
+                    other_menu.join(timeout=0.2)
+                return plan
+
+        plans = InterleavedPlans()
+        plans[("menu", nodes_signature(nodes))] = build_link_plan(nodes)
+        with mock.patch('larp.cms_menus._link_plans', plans), mock.patch('larp.cms_menus.LINK_PLANS_MAX_ENTRIES', 1):
+            render_menu("menu")
+            other_menu.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(list(plans), [("autre", nodes_signature(nodes))])
+
+
+class LarpMenuTests(TestCase):
+    def setUp(self):
+        set_current_user(None)
+        cache.clear()
+
+    def make_request(self, user, is_orga=False):
+        request = RequestFactory().get('/')
+        request.user = user
+        request.session = SessionStore()
+        request.session['is_orga'] = is_orga
+        request.current_page = None
+        request.toolbar = CMSToolbar(request)
+        return request
+
+    def render_menu(self, request):
+        template = Template("{% load larp_menu %}{% show_larp_menu 0 100 100 100 'larp/bootstrap5/larp_menu.html' %}")
+        return template.render(Context({'request': request}))
+
+    def test_menu_is_cached_per_role(self):
+        alice = User.objects.create_user("alice")
+        bob = User.objects.create_user("bob")
+        alice_request = self.make_request(alice)
+        bob_request = self.make_request(bob)
+        self.assertEqual(LarpMenuRenderer(menu_pool, alice_request).cache_key,
+                         LarpMenuRenderer(menu_pool, bob_request).cache_key)
+        self.assertNotEqual(LarpMenuRenderer(menu_pool, alice_request).cache_key,
+                            LarpMenuRenderer(menu_pool, self.make_request(alice, is_orga=True)).cache_key)
+
+        alice_menu = self.render_menu(alice_request)
+        bob_menu = self.render_menu(bob_request)
+        self.assertIn("alice", alice_menu)
+        self.assertIn(reverse('larp:profile', kwargs={'user_id': alice.pk}), alice_menu)
+        self.assertIn("bob", bob_menu)
+        self.assertIn(reverse('larp:profile', kwargs={'user_id': bob.pk}), bob_menu)
+        self.assertNotIn("alice", bob_menu)
+        self.assertNotIn("Coin Orga", bob_menu)
+        self.assertIn("Coin Orga", self.render_menu(self.make_request(bob, is_orga=True)))
+
+
+class CompleteBgTests(TestCase):
+    def setUp(self):
+        set_current_user(None)
+        cache.clear()
+        self.larp = larp_models.Larp.objects.create(name="GN test", factions_name="Faction")
+        self.faction = larp_models.Faction.objects.create(larp=self.larp, name="Faction")
+        self.step1 = larp_models.BgStep.objects.create(faction=self.faction, step=1, short_name="Origine", question="D'où venez-vous ?")
+        self.step2 = larp_models.BgStep.objects.create(faction=self.faction, step=2, short_name="Métier", question="Que faites-vous ?")
+        self.city = larp_models.BgChoice.objects.create(bg_step=self.step1, short_name="Ville", text="La ville")
+        self.forest = larp_models.BgChoice.objects.create(bg_step=self.step1, short_name="Forêt", text="La forêt")
+        self.smith = larp_models.BgChoice.objects.create(bg_step=self.step2, short_name="Forgeron", text="Forgeron", requisit=self.city)
+        self.hunter = larp_models.BgChoice.objects.create(bg_step=self.step2, short_name="Chasseur", text="Chasseur", requisit=self.forest)
+        self.player = User.objects.create_user("joueur")
+        self.pj_infos = larp_models.PjInfos.objects.create(user=self.player, larp=self.larp, faction=self.faction, name="Perso")
+        self.url = reverse('larp:complete_bg', kwargs={'pjinfos_id': self.pj_infos.pk})
+        self.client.force_login(self.player)
+
+    def test_graph_is_cached_until_bg_change(self):
+        graph = get_bg_graph(self.faction.pk)
+        self.assertEqual(graph['last_step'], 2)
+        self.assertEqual(graph['choices'][1], [self.city, self.forest])
+        with self.assertNumQueries(0):
+            get_bg_graph(self.faction.pk)
+
+        self.forest.text = "La grande forêt"
+        self.forest.save()
+        self.assertEqual(get_bg_graph(self.faction.pk)['choices'][1][1].text, "La grande forêt")
+        self.step2.delete()
+        self.assertEqual(get_bg_graph(self.faction.pk), compile_bg_graph(self.faction.pk))
+        self.assertEqual(get_bg_graph(self.faction.pk)['last_step'], 1)
+
+    def test_complete_bg_follows_requisits(self):
+        response = self.client.get(self.url)
+        self.assertContains(response, "La ville")
+        self.assertContains(response, "La forêt")
+
+        response = self.client.post(self.url, {'choice': self.forest.pk})
+        self.assertRedirects(response, self.url, fetch_redirect_response=False)
+        response = self.client.get(self.url)
+        self.assertContains(response, "Chasseur")
+        self.assertNotContains(response, "Forgeron")
+
+        # Un choix qui n'est pas proposé est refusé
+        response = self.client.post(self.url, {'choice': self.smith.pk})
+        self.assertEqual(response.status_code, 200)
+        self.pj_infos.refresh_from_db()
+        self.assertFalse(self.pj_infos.bg_completed)
+
+        response = self.client.post(self.url, {'choice': self.hunter.pk})
+        self.assertRedirects(response, reverse('larp:view_pj', kwargs={'pjinfos_id': self.pj_infos.pk}), fetch_redirect_response=False)
+        self.pj_infos.refresh_from_db()
+        self.assertTrue(self.pj_infos.bg_completed)
+
+    def test_bg_analysis(self):
+        analysis = get_bg_analysis(self.faction.pk)
+        self.assertEqual(analysis['nb_paths'], 2)
+        self.assertEqual(analysis['unreachable'], [])
+        self.assertEqual(analysis['dead_ends'], [])
+
+        # Prérequis sur un choix de la même étape : jamais proposé
+        orphan = larp_models.BgChoice.objects.create(bg_step=self.step2, short_name="Orphelin", requisit=self.smith)
+        self.hunter.delete()
+        analysis = get_bg_analysis(self.faction.pk)
+        self.assertEqual(analysis['nb_paths'], 1)
+        self.assertEqual(analysis['unreachable'], [orphan])
+        self.assertEqual(analysis['dead_ends'], [{'step': 2, 'bg_step': self.step2, 'after': [self.forest]}])
+
+        orga = User.objects.create_user("orga")
+        orga.groups.add(self.larp.orga_group)
+        self.client.force_login(orga)
+        response = self.client.get(reverse('larp:bg_steps', kwargs={'faction_id': self.faction.pk}))
+        self.assertContains(response, "Orphelin")
+        self.assertContains(response, "« Forêt »")
+
+    def test_bg_analysis_large_graph(self):
+        # 60 étapes de 10 choix, chaque choix dépendant d'un choix de l'étape précédente
+        graph = {'steps': {}, 'choices': {}, 'last_step': 60}
+        pk = 0
+        for step in range(1, 61):
+            graph['steps'][step] = larp_models.BgStep(pk=step, step=step)
+            graph['choices'][step] = []
+            for i in range(10):
+                pk += 1
+                requisit_id = pk - 10 if step > 1 and i < 5 else None
+                graph['choices'][step].append(larp_models.BgChoice(pk=pk, bg_step_id=step, requisit_id=requisit_id))
+        analysis = analyse_bg_graph(graph)
+        self.assertEqual(analysis['unreachable'], [])
+        self.assertEqual(analysis['dead_ends'], [])
+        # Le choix i (< 5) de l'étape n n'est proposé qu'après le choix i de l'étape n - 1 :
+        # un seul chemin par choix i, plus 5 choix libres après chaque chemin
+        nb_paths = 10
+        for _ in range(59):
+            nb_paths = 5 + 5 * nb_paths
+        self.assertEqual(analysis['nb_paths'], nb_paths)
+
+    def test_reorder_bg_steps(self):
+        step3 = larp_models.BgStep.objects.create(faction=self.faction, step=3, short_name="Famille", question="Votre famille ?")
+        noble = larp_models.BgChoice.objects.create(bg_step=step3, short_name="Noble")
+        larp_models.Character_Bg_choices.objects.create(pjInfos=self.pj_infos, bgchoice=self.forest, step=1)
+        larp_models.Character_Bg_choices.objects.create(pjInfos=self.pj_infos, bgchoice=self.hunter, step=2)
+        larp_models.Character_Bg_choices.objects.create(pjInfos=self.pj_infos, bgchoice=noble, step=3)
+        get_bg_graph(self.faction.pk)
+
+        orga = User.objects.create_user("orga")
+        orga.groups.add(self.larp.orga_group)
+        self.client.force_login(orga)
+        url = reverse('larp:bg_steps_reorder', kwargs={'faction_id': self.faction.pk})
+        response = self.client.post(url, {'order': [step3.pk, self.step2.pk, self.step1.pk]})
+        self.assertEqual(response.status_code, 200)
+
+        steps = larp_models.BgStep.objects.filter(faction=self.faction).order_by('step')
+        self.assertEqual([s.pk for s in steps], [step3.pk, self.step2.pk, self.step1.pk])
+        self.assertEqual([s.pk for s in get_bg_graph(self.faction.pk)['steps'].values()], [step3.pk, self.step2.pk, self.step1.pk])
+        answers = dict(larp_models.Character_Bg_choices.objects.values_list('bgchoice_id', 'step'))
+        self.assertEqual(answers, {noble.pk: 1, self.hunter.pk: 2, self.forest.pk: 3})
+
+        # Ordre incomplet : refusé, rien ne change
+        response = self.client.post(url, {'order': [self.step1.pk, self.step2.pk]})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(larp_models.BgStep.objects.get(pk=step3.pk).step, 1)
+
+
+class CharacterListTests(TestCase):
+    def setUp(self):
+        set_current_user(None)
+        cache.clear()
+        self.player = User.objects.create_user("veteran")
+        profile = self.player.profile
+        profile.activated = True
+        profile.xp_gn = larp_models.Profile.XP_GN.ONE.name
+        profile.save()
+        self.nb_larps = 0
+
+    def add_larp(self, nb_opus):
+        """Un GN auquel le joueur a participé nb_opus fois, en PJ puis en PNJF au dernier opus"""
+        self.nb_larps += 1
+        larp = larp_models.Larp.objects.create(name=f"GN {self.nb_larps}", factions_name="Faction", sheet_creation_opened=True)
+        faction = larp_models.Faction.objects.create(larp=larp, name=f"Faction {self.nb_larps}")
+        for i in range(nb_opus):
+            opus = larp_models.Opus.objects.create(larp=larp, name=f"Opus {self.nb_larps}-{i}")
+            access_type = larp_models.AccessType.PNJF if i == nb_opus - 1 else larp_models.AccessType.PJ
+            larp_models.Inscription.objects.create(user=self.player, opus=opus, faction=faction, access_type=access_type)
+        larp_models.PjInfos.objects.create(user=self.player, larp=larp, faction=faction, name=f"Perso {self.nb_larps}")
+        return larp
+
+    def test_only_last_inscriptions(self):
+        self.add_larp(3)
+        self.add_larp(1)
+        with self.assertNumQueries(3):
+            inscriptions = only_last_inscriptions(self.player)
+        self.assertEqual(list(inscriptions), ["GN 1", "GN 2"])
+        for current in inscriptions.values():
+            self.assertEqual(current.access_type, larp_models.AccessType.PNJF)
+            self.assertEqual(len(current.pj_infos), 1)
+            self.assertIsNotNone(current.pnj_infos)
+            self.assertTrue(current.can_add_character)
+
+    def test_character_list_query_count_is_flat(self):
+        url = reverse('larp:character_list')
+        self.client.force_login(self.player)
+        self.add_larp(1)
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as small:
+            response = self.client.get(url)
+        self.assertContains(response, "Perso 1")
+
+        for _ in range(4):
+            self.add_larp(5)
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as large:
+            response = self.client.get(url)
+        self.assertContains(response, "Perso 5 (Faction 5)")
+        self.assertEqual(len(small), len(large))
+
+
+class SeedDatasetTests(TestCase):
+    def setUp(self):
+        set_current_user(None)
+        cache.clear()
+
+    def test_command_generates_every_kind_of_object(self):
+        call_command('seed_dataset', larps=2, opus=2, factions=3, players=40, steps=4, choices=3,
+                     password="secret", stdout=StringIO())
+
+        self.assertEqual(larp_models.Larp.objects.count(), 2)
+        self.assertEqual(User.objects.filter(username__startswith="seed-player").count(), 40)
+        self.assertEqual(larp_models.Inscription.objects.count(), 2 * 2 * 40)
+        self.assertEqual(set(larp_models.Inscription.objects.values_list('access_type', flat=True)),
+                         set(larp_models.AccessType.values))
+        self.assertEqual(larp_models.PnjInfos.objects.count(),
+                         larp_models.Inscription.objects.exclude(access_type=larp_models.AccessType.PJ).
+                         values('user', 'opus__larp').distinct().count())
+        self.assertEqual(larp_models.BgChoice.objects.filter(requisit__isnull=False).count(), 2 * 3 * 3)
+        self.assertTrue(larp_models.Character_Bg_choices.objects.exists())
+        self.assertTrue(self.client.login(username="seed-orga", password="secret"))
+
+        with self.assertRaises(CommandError):
+            call_command('seed_dataset', players=1, stdout=StringIO())
+
+    def test_same_seed_gives_same_dataset(self):
+        def access_types(prefix):
+            seed_dataset(seed=7, nb_larps=1, nb_players=30, prefix=prefix)
+            return list(larp_models.Inscription.objects.filter(user__username__startswith=f"{prefix}-").
+                        order_by('user__username', 'opus__name').
+                        values_list('user__username', 'access_type', 'faction__name'))
+
+        first = [(u.replace("a-", "", 1), a, f and f.replace("a GN", "", 1)) for u, a, f in access_types("a")]
+        second = [(u.replace("b-", "", 1), a, f and f.replace("b GN", "", 1)) for u, a, f in access_types("b")]
+        self.assertEqual(first, second)
+
+
+# Tables dont les parcours complets sont interdits par HotPathIndexTests
+INDEXED_TABLES = {'larp_inscription', 'larp_pjinfos', 'larp_pnjinfos', 'larp_character_bg_choices'}
+
+
+def full_scans(queryset):
+    """Tables de INDEXED_TABLES lues en entier d'après le plan d'exécution (EXPLAIN) de la requête"""
+    if connection.vendor == 'sqlite':
+        # "SCAN larp_inscription" : parcours complet, "SEARCH ... USING INDEX" : accès par index
+        tables = re.findall(r"\bSCAN (\w+)", queryset.explain())
+    elif connection.vendor == 'mysql':
+        plan = json.loads(queryset.explain(format='json'))
+        tables = re.findall(r'"table_name": "(\w+)", "access_type": "ALL"', json.dumps(plan))
+    else:
+        raise unittest.SkipTest(f"Plans d'exécution {connection.vendor} non analysés")
+    return [table for table in tables if table in INDEXED_TABLES]
+
+
+def sorts_without_index(queryset):
+    """Le tri (ORDER BY) de la requête se fait à part, sans profiter de l'ordre d'un index"""
+    if connection.vendor == 'sqlite':
+        return "USE TEMP B-TREE FOR ORDER BY" in queryset.explain()
+    if connection.vendor == 'mysql':
+        return '"using_filesort": true' in json.dumps(json.loads(queryset.explain(format='json')))
+    raise unittest.SkipTest(f"Plans d'exécution {connection.vendor} non analysés")
+
+
+class HotPathIndexTests(TestCase):
+    """Les requêtes les plus fréquentes des vues larp passent par un index sur le jeu de données seed_dataset"""
+    @classmethod
+    def setUpTestData(cls):
+        set_current_user(None)
+        dataset = seed_dataset(seed=3, nb_larps=2, nb_opus=3, nb_factions=4, nb_players=200)
+        cls.larp = dataset['larps'][0]
+        cls.opus = larp_models.Opus.objects.filter(larp=cls.larp).first()
+        cls.player = dataset['player']
+        cls.pj_infos = larp_models.PjInfos.objects.filter(user=cls.player, larp=cls.larp).first()
+        cls.faction_ids = list(larp_models.Faction.objects.filter(larp=cls.larp).values_list('pk', flat=True))
+
+    def hot_queries(self):
+        played_user_ids = larp_models.Inscription.objects.filter(
+            opus=self.opus, faction_id__in=self.faction_ids,
+            access_type__in=[larp_models.AccessType.PJ, larp_models.AccessType.PNJF]).values('user_id')
+        user_ids = list(larp_models.Inscription.objects.filter(opus=self.opus).values_list('user_id', flat=True)[:50])
+        last_inscription = larp_models.Inscription.objects.filter(
+            user=OuterRef('user'), opus__larp=OuterRef('opus__larp')).order_by('-created_at', '-pk').values('pk')[:1]
+        return {
+            # build_roster
+            'roster inscriptions': larp_models.Inscription.objects.filter(
+                Q(faction_id__in=self.faction_ids) | Q(access_type=larp_models.AccessType.PNJV), opus=self.opus),
+            'roster pj_infos': larp_models.PjInfos.objects.filter(
+                larp=self.larp, faction_id__in=self.faction_ids, user_id__in=played_user_ids),
+            'roster pnj_infos': larp_models.PnjInfos.objects.filter(larp=self.larp, user_id__in=user_ids),
+            # only_last_inscriptions, view_pnj
+            'last inscriptions': larp_models.Inscription.objects.filter(user=self.player, pk=Subquery(last_inscription)),
+            'last inscription of larp': larp_models.Inscription.objects.filter(
+                user=self.player, opus__larp=self.larp).order_by('-created_at')[:1],
+            'pj_infos of user': larp_models.PjInfos.objects.filter(user=self.player, larp_id__in=[self.larp.pk]),
+            'pnj_infos of user': larp_models.PnjInfos.objects.filter(user=self.player, larp_id__in=[self.larp.pk]),
+            # complete_bg, view_pj
+            'bg answers': larp_models.Character_Bg_choices.objects.filter(pjInfos=self.pj_infos).order_by('step'),
+        }
+
+    def test_hot_queries_use_indexes(self):
+        for name, queryset in self.hot_queries().items():
+            with self.subTest(query=name):
+                self.assertEqual(full_scans(queryset), [], queryset.explain())
+                if queryset.query.order_by:
+                    self.assertFalse(sorts_without_index(queryset), queryset.explain())
+
+
+# Les temps de réponse ne sont vérifiés qu'à la demande (LATENCY_BUDGETS=1) :
+# ils dépendent de la machine et rendraient la suite instable en CI
+CHECK_LATENCY_BUDGETS = os.getenv("LATENCY_BUDGETS") == "1"
+
+
+class QueryBudgetMixin:
+    """
+    Vérifie qu'une vue respecte son budget : code HTTP attendu pour le rôle,
+    nombre maximal de requêtes SQL et temps de réponse maximal (ms, vérifié
+    avec CHECK_LATENCY_BUDGETS), sur le jeu de données seed_dataset.
+
+    Chaque budget est un tuple (nom d'URL, rôle, code HTTP, kwargs, requêtes max,
+    ms max) éventuellement suivi d'un dictionnaire d'options de requête : 'method',
+    'query' (paramètres GET) et les arguments du client de test ('data',
+    'headers', 'content_type'...). kwargs et les options peuvent être des
+    fonctions recevant self.data (objets du jeu de données).
+    Le rôle est 'anonymous', 'player' (joueur PJ), 'pnj' (PNJ de faction) ou 'orga'.
+    """
+    @classmethod
+    def seed_budget_dataset(cls):
+        set_current_user(None)
+        dataset = seed_dataset(seed=42, nb_larps=2, nb_opus=3, nb_factions=4, nb_players=150)
+        larp = dataset['larps'][0]
+        player = dataset['player']
+        pj_infos = larp_models.PjInfos.objects.get(user=player, larp=larp)
+        pnj_inscription = larp_models.Inscription.objects.filter(
+            opus__larp=larp, access_type=larp_models.AccessType.PNJF).order_by('pk').first()
+        bg_step = larp_models.BgStep.objects.filter(faction=pj_infos.faction).order_by('step').last()
+        cls.data = {
+            'larp': larp,
+            'opus': larp_models.Opus.objects.filter(larp=larp).order_by('pk').last(),
+            'faction': pj_infos.faction,
+            'ticket': larp_models.Ticket.objects.filter(opus__larp=larp, access_type=larp_models.AccessType.PJ).first(),
+            'orga': dataset['orga'],
+            'player': player,
+            'inscription': larp_models.Inscription.objects.filter(user=player, opus__larp=larp).order_by('pk').last(),
+            'pj_infos': pj_infos,
+            'pnj': pnj_inscription.user,
+            'pnj_infos': larp_models.PnjInfos.objects.get(user=pnj_inscription.user, larp=larp),
+            'bg_step': bg_step,
+            'bg_choice': larp_models.BgChoice.objects.filter(bg_step=bg_step, requisit__isnull=False).first(),
+            'answer': larp_models.Character_Bg_choices.objects.filter(pjInfos__user=player).first() or
+                      larp_models.Character_Bg_choices.objects.create(
+                          pjInfos=pj_infos, step=1,
+                          bgchoice=larp_models.BgChoice.objects.filter(bg_step__faction=pj_infos.faction, bg_step__step=1).first()),
+        }
+
+    def request_as(self, role, url, options):
+        self.client.logout()
+        if role != 'anonymous':
+            self.client.force_login(self.data[role])
+        method = getattr(self.client, options.get('method', 'get'))
+        if 'query' in options:
+            url += '?' + options['query'](self.data)
+        # Les autres options (data, headers, content_type...) sont passées au client de test
+        kwargs = {key: value(self.data) if callable(value) else value
+                  for key, value in options.items() if key not in ('method', 'query')}
+
+        # Un premier appel remplit les caches (menus, rosters...), le second est mesuré
+        method(url, **kwargs)
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            response = method(url, **kwargs)
+            if response.streaming:
+                b''.join(response.streaming_content)
+            elapsed = (time.perf_counter() - start) * 1000
+        return response, len(queries), elapsed
+
+    def assert_budgets(self, budgets):
+        for name, role, status_code, kwargs, max_queries, max_ms, *options in budgets:
+            options = options[0] if options else {}
+            with self.subTest(url=name, role=role):
+                url = reverse(name, kwargs=kwargs(self.data))
+                response, nb_queries, elapsed = self.request_as(role, url, options)
+                # Une vue qui refuse l'accès à tort respecterait trivialement son budget
+                self.assertEqual(response.status_code, status_code, f"{name} ({role})")
+                self.assertLessEqual(nb_queries, max_queries, f"{name} ({role}) : {nb_queries} requêtes")
+                if CHECK_LATENCY_BUDGETS:
+                    self.assertLessEqual(elapsed, max_ms, f"{name} ({role}) : {elapsed:.0f} ms")
+
+    def assert_all_urls_budgeted(self, urlpatterns, app_name, budgets, excluded=(), single_role=()):
+        """
+        Chaque URL a un budget côté joueur (rôle 'player' ou 'pnj') et côté orga,
+        sauf celles de excluded (aucun budget) et de single_role (un seul rôle)
+        """
+        roles = defaultdict(set)
+        for name, role, *_ in budgets:
+            roles[name.split(':')[1]].add(role)
+        for pattern in urlpatterns:
+            if pattern.name in excluded:
+                continue
+            self.assertIn(pattern.name, roles, f"Pas de budget pour {app_name}:{pattern.name}")
+            if pattern.name not in single_role:
+                self.assertIn('orga', roles[pattern.name], f"Pas de budget orga pour {app_name}:{pattern.name}")
+                self.assertTrue(roles[pattern.name] & {'player', 'pnj'},
+                                f"Pas de budget joueur pour {app_name}:{pattern.name}")
+
+
+# Budgets des vues larp : (URL, rôle, code HTTP, kwargs, requêtes max, ms max[, options])
+LARP_BUDGETS = [
+    ('larp:character_list', 'player', 200, lambda d: {}, 18, 300),
+    # L'orga du jeu de données n'a pas de profil complété : renvoyé vers son profil
+    ('larp:character_list', 'orga', 302, lambda d: {}, 8, 100),
+    ('larp:profile', 'player', 200, lambda d: {'user_id': d['player'].pk}, 18, 300),
+    ('larp:profile', 'orga', 200, lambda d: {'user_id': d['player'].pk}, 18, 300),
+    ('larp:profile', 'pnj', 403, lambda d: {'user_id': d['player'].pk}, 4, 100),
+    ('larp:my-profile', 'player', 302, lambda d: {}, 3, 100),
+    ('larp:my-profile', 'orga', 302, lambda d: {}, 3, 100),
+    ('larp:view_profile_pdf', 'player', 200, lambda d: {'user_id': d['player'].pk}, 6, 500),
+    ('larp:view_profile_pdf', 'orga', 200, lambda d: {'user_id': d['player'].pk}, 7, 500),
+    ('larp:view_profile_pdf', 'pnj', 403, lambda d: {'user_id': d['player'].pk}, 4, 100),
+    ('larp:pnj_form', 'pnj', 200, lambda d: {'pk': d['pnj_infos'].pk}, 17, 300),
+    ('larp:pnj_form', 'orga', 200, lambda d: {'pk': d['pnj_infos'].pk}, 17, 300),
+    ('larp:view_pnj', 'pnj', 200, lambda d: {'pnjinfos_id': d['pnj_infos'].pk}, 17, 300),
+    ('larp:view_pnj', 'orga', 200, lambda d: {'pnjinfos_id': d['pnj_infos'].pk}, 18, 300),
+    ('larp:view_pnj', 'player', 403, lambda d: {'pnjinfos_id': d['pnj_infos'].pk}, 7, 100),
+    ('larp:view_pnj_pdf', 'pnj', 200, lambda d: {'pnjinfos_id': d['pnj_infos'].pk}, 5, 500),
+    ('larp:view_pnj_pdf', 'orga', 200, lambda d: {'pnjinfos_id': d['pnj_infos'].pk}, 7, 500),
+    ('larp:view_pnj_pdf', 'player', 403, lambda d: {'pnjinfos_id': d['pnj_infos'].pk}, 6, 100),
+    ('larp:create_pj', 'player', 200, lambda d: {'inscription_id': d['inscription'].pk}, 17, 300),
+    ('larp:create_pj', 'orga', 200, lambda d: {'inscription_id': d['inscription'].pk}, 17, 300),
+    ('larp:edit_pj', 'player', 200, lambda d: {'pjinfos_id': d['pj_infos'].pk}, 17, 300),
+    ('larp:edit_pj', 'orga', 200, lambda d: {'pjinfos_id': d['pj_infos'].pk}, 17, 300),
+    ('larp:change_pj_status', 'player', 302, lambda d: {'pjinfos_id': d['pj_infos'].pk}, 10, 200,
+     {'method': 'post', 'data': lambda d: {'status': 'PLAYER_VALIDATED'}}),
+    ('larp:change_pj_status', 'orga', 302, lambda d: {'pjinfos_id': d['pj_infos'].pk}, 10, 200,
+     {'method': 'post', 'data': lambda d: {'status': 'PLAYER_VALIDATED'}}),
+    ('larp:change_pj_status', 'pnj', 403, lambda d: {'pjinfos_id': d['pj_infos'].pk}, 7, 100,
+     {'method': 'post', 'data': lambda d: {'status': 'PLAYER_VALIDATED'}}),
+    ('larp:change_pnj_status', 'pnj', 302, lambda d: {'pnjinfos_id': d['pnj_infos'].pk}, 10, 200,
+     {'method': 'post', 'data': lambda d: {'completed': 1}}),
+    ('larp:change_pnj_status', 'orga', 302, lambda d: {'pnjinfos_id': d['pnj_infos'].pk}, 10, 200,
+     {'method': 'post', 'data': lambda d: {'completed': 1}}),
+    ('larp:change_pnj_status', 'player', 403, lambda d: {'pnjinfos_id': d['pnj_infos'].pk}, 7, 100,
+     {'method': 'post', 'data': lambda d: {'completed': 1}}),
+    ('larp:view_pj', 'player', 200, lambda d: {'pjinfos_id': d['pj_infos'].pk}, 18, 300),
+    ('larp:view_pj', 'orga', 200, lambda d: {'pjinfos_id': d['pj_infos'].pk}, 18, 300),
+    ('larp:view_pj', 'pnj', 403, lambda d: {'pjinfos_id': d['pj_infos'].pk}, 6, 100),
+    ('larp:view_pj_pdf', 'player', 200, lambda d: {'pjinfos_id': d['pj_infos'].pk}, 5, 500),
+    ('larp:view_pj_pdf', 'orga', 200, lambda d: {'pjinfos_id': d['pj_infos'].pk}, 7, 500),
+    ('larp:view_pj_pdf', 'pnj', 403, lambda d: {'pjinfos_id': d['pj_infos'].pk}, 6, 100),
+    ('larp:complete_bg', 'player', 200, lambda d: {'pjinfos_id': d['pj_infos'].pk}, 17, 300),
+    ('larp:player_document', 'orga', 200, lambda d: {'pjinfos_id': d['pj_infos'].pk}, 8, 200,
+     {'method': 'post', 'data': lambda d: {'name': "Plan", 'document_url': "https://example.com/plan.pdf"}}),
+    ('larp:player_document', 'player', 403, lambda d: {'pjinfos_id': d['pj_infos'].pk}, 6, 100,
+     {'method': 'post', 'data': lambda d: {'name': "Plan", 'document_url': "https://example.com/plan.pdf"}}),
+    ('larp:edit_bg_choice', 'player', 200, lambda d: {'bgchoice_id': d['answer'].pk}, 6, 200),
+    ('larp:edit_bg_choice', 'orga', 200, lambda d: {'bgchoice_id': d['answer'].pk}, 8, 200),
+    ('larp:edit_bg_choice', 'pnj', 403, lambda d: {'bgchoice_id': d['answer'].pk}, 6, 100),
+    ('larp:bg_steps', 'orga', 200, lambda d: {'faction_id': d['faction'].pk}, 17, 300),
+    ('larp:bg_steps', 'player', 403, lambda d: {'faction_id': d['faction'].pk}, 6, 100),
+    ('larp:bg_step_change_nb', 'orga', 302, lambda d: {'faction_id': d['faction'].pk}, 12, 200,
+     {'query': lambda d: f"action=up&step_id={d['bg_step'].pk}"}),
+    ('larp:bg_step_change_nb', 'player', 403, lambda d: {'faction_id': d['faction'].pk}, 9, 100,
+     {'query': lambda d: f"action=up&step_id={d['bg_step'].pk}"}),
+    ('larp:bg_steps_reorder', 'orga', 200, lambda d: {'faction_id': d['faction'].pk}, 9, 200,
+     {'method': 'post', 'data': lambda d: {'order': list(larp_models.BgStep.objects.filter(faction=d['faction']).
+                                                          order_by('step').values_list('pk', flat=True))}}),
+    ('larp:bg_steps_reorder', 'player', 403, lambda d: {'faction_id': d['faction'].pk}, 6, 100,
+     {'method': 'post', 'data': lambda d: {'order': []}}),
+    ('larp:bg_choices', 'orga', 200, lambda d: {'bg_step_id': d['bg_step'].pk}, 18, 300),
+    ('larp:bg_choices', 'player', 403, lambda d: {'bg_step_id': d['bg_step'].pk}, 6, 100),
+    ('larp:bg_choice_requisit', 'orga', 200, lambda d: {'bg_choice_id': d['bg_choice'].pk}, 19, 300),
+    ('larp:bg_choice_requisit', 'player', 403, lambda d: {'bg_choice_id': d['bg_choice'].pk}, 6, 100),
+    ('larp:orga_gn_list', 'orga', 200, lambda d: {}, 17, 300),
+    ('larp:orga_gn_list', 'player', 200, lambda d: {}, 15, 300),
+    ('larp:orga_gn', 'orga', 200, lambda d: {'larp_id': d['larp'].pk}, 18, 300),
+    ('larp:orga_gn', 'player', 403, lambda d: {'larp_id': d['larp'].pk}, 5, 100),
+    ('larp:orga_gn_faction', 'orga', 200, lambda d: {'larp_id': d['larp'].pk, 'faction_id': d['faction'].pk}, 8, 300),
+    ('larp:orga_gn_faction', 'player', 403, lambda d: {'larp_id': d['larp'].pk, 'faction_id': d['faction'].pk}, 6, 100),
+    ('larp:orga_gn_pnjv', 'orga', 200, lambda d: {'larp_id': d['larp'].pk}, 7, 200),
+    ('larp:orga_gn_pnjv', 'player', 403, lambda d: {'larp_id': d['larp'].pk}, 6, 100),
+    ('larp:orga_sales', 'orga', 200, lambda d: {'larp_id': d['larp'].pk}, 19, 300),
+    ('larp:orga_sales', 'player', 403, lambda d: {'larp_id': d['larp'].pk}, 6, 100),
+    ('larp:orga_export_pdf', 'orga', 200, lambda d: {'larp_id': d['larp'].pk}, 12, 5000,
+     {'query': lambda d: f"faction={d['faction'].pk}"}),
+    ('larp:orga_export_pdf', 'player', 403, lambda d: {'larp_id': d['larp'].pk}, 6, 100),
+]
+
+# Vues sans budget, et pourquoi
+LARP_EXCLUDED_URLS = {
+    'test': "vue de débogage qui ne renvoie pas de réponse",
+    'my_inscriptions': "le gabarit référence l'URL larp:security_form, qui n'existe pas",
+}
+
+# Vues budgétées pour un seul rôle, et pourquoi
+LARP_SINGLE_ROLE_URLS = {
+    'complete_bg': "questionnaire rempli par le joueur pour sa propre fiche",
+}
+
+
+class QueryBudgetTests(QueryBudgetMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.seed_budget_dataset()
+
+    def setUp(self):
+        set_current_user(None)
+        cache.clear()
+
+    def test_every_larp_url_has_a_budget(self):
+        from larp.urls import urlpatterns
+        self.assert_all_urls_budgeted(urlpatterns, 'larp', LARP_BUDGETS, LARP_EXCLUDED_URLS, LARP_SINGLE_ROLE_URLS)
+
+    def test_larp_views_within_budget(self):
+        self.assert_budgets(LARP_BUDGETS)
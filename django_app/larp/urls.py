@@ -42,8 +42,13 @@ urlpatterns = [
     # Vues orga
     path('bg_steps/<int:faction_id>', views.bg_steps, name='bg_steps'),
     path('bg_step_change_nb/<int:faction_id>', views.bg_step_change_nb, name='bg_step_change_nb'),
+    path('bg_steps_reorder/<int:faction_id>', views.bg_steps_reorder, name='bg_steps_reorder'),
     path('bg_choices/<int:bg_step_id>', views.bg_choices, name='bg_choices'),
     path('bg_choice_requisit/<int:bg_choice_id>', views.bg_choice_requisit, name='bg_choice_requisit'),
     path('orga_gn_list', views.orga_gn_list, name='orga_gn_list'),
-    path('orga_gn/<int:larp_id>', views.orga_gn, name='orga_gn')
+    path('orga_gn/<int:larp_id>', views.orga_gn, name='orga_gn'),
+    path('orga_gn/<int:larp_id>/faction/<int:faction_id>', views.orga_gn_faction, name='orga_gn_faction'),
+    path('orga_gn/<int:larp_id>/pnjv', views.orga_gn_pnjv, name='orga_gn_pnjv'),
+    path('orga_gn/<int:larp_id>/export_pdf', views.orga_export_pdf, name='orga_export_pdf'),
+    path('orga_gn/<int:larp_id>/sales', views.orga_sales, name='orga_sales'),
 ]
@@ -1,54 +1,92 @@
+from collections import defaultdict
 from django.http import HttpRequest
+from django.db.models import OuterRef, Subquery
 from larp import models as larp_models
 from django.contrib.auth.models import User
 from django.core.exceptions import PermissionDenied
-from reportlab.platypus import TableStyle
-from reportlab.lib.styles import ParagraphStyle
-from reportlab.lib import colors
 
 
 class CurrentInscription():
-    def __init__(self, inscription: larp_models.Inscription):
+    def __init__(self, inscription: larp_models.Inscription, pj_infos=None, pnj_infos=None):
+        """pj_infos et pnj_infos : fiches de l'utilisateur pour ce GN, déjà chargées"""
         self.access_type = inscription.access_type
         self.created_at = inscription.created_at
         self.can_add_character = False
         self.larp_id = inscription.opus.larp.pk
         self.inscription_id = inscription.pk
         self.sheet_creation_opened = inscription.opus.larp.sheet_creation_opened
+        self.pj_infos = []
+        self.pnj_infos = None
 
         if self.access_type == larp_models.AccessType.PJ or self.access_type == larp_models.AccessType.PNJF:
-            self.pj_infos = larp_models.PjInfos.objects.filter(user=inscription.user, larp=inscription.opus.larp)
+            self.pj_infos = pj_infos or []
 
             if len(self.pj_infos) < 2:
                 self.can_add_character = True
 
         if self.access_type == larp_models.AccessType.PNJF or self.access_type == larp_models.AccessType.PNJV:
-            self.pnj_infos = larp_models.PnjInfos.objects.get(user=inscription.user, larp=inscription.opus.larp)
+            self.pnj_infos = pnj_infos
 
 
 """
 Retourne un dictionnaire sous la forme
 [larp_name] -> inscription
+en ne gardant que la dernière inscription de chaque GN.
+3 requêtes, quel que soit le nombre d'opus auxquels l'utilisateur a participé.
 """
 def only_last_inscriptions(user: User):
-    
-    inscriptions = larp_models.Inscription.objects.select_related('opus__larp').filter(user=user)
+    # La dernière inscription de l'utilisateur pour le GN de chaque inscription
+    last_inscription = larp_models.Inscription.objects.filter(
+        user=OuterRef('user'),
+        opus__larp=OuterRef('opus__larp')
+    ).order_by('-created_at', '-pk').values('pk')[:1]
+    inscriptions = list(larp_models.Inscription.objects.
+                        select_related('opus__larp').
+                        filter(user=user, pk=Subquery(last_inscription)).
+                        order_by('pk'))
+    larp_ids = [i.opus.larp_id for i in inscriptions]
+
+    pj_infos_by_larp = defaultdict(list)
+    for pj_infos in larp_models.PjInfos.objects.select_related('faction').\
+                    filter(user=user, larp_id__in=larp_ids).order_by('pk'):
+        pj_infos_by_larp[pj_infos.larp_id].append(pj_infos)
+    pnj_infos_by_larp = {p.larp_id: p for p in larp_models.PnjInfos.objects.filter(user=user, larp_id__in=larp_ids)}
+
     larps = {}
     for i in inscriptions:
-        if not i.opus.larp.name in larps:
-            larps[i.opus.larp.name] = CurrentInscription(i)
-        else:
-            current_inscription = larps[i.opus.larp.name]
-            if i.created_at > current_inscription.created_at:
-                larps[i.opus.larp.name] = CurrentInscription(i)
+        larp_id = i.opus.larp_id
+        larps[i.opus.larp.name] = CurrentInscription(i, pj_infos_by_larp[larp_id], pnj_infos_by_larp.get(larp_id))
 
     return larps
 
 
-def has_orga_permission(user: User, larp: larp_models.Larp, raise_exception=True):
+def get_orga_larp_ids(user: User) -> frozenset:
+    """
+    Identifiants des GN dont l'utilisateur est orga.
+    Chargés en une requête puis mémorisés sur l'objet user, qui vit le temps
+    de la requête HTTP (request.user) : les vérifications suivantes sont gratuites.
+    """
+    if not user.is_authenticated:
+        return frozenset()
+    if not hasattr(user, '_orga_larp_ids'):
+        user._orga_larp_ids = frozenset(
+            larp_models.Larp.objects.filter(orga_group__user=user).values_list('pk', flat=True))
+    return user._orga_larp_ids
+
+
+def clear_orga_larp_ids(user: User):
+    """A appeler quand les groupes de l'utilisateur changent (voir signals)"""
+    user.__dict__.pop('_orga_larp_ids', None)
+
+
+def is_orga_for(user: User, larp_id: int) -> bool:
     if user.is_superuser:
         return True
-    if user.groups.filter(pk=larp.orga_group.pk).exists():
+    return larp_id in get_orga_larp_ids(user)
+
+
+def has_orga_permission(user: User, larp_id: int, raise_exception=True):
+    if is_orga_for(user, larp_id):
         return True
     if raise_exception:
             raise PermissionDenied
@@ -64,37 +102,3 @@ def orga_or_denied(request:HttpRequest, raise_exception=True):
         return True
     if raise_exception:
             raise PermissionDenied
-    
-PDF_TABLE_STYLE = TableStyle([
-        ('BACKGROUND', (0, 0), (0, -1), colors.lightgrey),
-        ('TEXTCOLOR', (0, 0), (-1, -1), colors.black),
-        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-        ('FONTNAME', (0, 0), (-1, -1), 'Helvetica'),
-        ('FONTSIZE', (0, 0), (-1, -1), 10),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 12),
-        ('BACKGROUND', (1, 0), (1, -1), colors.beige),
-        ('GRID', (0, 0), (-1, -1), 1, colors.black)
-    ])
-
-
-def get_pdf_custom_styles(generic_styles):
-    title_style = ParagraphStyle(
-        'CustomTitle',
-        parent=generic_styles['Heading1'],
-        fontSize=18,
-        spaceAfter=30,
-        alignment=1,  # Center alignment
-    )
-    heading_style = ParagraphStyle(
-        'CustomHeading',
-        parent=generic_styles['Heading2'],
-        fontSize=14,
-        spaceAfter=12,
-        spaceBefore=20,
-    )
-    indent_style = ParagraphStyle(
-        'CustomIndentedParagraph',
-        parent=generic_styles['Normal'],
-        leftIndent=8
-    )
-    return title_style, heading_style, indent_style
\ No newline at end of file
@@ -5,19 +5,18 @@ from django.http.request import HttpRequest
 from django.contrib.auth.models import User, Group
 from django.db import models
 from django.db.models import Q
-from django.http import HttpResponse
-from reportlab.lib.pagesizes import A4
-from reportlab.lib.styles import getSampleStyleSheet
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table
-from reportlab.lib.units import mm
-from io import BytesIO
+from django.http import HttpResponse, StreamingHttpResponse
 from django.db import transaction
 from django_htmx.http import HttpResponseClientRedirect
 from django.contrib import messages
+from django.utils.http import content_disposition_header
 
 from .models import Profile, Inscription, PnjInfos,PjInfos, Larp, Opus, BgStep, BgChoice, Character_Bg_choices, Faction
 from larp.forms import PjDocumentForm, ProfileForm, PnjInfosForm, PjInfosForm, BgAnswerForm, BgStepForm, BgChoiceForm, PjStatusForm, CharacterBgTextForm
-from larp.utils import has_orga_permission, orga_or_denied, get_pdf_custom_styles, PDF_TABLE_STYLE
+from larp.utils import get_orga_larp_ids, has_orga_permission, is_orga_for, orga_or_denied
+from larp.pdf import pdf_response, render_pdfs, stream_zip, pj_sheet, pnj_sheet, profile_sheet
+from larp.roster import get_faction_roster, get_pnjv_roster
+from larp.bg_graph import available_choices, get_bg_analysis, get_bg_graph, is_last_step, reorder_bg_steps
 from django.core.exceptions import BadRequest, PermissionDenied
 
     
@@ -86,7 +85,7 @@ def edit_bg_choice(request: HttpRequest, bgchoice_id: int):
     charac_choice = Character_Bg_choices.objects.select_related('pjInfos__larp', 'pjInfos__user').get(pk=bgchoice_id)
     larp = charac_choice.pjInfos.larp
     if request.user.pk != charac_choice.pjInfos.user.pk:
-        has_orga_permission(request.user, larp)
+        has_orga_permission(request.user, larp.pk)
 
     if request.method == "GET":
         form = CharacterBgTextForm(instance=charac_choice)
@@ -109,7 +108,7 @@ def edit_bg_choice(request: HttpRequest, bgchoice_id: int):
 @login_required
 def player_document(request: HttpRequest, pjinfos_id: int):
     pj_infos = PjInfos.objects.select_related('larp').get(pk=pjinfos_id)
-    has_orga_permission(request.user, pj_infos.larp)
+    has_orga_permission(request.user, pj_infos.larp_id)
 
     if request.method == "POST":
         document_form = PjDocumentForm(request.POST)
@@ -141,8 +140,7 @@ def orga_gn_list(request: HttpRequest):
     if request.user.is_superuser:
         user_orga_larps = Larp.objects.all()
     else:
-        user_groups_id = request.user.groups.all().values_list('pk')
-        user_orga_larps = Larp.objects.filter(orga_group_id__in=user_groups_id)
+        user_orga_larps = Larp.objects.filter(pk__in=get_orga_larp_ids(request.user))
     context = {
         'larps': user_orga_larps
     }
@@ -151,31 +149,47 @@ def orga_gn_list(request: HttpRequest):
                 context)
 
 
-def orga_gn_pnjv(request: HttpRequest, last_opus, larp, factions):
-    pnjv_user_ids = Inscription.objects.filter(opus=last_opus, access_type='PNJV').values_list('user_id', flat=True)
-    pnjv_list = list(PnjInfos.objects.filter(larp=larp, user_id__in=pnjv_user_ids).select_related('user').order_by('user__last_name', 'user__first_name'))
+def get_orga_opus(request: HttpRequest, larp_id):
+    larp = get_object_or_404(Larp, pk=larp_id)
+    has_orga_permission(request.user, larp.pk)
+    try:
+        last_opus = Opus.objects.filter(larp_id=larp_id).latest('created_at')
+    except Opus.DoesNotExist:
+        last_opus = None
+    return larp, last_opus
 
-    context = {
-        'larp': larp,
-        'opus': last_opus,
-        'pnjv_list': pnjv_list,
-        'factions': factions,
-        'selected_faction': 'PNJV',
-    }
 
-    return render(request, 'larp/orga/orga_gn.html', context)
+@login_required
+def orga_gn_pnjv(request: HttpRequest, larp_id):
+    larp, last_opus = get_orga_opus(request, larp_id)
+    if last_opus is None:
+        raise BadRequest("No opus for this larp")
+
+    return render(request, 'larp/orga/orga_gn.html#pnjv-section',
+                  {
+                      'pnjv_list': get_pnjv_roster(larp, last_opus),
+                  })
+
+
+@login_required
+def orga_gn_faction(request: HttpRequest, larp_id, faction_id):
+    larp, last_opus = get_orga_opus(request, larp_id)
+    if last_opus is None:
+        raise BadRequest("No opus for this larp")
+    faction = get_object_or_404(Faction, pk=faction_id, larp=larp)
+
+    return render(request, 'larp/orga/orga_gn.html#faction-section',
+                  {
+                      'faction_info': get_faction_roster(larp, last_opus, faction),
+                  })
 
 
 @login_required
 def orga_gn(request: HttpRequest, larp_id):
-    from .models import Faction  # local import to avoid circulars in headings
-    larp = Larp.objects.get(pk=larp_id)
-    has_orga_permission(request.user, larp)
-    try:
-        last_opus = Opus.objects.filter(larp_id=larp_id).latest('created_at')
-    except Opus.DoesNotExist:
+    larp, last_opus = get_orga_opus(request, larp_id)
+    if last_opus is None:
         return render(request, 'larp/simple.html', {'message': "Erreur : aucun opus créé pour ce GN"})
-    factions = Faction.objects.filter(larp=larp).order_by('name')
+    factions = list(Faction.objects.filter(larp=larp).order_by('name'))
 
 
     # Get selected faction from query parameters
@@ -183,80 +197,123 @@ def orga_gn(request: HttpRequest, larp_id):
     selected_faction = None
     if selected_faction_id:
         if selected_faction_id == 'PNJV':
-            return orga_gn_pnjv(request, last_opus, larp, factions)
+            selected_faction = 'PNJV'
         else:
-            try:
-                selected_faction = Faction.objects.get(pk=selected_faction_id, larp=larp)
-            except Faction.DoesNotExist:
-                selected_faction = None
-
-        
-    factions_to_process = factions if selected_faction is None else [selected_faction]
-    
-    # Get all inscriptions for the latest opus
-    inscriptions = Inscription.objects.filter(opus=last_opus).select_related('user', 'faction')
-    
-    # Create faction data with both PJ and PNJF lists
-    faction_data = []
-    
-    for faction in factions_to_process:
-        # Pure PJ users (access_type = 'PJ')
-        pj_users = inscriptions.filter(faction=faction, access_type='PJ').values_list('user_id', flat=True)
-        pj_list = PjInfos.objects.filter(faction=faction, user_id__in=pj_users)
-        pj_users = User.objects.filter(pk__in=pj_users)
-        pj_ordered_list = []
-        for user in pj_users:
-            pj_infos = list(pj_list.filter(user=user))
-            pj1 = None
-            pj2 = None
-            if len(pj_infos) > 0:
-                pj1 = pj_infos[0]
-            if len(pj_infos) > 1:
-                pj2 = pj_infos[1]
-            pj_ordered_list.append({
-                'user': user,
-                'pj1': pj1,
-                'pj2': pj2
-            })
-        # PNJF users (access_type = 'PNJF') - have both PJ and PNJ sheets
-        pnjf_users = inscriptions.filter(faction=faction, access_type='PNJF').values_list('user_id', flat=True)
-        pnjf_list = []
-        pnjf_users = User.objects.filter(pk__in=pnjf_users)
-        for user in pnjf_users:
-            try:
-                pj_infos = list(PjInfos.objects.filter(faction=faction, user=user))
-                pnj_infos = PnjInfos.objects.get(user=user, larp_id=larp_id)
-                pnjf_list.append({
-                    'user': user,
-                    'pj_infos': pj_infos,
-                    'pnj_infos': pnj_infos
-                })
-            except (PjInfos.DoesNotExist, PnjInfos.DoesNotExist):
-                # Skip if either sheet is missing
-                continue
-        
-        faction_data.append({
-            'faction': faction,
-            'pj_list': pj_ordered_list,
-            'pnjf_list': pnjf_list
-        })
+            selected_faction = next((f for f in factions if str(f.pk) == selected_faction_id), None)
 
-    # PNJV: PNJ volant have no faction; take users with PNJV inscription on latest opus
-    pnjv_user_ids = Inscription.objects.filter(opus=last_opus, access_type='PNJV').values_list('user_id', flat=True)
-    pnjv_list = list(PnjInfos.objects.filter(larp=larp, user_id__in=pnjv_user_ids).select_related('user').order_by('user__last_name', 'user__first_name'))
+    if selected_faction is None:
+        factions_to_process = factions
+    elif selected_faction == 'PNJV':
+        factions_to_process = []
+    else:
+        factions_to_process = [selected_faction]
 
+    # Les tableaux de chaque faction (et des PNJV) sont chargés en htmx
+    # par orga_gn_faction / orga_gn_pnjv quand ils deviennent visibles
     context = {
         'larp': larp,
         'opus': last_opus,
-        'faction_data': faction_data,
-        'pnjv_list': pnjv_list,
         'factions': factions,
+        'factions_to_process': factions_to_process,
         'selected_faction': selected_faction,
     }
 
     return render(request, 'larp/orga/orga_gn.html', context)
 
 
+@login_required
+def orga_sales(request: HttpRequest, larp_id):
+    """Tableau de bord des ventes d'un opus (par défaut le dernier) ou de tous les opus (?opus=all)"""
+    from payments.analytics import sales_dashboard
+
+    larp = get_object_or_404(Larp, pk=larp_id)
+    has_orga_permission(request.user, larp.pk)
+    opus_list = list(Opus.objects.filter(larp=larp).order_by('created_at'))
+    if not opus_list:
+        return render(request, 'larp/simple.html', {'message': "Erreur : aucun opus créé pour ce GN"})
+
+    selected = request.GET.get('opus')
+    if selected == 'all':
+        selected_opus = None
+        opus_ids = [o.pk for o in opus_list]
+    else:
+        selected_opus = next((o for o in opus_list if str(o.pk) == selected), opus_list[-1])
+        opus_ids = [selected_opus.pk]
+
+    context = {
+        'larp': larp,
+        'opus_list': opus_list,
+        'selected_opus': selected_opus,
+        'sales': sales_dashboard(opus_ids, Faction.objects.filter(larp=larp).order_by('name')),
+    }
+    return render(request, 'larp/orga/orga_sales.html', context)
+
+
+NO_FACTION_FOLDER = "Sans faction"
+
+
+def iter_export_sheets(larp, opus, faction=None):
+    """
+    Fiches (PJ puis PNJ) des inscrits d'un opus, éventuellement limitées à une
+    faction, sous la forme (nom de fichier dans le ZIP, blocs du PDF)
+    """
+    inscriptions = Inscription.objects.filter(opus=opus).select_related('faction')
+    if faction is not None:
+        inscriptions = inscriptions.filter(faction=faction)
+    inscription_by_user = {i.user_id: i for i in inscriptions}
+
+    def folder(name):
+        return name.replace('/', '-')
+
+    played_user_ids = [user_id for user_id, i in inscription_by_user.items() if i.access_type != 'PNJV']
+    pj_list = PjInfos.objects.filter(larp=larp, user_id__in=played_user_ids).\
+                select_related('faction', 'larp', 'user').\
+                prefetch_related(models.Prefetch(
+                    'character_bg_choices_set',
+                    queryset=Character_Bg_choices.objects.select_related('bgchoice__bg_step').order_by('step'))).\
+                order_by('faction__name', 'name')
+    if faction is not None:
+        pj_list = pj_list.filter(faction=faction)
+    for pj_infos in pj_list.iterator(chunk_size=100):
+        filename = f"{folder(pj_infos.faction.name)}/personnage_{folder(pj_infos.name)}_{pj_infos.pk}.pdf"
+        yield filename, pj_sheet(pj_infos, pj_infos.character_bg_choices_set.all())
+
+    pnj_user_ids = [user_id for user_id, i in inscription_by_user.items() if i.access_type != 'PJ']
+    pnj_list = PnjInfos.objects.filter(larp=larp, user_id__in=pnj_user_ids).\
+                select_related('larp', 'user').\
+                order_by('user__last_name', 'user__first_name')
+    for pnj_infos in pnj_list.iterator(chunk_size=100):
+        inscription = inscription_by_user[pnj_infos.user_id]
+        if inscription.access_type == 'PNJV':
+            pnj_folder = 'PNJV'
+        elif inscription.faction is None:
+            # Faction pas encore attribuée (inscription créée depuis l'admin)
+            pnj_folder = NO_FACTION_FOLDER
+        else:
+            pnj_folder = folder(inscription.faction.name)
+        user = pnj_infos.user
+        filename = f"{pnj_folder}/pnj_{folder(user.first_name)}_{folder(user.last_name)}_{pnj_infos.pk}.pdf"
+        yield filename, pnj_sheet(pnj_infos, inscription)
+
+
+@login_required
+def orga_export_pdf(request: HttpRequest, larp_id):
+    """Export ZIP de toutes les fiches PDF du dernier opus, ou d'une faction (GET parameter : faction)"""
+    larp, last_opus = get_orga_opus(request, larp_id)
+    if last_opus is None:
+        raise BadRequest("No opus for this larp")
+    faction = None
+    if request.GET.get('faction'):
+        faction = get_object_or_404(Faction, pk=request.GET['faction'], larp=larp)
+
+    # Les PDF sont générés en parallèle et le ZIP envoyé au fur et à mesure
+    sheets = iter_export_sheets(larp, last_opus, faction)
+    response = StreamingHttpResponse(stream_zip(render_pdfs(sheets)), content_type='application/zip')
+    filename = f"fiches_{last_opus.name}" if faction is None else f"fiches_{last_opus.name}_{faction.name}"
+    response['Content-Disposition'] = content_disposition_header(True, f"{filename}.zip")
+    return response
+
+
 @login_required
 def change_pnj_status(request: HttpRequest, pnjinfos_id):
     from django.core.exceptions import BadRequest, PermissionDenied
@@ -266,7 +323,7 @@ def change_pnj_status(request: HttpRequest, pnjinfos_id):
         raise BadRequest("Method not allowed")
     
     completed = bool(request.POST.get('completed', 0))    
-    is_orga = has_orga_permission(request.user, pnj_infos.larp, False)
+    is_orga = is_orga_for(request.user, pnj_infos.larp_id)
     if not is_orga:
         if request.user.pk != pnj_infos.user.pk or \
             completed is not True:
@@ -287,7 +344,7 @@ def change_pj_status(request: HttpRequest, pjinfos_id):
     if status not in list(PjInfos.SHEET_STATUS.__members__.keys()):
         raise BadRequest("Unknown status")
     
-    is_orga = has_orga_permission(request.user, pj_infos.larp, False)
+    is_orga = is_orga_for(request.user, pj_infos.larp_id)
     if not is_orga:
         if request.user.pk != pj_infos.user.pk or \
             status != PjInfos.SHEET_STATUS.PLAYER_VALIDATED.name:
@@ -336,7 +393,7 @@ def my_inscriptions(request: HttpRequest):
 @login_required
 def bg_choice_requisit(request: HttpRequest, bg_choice_id: int):
     bg_choice = get_object_or_404(BgChoice.objects.select_related('bg_step__faction__larp'), pk=bg_choice_id)
-    has_orga_permission(request.user, bg_choice.bg_step.faction.larp)
+    has_orga_permission(request.user, bg_choice.bg_step.faction.larp_id)
     bg_steps = BgStep.objects.filter(faction=bg_choice.bg_step.faction, step__lt=bg_choice.bg_step.step)
 
 
@@ -373,7 +430,7 @@ def bg_choice_requisit(request: HttpRequest, bg_choice_id: int):
 @login_required
 def bg_choices(request: HttpRequest, bg_step_id: int):
     bg_step = get_object_or_404(BgStep.objects.select_related('faction__larp'), pk=bg_step_id)
-    has_orga_permission(request.user, bg_step.faction.larp)
+    has_orga_permission(request.user, bg_step.faction.larp_id)
     bg_choices = BgChoice.objects.filter(bg_step=bg_step)
     template = 'larp/orga/bg_choices.html'
     action = 'add-choice'
@@ -422,7 +479,7 @@ def bg_choices(request: HttpRequest, bg_step_id: int):
 @transaction.atomic
 def bg_step_change_nb(request: HttpRequest, faction_id: int):
     faction = get_object_or_404(Faction.objects.select_related('larp'), pk=faction_id)
-    has_orga_permission(request.user, faction.larp)
+    has_orga_permission(request.user, faction.larp_id)
     faction_steps = BgStep.objects.filter(faction_id=faction_id)
     action = request.GET.get('action', None)
     bg_step_id = request.GET.get('step_id', None)
@@ -443,10 +500,26 @@ def bg_step_change_nb(request: HttpRequest, faction_id: int):
 
     return redirect(reverse('larp:bg_steps', kwargs={'faction_id': faction_id}))
 
+@login_required
+def bg_steps_reorder(request: HttpRequest, faction_id: int):
+    """Nouvel ordre complet des étapes, envoyé par le glisser-déposer de bg_steps"""
+    faction = get_object_or_404(Faction.objects.select_related('larp'), pk=faction_id)
+    has_orga_permission(request.user, faction.larp_id)
+    if request.method != "POST":
+        raise BadRequest("Method not allowed")
+
+    try:
+        step_ids = [int(step_id) for step_id in request.POST.getlist('order')]
+        reorder_bg_steps(faction.pk, step_ids)
+    except ValueError as e:
+        raise BadRequest(str(e))
+
+    return HttpResponseClientRedirect(reverse('larp:bg_steps', kwargs={'faction_id': faction_id}))
+
 @login_required
 def bg_steps(request: HttpRequest, faction_id: int):
     faction = get_object_or_404(Faction.objects.select_related('larp'), pk=faction_id)
-    has_orga_permission(request.user, faction.larp)
+    has_orga_permission(request.user, faction.larp_id)
     template = 'larp/orga/bg_steps.html'
     action = 'add-step'
 
@@ -500,6 +573,7 @@ def bg_steps(request: HttpRequest, faction_id: int):
                 "form": form,
                 "faction": faction,
                 "current_steps": current_steps,
+                "analysis": get_bg_analysis(faction.pk),
             })
 
 
@@ -552,73 +626,9 @@ def view_profile_pdf(request: HttpRequest, user_id: int):
     user = User.objects.get(pk=user_id)
     profile = Profile.objects.get(user=user)
     
-    # Create PDF response
-    response = HttpResponse(content_type='application/pdf')
-    response['Content-Disposition'] = f'attachment; filename="fiche_sécurité_{user.first_name}_{user.last_name}.pdf"'
-    
-    # Create PDF document
-    buffer = BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=A4, rightMargin=72, leftMargin=72, topMargin=72, bottomMargin=18)
-    
-    # Get styles
-    styles = getSampleStyleSheet()
-    title_style, heading_style, indent_style = get_pdf_custom_styles(styles)
-    
-    # Build PDF content
-    story = []
-    
-    # Title
-    story.append(Paragraph(f"Fiche Sécurité : {user.first_name} {user.last_name}", title_style))
-    
-    # General Information
-    story.append(Paragraph("Profil utilisateur", heading_style))
-
-    birthdate = profile.birthdate.strftime("%d / %m / %Y")
-    story.append(Paragraph(f"<b>Date de naissance : </b> {birthdate}", styles['Normal']))
-
-    story.append(Spacer(1, 12))
-    pseudos = profile.pseudos.replace('\n', '<br/>')
-    story.append(Paragraph(f"<b>Pseudo sur les réseaux sociaux : </b>", styles['Normal']))
-    story.append(Paragraph(pseudos, indent_style))
-
-    story.append(Spacer(1, 20))
-
-    # Security informations
-    story.append(Paragraph("Informations de sécurité", heading_style))
-
-    story.append(Paragraph(f"<b>Régime alimentaire, allergie ou autre élément de santé : </b>", styles['Normal']))
-    story.append(Paragraph(profile.food.replace('\n', '<br/>'), indent_style))
-
-    story.append(Spacer(1, 12))
-    story.append(Paragraph(f"<b>Personnes avec qui je ne souhaite pas jouer : </b>", styles['Normal']))
-    story.append(Paragraph(profile.unwanted_people.replace('\n', '<br/>'), indent_style))
-    
-    story.append(Spacer(1, 12))
-    xp_gn = Profile.XP_GN[profile.xp_gn].value
-    story.append(Paragraph(f"<b>Expérience GNistique : </b> {xp_gn}", styles['Normal']))
-
-    story.append(Spacer(1, 12))
-    story.append(Paragraph(f"<b>Phobies : </b>", styles['Normal']))
-    story.append(Paragraph(profile.fears.replace('\n', '<br/>'), indent_style))
-
-    story.append(Spacer(1, 12))
-    triggers = [str(t) for t in profile.triggers.all()]
-    story.append(Paragraph(f"<b>Désirs de non jeu / triggers : </b>", styles['Normal']))
-    story.append(Paragraph('<br/>'.join(triggers), indent_style))
-
-    story.append(Spacer(1, 20))
-    story.append(Paragraph("Contacts d'urgence", heading_style))
-    story.append(Paragraph(profile.emergency_contact.replace('\n', '<br/>'), indent_style))
-    
-        # Build PDF
-    doc.build(story)
-    
-    # Get PDF content
-    pdf_content = buffer.getvalue()
-    buffer.close()
-    
-    response.write(pdf_content)
-    return response
+    return pdf_response(request,
+                        profile_sheet(user, profile, profile.triggers.all()),
+                        f"fiche_sécurité_{user.first_name}_{user.last_name}.pdf")
     
 
 @login_required
@@ -652,7 +662,7 @@ def view_pj(request: HttpRequest, pjinfos_id: int):
     
     # Check if user has permission to view this character
     # User can view their own characters or be an orga for the larp
-    is_orga = has_orga_permission(request.user, pj_infos.larp, False)
+    is_orga = is_orga_for(request.user, pj_infos.larp_id)
     if pj_infos.user != request.user and not is_orga:
         raise PermissionDenied()
     
@@ -681,93 +691,14 @@ def view_pj_pdf(request: HttpRequest, pjinfos_id: int):
     
     # Check if user has permission to view this character
     if pj_infos.user != request.user:
-        has_orga_permission(request.user, pj_infos.larp)
+        has_orga_permission(request.user, pj_infos.larp_id)
     
     # Get background choices for this character
     bg_choices = Character_Bg_choices.objects.filter(pjInfos=pj_infos).select_related('bgchoice__bg_step').order_by('step')
     
-    # Create PDF response
-    response = HttpResponse(content_type='application/pdf')
-    response['Content-Disposition'] = f'attachment; filename="personnage_{pj_infos.name}_{pj_infos.larp.name}.pdf"'
-    
-    # Create PDF document
-    buffer = BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=A4, rightMargin=72, leftMargin=72, topMargin=72, bottomMargin=18)
-    
-    # Get styles
-    styles = getSampleStyleSheet()
-    title_style, heading_style, indent_style = get_pdf_custom_styles(styles)
-    
-    # Build PDF content
-    story = []
-    
-    # Title
-    story.append(Paragraph(f"Fiche Personnage: {pj_infos.name}", title_style))
-
-    # Contact Orga
-    story.append(Paragraph("Contact Orga", heading_style))
-    story.append(Paragraph(pj_infos.faction.orga_contact.replace('\n', '<br/>'), indent_style))
-    
-    # General Information
-    story.append(Paragraph("Informations générales", heading_style))
-    
-    general_data = [
-        ['Joueur :', f"{pj_infos.user.first_name} {pj_infos.user.last_name}"],
-        ["Nom d'utilisateur :", f"{pj_infos.user.username}"],
-        [pj_infos.larp.factions_name, pj_infos.faction.name],
-        ['Préférence émotionnelle :', pj_infos.get_emotions_display()],
-    ]
-    
-    general_table = Table(general_data, colWidths=[60*mm,100*mm])
-    general_table.setStyle(PDF_TABLE_STYLE)
-    
-    story.append(general_table)
-    story.append(Spacer(1, 20))
-    
-    # Skills
-    story.append(Paragraph("Compétences", heading_style))
-    story.append(Paragraph(f"<b>Compétences actuelles:</b>", styles['Normal']))
-    story.append(Paragraph(pj_infos.skills.replace('\n', '<br/>'), indent_style))
-    
-    if pj_infos.last_learned:
-        story.append(Spacer(1, 12))
-        story.append(Paragraph(f"<b>Dernière compétence apprise:</b> {pj_infos.last_learned}", styles['Normal']))
-    
-    story.append(Spacer(1, 20))
-    
-    # Objectives
-    if pj_infos.objectives:
-        story.append(Paragraph("Objectifs de jeu", heading_style))
-        story.append(Paragraph(pj_infos.objectives.replace('\n', '<br/>'), indent_style))
-        story.append(Spacer(1, 20))
-    
-    # Background Choices
-    if bg_choices:
-        story.append(Paragraph("Choix de background", heading_style))
-        
-        for bg_choice in bg_choices:
-            story.append(Paragraph(f"<b>Étape {bg_choice.step}: </b><i>{bg_choice.bgchoice.bg_step.question}</i>", styles['Normal']))
-            story.append(Spacer(1, 6))
-            
-            choice_text = bg_choice.bgchoice.text or bg_choice.bgchoice.short_name
-            story.append(Paragraph(f"{choice_text}", styles['Normal']))
-            
-            if bg_choice.player_text:
-                story.append(Spacer(1, 6))
-                story.append(Paragraph(f"<b>Commentaire du joueur:</b>", styles['Normal']))
-                story.append(Paragraph(bg_choice.player_text.replace('\n', '<br/>'), indent_style))
-            
-            story.append(Spacer(1, 15))
-    
-    # Build PDF
-    doc.build(story)
-    
-    # Get PDF content
-    pdf_content = buffer.getvalue()
-    buffer.close()
-    
-    response.write(pdf_content)
-    return response
+    return pdf_response(request,
+                        pj_sheet(pj_infos, bg_choices),
+                        f"personnage_{pj_infos.name}_{pj_infos.larp.name}.pdf")
 
 
 @login_required
@@ -782,7 +713,7 @@ def view_pnj(request: HttpRequest, pnjinfos_id: int):
     # Check if user has permission to view this PNJ info
     # User can view their own PNJ info or be an orga for the larp
     if pnj_infos.user != request.user:
-        has_orga_permission(request.user, pnj_infos.larp)
+        has_orga_permission(request.user, pnj_infos.larp_id)
     
     context = {
         'title': f"Fiche PNJ: {pnj_infos.user.first_name} {pnj_infos.user.last_name}",
@@ -802,120 +733,38 @@ def view_pnj_pdf(request: HttpRequest, pnjinfos_id: int):
     
     # Check if user has permission to view this PNJ info
     if pnj_infos.user != request.user:
-        has_orga_permission(request.user, pnj_infos.larp)
+        has_orga_permission(request.user, pnj_infos.larp_id)
 
     inscription = Inscription.objects.\
-                            select_related('opus__larp').\
+                            select_related('opus__larp', 'faction').\
                             filter(user=pnj_infos.user, opus__larp=pnj_infos.larp).\
                             latest('created_at')
     
-    # Create PDF response
-    response = HttpResponse(content_type='application/pdf')
-    response['Content-Disposition'] = f'attachment; filename="pnj_{pnj_infos.user.first_name}_{pnj_infos.user.last_name}_{pnj_infos.larp.name}.pdf"'
-    
-    # Create PDF document
-    buffer = BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=A4, rightMargin=72, leftMargin=72, topMargin=72, bottomMargin=18)
-    
-    # Get styles
-    styles = getSampleStyleSheet()
-    title_style, heading_style, indent_style = get_pdf_custom_styles(styles)
-    
-    # Build PDF content
-    story = []
-    
-    # Title
-    story.append(Paragraph(f"Fiche PNJ: {pnj_infos.user.first_name} {pnj_infos.user.last_name}", title_style))
-
-    # Contact Orga
-    story.append(Paragraph("Contact Orga", heading_style))
-    if inscription.access_type == 'PNJV':
-        infos_orga = pnj_infos.larp.pnjv_orga_contact
-    else:
-        infos_orga = inscription.faction.orga_contact
-    story.append(Paragraph(infos_orga.replace('\n', '<br/>'), indent_style))
-    
-    # General Information
-    story.append(Paragraph("Informations générales", heading_style))
-    
-    general_data = [
-        ['Joueur :', f"{pnj_infos.user.first_name} {pnj_infos.user.last_name}"],
-        ["Nom d'utilisateur :", f"{pnj_infos.user.username}"],
-        ['Préférence horaire :', pnj_infos.get_prefered_time_display() if pnj_infos.prefered_time else 'Non spécifié'],
-        ['Action de nuit :', 'Oui' if pnj_infos.nigth_action else 'Non' if pnj_infos.nigth_action is not None else 'Non spécifié'],
-    ]
-    
-    general_table = Table(general_data, colWidths=[60*mm,100*mm])
-    general_table.setStyle(PDF_TABLE_STYLE)
-    
-    story.append(general_table)
-    story.append(Spacer(1, 20))
-    
-    # Preferences
-    story.append(Paragraph("Préférences de jeu", heading_style))
-    
-    preferences_data = [
-        ['Logistique (0) vs Rôles (5) :', pnj_infos.get_logistic_or_role_display() if pnj_infos.logistic_or_role is not None else 'Non spécifié'],
-        ['Niveau d\'importance (0-5) :', pnj_infos.get_importance_display() if pnj_infos.importance is not None else 'Non spécifié'],
-    ]
-    
-    preferences_table = Table(preferences_data, colWidths=[60*mm,100*mm])
-    preferences_table.setStyle(PDF_TABLE_STYLE)
-    
-    story.append(preferences_table)
-    story.append(Spacer(1, 20))
-    
-    # Talents
-    if pnj_infos.talent:
-        story.append(Paragraph("Talents particuliers", heading_style))
-        story.append(Paragraph(pnj_infos.talent.replace('\n', '<br/>'), indent_style))
-        story.append(Spacer(1, 20))
-    
-    # Organizer Information
-    if pnj_infos.info_orga:
-        story.append(Paragraph("Informations pour l'organisation", heading_style))
-        story.append(Paragraph(pnj_infos.info_orga.replace('\n', '<br/>'), indent_style))
-        story.append(Spacer(1, 20))
-    
-    # Build PDF
-    doc.build(story)
-    
-    # Get PDF content
-    pdf_content = buffer.getvalue()
-    buffer.close()
-    
-    response.write(pdf_content)
-    return response
+    return pdf_response(request,
+                        pnj_sheet(pnj_infos, inscription),
+                        f"pnj_{pnj_infos.user.first_name}_{pnj_infos.user.last_name}_{pnj_infos.larp.name}.pdf")
 
 
 @login_required
 def complete_bg(request: HttpRequest, pjinfos_id: int):
     pj_infos = PjInfos.objects.select_related('faction').get(pk=pjinfos_id, user=request.user)
     # Determine next step to display: count completed answers for this pj
-    completed_steps = Character_Bg_choices.objects.filter(pjInfos=pj_infos).values_list('step', flat=True)
-    next_step = (max(completed_steps) + 1) if completed_steps else 1
+    character_choices = dict(Character_Bg_choices.objects.filter(pjInfos=pj_infos).values_list('step', 'bgchoice_id'))
+    next_step = (max(character_choices) + 1) if character_choices else 1
 
-    # Find the BgStep for the player's faction and next step
-    try:
-        bg_step = BgStep.objects.get(faction=pj_infos.faction, step=next_step)
-    except BgStep.DoesNotExist:
+    # Le questionnaire de la faction est compilé et mis en cache (larp.bg_graph)
+    graph = get_bg_graph(pj_infos.faction_id)
+    bg_step = graph['steps'].get(next_step)
+    if bg_step is None:
         return redirect(reverse('larp:view_pj', kwargs={'pjinfos_id': pjinfos_id}))
 
-    # Get all choices for this step
-    all_choices_qs = BgChoice.objects.filter(bg_step=bg_step)
-    
-    # Get choices already made by this character
-    character_choices = Character_Bg_choices.objects.filter(pjInfos=pj_infos).values_list('bgchoice', flat=True)
-    
     # Filter choices based on requisit: only show choices with no requisit or where the requisit has been chosen
-    choices_qs = all_choices_qs.filter(
-        Q(requisit__isnull=True) | Q(requisit__in=character_choices)
-    )
+    choices = available_choices(graph, bg_step.step, set(character_choices.values()))
 
     url_validation = reverse('larp:complete_bg', kwargs={'pjinfos_id': pjinfos_id})
 
     if request.method == 'GET':
-        form = BgAnswerForm(choices_qs=choices_qs)
+        form = BgAnswerForm(choices_qs=choices)
         return render(request, 'larp/complete_bg.html', {
             'pj_infos': pj_infos,
             'title': bg_step.short_name,
@@ -925,11 +774,11 @@ def complete_bg(request: HttpRequest, pjinfos_id: int):
         })
 
     if request.method == 'POST':
-        form = BgAnswerForm(request.POST, choices_qs=choices_qs)
+        form = BgAnswerForm(request.POST, choices_qs=choices)
         if form.is_valid():
             selected_choice_id = int(form.cleaned_data['choice'])
             player_text = form.cleaned_data.get('player_text', '')
-            selected_choice = choices_qs.get(pk=selected_choice_id)
+            selected_choice = next(c for c in choices if c.pk == selected_choice_id)
 
             # Create or update the through model for this step
             Character_Bg_choices.objects.update_or_create(
@@ -939,11 +788,7 @@ def complete_bg(request: HttpRequest, pjinfos_id: int):
             )
 
             # Check if this was the last step for this faction
-            max_step_for_faction = BgStep.objects.filter(faction=pj_infos.faction).aggregate(
-                max_step=models.Max('step')
-            )['max_step']
-            
-            if bg_step.step >= max_step_for_faction:
+            if is_last_step(graph, bg_step.step):
                 # This was the last step, mark background as completed
                 pj_infos.bg_completed = True
                 pj_infos.save()
@@ -959,4 +804,4 @@ def complete_bg(request: HttpRequest, pjinfos_id: int):
             'form': form,
             'question': bg_step.question,
             'url_validation': url_validation
-        })
\ No newline at end of file
+        })
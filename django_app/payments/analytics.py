@@ -0,0 +1,162 @@
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from larp.models import AccessType, Inscription, Opus
+from .models import Purchase, SalesSummary
+
+
+def purchase_article(access_type, opus_name):
+    """Libellé d'un achat de place (affichage seulement : voir Purchase.opus et Purchase.access_type)"""
+    return f"Place {access_type} pour {opus_name}"
+
+
+def add_to_summary(opus_id, access_type, faction_id, day, inscriptions=0, purchases=0, revenue_cents=0):
+    """
+    Ajoute (ou retire, avec des valeurs négatives) des ventes à la ligne de synthèse du jour.
+    Un retrait ne crée pas de ligne : sans ligne, il n'y a rien à décompter
+    (et l'opus est peut-être en cours de suppression).
+    """
+    key = {'opus_id': opus_id, 'access_type': access_type, 'faction_key': faction_id or 0, 'day': day}
+    values = {'inscriptions': inscriptions, 'purchases': purchases, 'revenue_cents': revenue_cents}
+    increments = {name: F(name) + value for name, value in values.items()}
+    if SalesSummary.objects.filter(**key).update(**increments) or min(values.values()) < 0:
+        return
+    try:
+        # Point de sauvegarde : un échec ne casse pas la transaction en cours
+        with transaction.atomic():
+            SalesSummary.objects.create(**key, faction_id=faction_id, **values)
+    except IntegrityError:
+        # Ligne créée entre-temps par une autre transaction : la contrainte unique garantit qu'elle est seule
+        SalesSummary.objects.filter(**key).update(**increments)
+
+
+def add_many_to_summary(rows):
+    """
+    Ajoute un lot de ventes à la synthèse, additionnées par clé au préalable :
+    une ou deux requêtes par clé, quelle que soit la taille du lot.
+    rows : tuples (clé, ventes), la clé étant celle de inscription_key et les
+    ventes un dictionnaire d'arguments de add_to_summary.
+    """
+    totals = defaultdict(Counter)
+    for key, values in rows:
+        totals[key].update(values)
+    for key, values in totals.items():
+        add_to_summary(*key, **values)
+
+
+def inscription_key(opus_id, access_type, faction_id, created_at):
+    """Clé de synthèse des ventes d'une inscription (voir larp.signals.inscription_values)"""
+    return (opus_id, access_type, faction_id, timezone.localdate(created_at))
+
+
+def purchase_key(purchase):
+    """Clé de synthèse des ventes d'un achat : la faction est celle de son inscription"""
+    faction_id = purchase.inscription.faction_id if purchase.inscription_id else None
+    return (purchase.opus_id, purchase.access_type, faction_id, purchase.created_at)
+
+
+def purchases_created(purchases):
+    """bulk_create d'achats : à appeler ensuite pour les compter dans la synthèse des ventes"""
+    add_many_to_summary((purchase_key(purchase), {'purchases': 1, 'revenue_cents': purchase.amount_cents})
+                        for purchase in purchases)
+
+
+@transaction.atomic
+def rebuild_sales_summary(larp_id=None) -> int:
+    """
+    Recalcule la synthèse des ventes (de tous les GN, ou d'un seul) à partir
+    des inscriptions et des achats. Retourne le nombre de lignes créées.
+    """
+    opus_qs = Opus.objects.all() if larp_id is None else Opus.objects.filter(larp_id=larp_id)
+    SalesSummary.objects.filter(opus__in=opus_qs).delete()
+
+    totals = defaultdict(lambda: {'inscriptions': 0, 'purchases': 0, 'revenue_cents': 0})
+    for row in Inscription.objects.filter(opus__in=opus_qs).\
+                annotate(day=TruncDate('created_at')).\
+                values('opus_id', 'access_type', 'faction_id', 'day').\
+                annotate(nb=Count('pk')).order_by():
+        totals[(row['opus_id'], row['access_type'], row['faction_id'], row['day'])]['inscriptions'] += row['nb']
+
+    # La faction d'un achat est celle de l'inscription qu'il a créée (aucune si elle a été supprimée)
+    for row in Purchase.objects.filter(opus__in=opus_qs).\
+                values('opus_id', 'access_type', 'inscription__faction_id', 'created_at').\
+                annotate(nb=Count('pk'), cents=Sum('amount_cents')).order_by():
+        total = totals[(row['opus_id'], row['access_type'], row['inscription__faction_id'], row['created_at'])]
+        total['purchases'] += row['nb']
+        total['revenue_cents'] += row['cents']
+
+    rows = SalesSummary.objects.bulk_create([
+        SalesSummary(opus_id=opus_id, access_type=access_type, faction_id=faction_id, faction_key=faction_id or 0,
+                     day=day, **values)
+        for (opus_id, access_type, faction_id, day), values in totals.items()
+    ])
+    return len(rows)
+
+
+def sales_dashboard(opus_ids, factions):
+    """
+    Tableau de bord des ventes d'un ou plusieurs opus, en une requête sur SalesSummary.
+
+    Retourne un dictionnaire :
+    - 'totals' : inscriptions, achats et chiffre d'affaires
+    - 'by_access_type' : mêmes totaux par type de billet
+    - 'by_faction' : inscriptions PJ et PNJF par faction et taux de remplissage
+      des places PJ (None si la faction n'a pas de nombre de places)
+    - 'by_week' : ventes par semaine (lundi), avec le cumul du chiffre d'affaires
+
+    Les montants sont additionnés en centimes (revenue_cents) et donnés aussi en euros (revenue).
+    """
+    rows = list(SalesSummary.objects.filter(opus_id__in=opus_ids).
+                values_list('access_type', 'faction_id', 'day', 'inscriptions', 'purchases', 'revenue_cents'))
+
+    def empty():
+        return {'inscriptions': 0, 'purchases': 0, 'revenue_cents': 0}
+
+    def with_euros(values):
+        return {**values, 'revenue': values['revenue_cents'] / 100}
+
+    totals = empty()
+    by_access_type = {access_type: empty() for access_type in AccessType.values}
+    by_faction = {faction.pk: {'faction': faction, AccessType.PJ: 0, AccessType.PNJF: 0} for faction in factions}
+    by_week = defaultdict(empty)
+    for access_type, faction_id, day, inscriptions, purchases, revenue_cents in rows:
+        week = day - timedelta(days=day.weekday())
+        for total in (totals, by_access_type.setdefault(access_type, empty()), by_week[week]):
+            total['inscriptions'] += inscriptions
+            total['purchases'] += purchases
+            total['revenue_cents'] += revenue_cents
+        if faction_id in by_faction and access_type in (AccessType.PJ, AccessType.PNJF):
+            by_faction[faction_id][access_type] += inscriptions
+
+    faction_rows = []
+    for values in by_faction.values():
+        places = values['faction'].places
+        faction_rows.append({
+            'faction': values['faction'],
+            'pj': values[AccessType.PJ],
+            'pnjf': values[AccessType.PNJF],
+            'places': places,
+            'fill_rate': values[AccessType.PJ] / places if places else None,
+        })
+
+    week_rows = []
+    cumulative_cents = 0
+    max_cents = max((values['revenue_cents'] for values in by_week.values()), default=0) or 1
+    for week in sorted(by_week):
+        values = by_week[week]
+        cumulative_cents += values['revenue_cents']
+        week_rows.append({'week': week, **with_euros(values), 'cumulative_revenue': cumulative_cents / 100,
+                          'bar_width': round(100 * values['revenue_cents'] / max_cents)})
+
+    return {
+        'totals': with_euros(totals),
+        'by_access_type': [{'access_type': access_type, 'label': AccessType(access_type).label, **with_euros(values)}
+                           for access_type, values in by_access_type.items()],
+        'by_faction': faction_rows,
+        'by_week': week_rows,
+    }
@@ -0,0 +1,16 @@
+from django import forms
+from larp import models as larp_models
+
+
+class LedgerFilterForm(forms.Form):
+    """Filtres du registre des achats, limités aux GN dont l'utilisateur est orga"""
+    larp = forms.ModelChoiceField(queryset=larp_models.Larp.objects.none(), required=False, label="GN")
+    opus = forms.ModelChoiceField(queryset=larp_models.Opus.objects.none(), required=False, label="Opus")
+    date_from = forms.DateField(required=False, label="Du", widget=forms.DateInput(attrs={'type': 'date'}))
+    date_to = forms.DateField(required=False, label="Au", widget=forms.DateInput(attrs={'type': 'date'}))
+
+    def __init__(self, *args, larp_ids, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['larp'].queryset = larp_models.Larp.objects.filter(pk__in=larp_ids).order_by('name')
+        self.fields['opus'].queryset = larp_models.Opus.objects.filter(larp_id__in=larp_ids).\
+                                        select_related('larp').order_by('larp__name', 'created_at')
@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from payments.services import process_pending_events
+
+
+class Command(BaseCommand):
+    help = "Traite les événements Stripe mis en file d'attente par le webhook"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=50, help="Nombre d'événements traités par lot")
+        parser.add_argument('--loop', action='store_true', help="Tourne en continu au lieu de vider la file une fois")
+        parser.add_argument('--sleep', type=float, default=5, help="Attente (secondes) quand la file est vide, avec --loop")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        total = 0
+        while True:
+            processed = process_pending_events(batch_size)
+            total += processed
+            if processed < batch_size:
+                if not options['loop']:
+                    break
+                time.sleep(options['sleep'])
+
+        self.stdout.write(f"{total} événement(s) Stripe traité(s)")
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from payments.analytics import rebuild_sales_summary
+
+
+class Command(BaseCommand):
+    help = "Recalcule la synthèse des ventes (tableau de bord orga) à partir des inscriptions et des achats"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--larp', type=int, help="Identifiant du GN à recalculer (par défaut : tous)")
+
+    def handle(self, *args, **options):
+        nb_rows = rebuild_sales_summary(options['larp'])
+        self.stdout.write(f"{nb_rows} ligne(s) de synthèse des ventes recalculée(s)")
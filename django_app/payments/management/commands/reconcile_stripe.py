@@ -0,0 +1,36 @@
+from datetime import datetime, time, timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from payments.reconciliation import RecordedStripeClient, StripeClient, reconcile
+
+
+class Command(BaseCommand):
+    help = "Rapproche les sessions Stripe payées des achats et crée les inscriptions et achats manquants"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=30, help="Sessions des N derniers jours (0 : toutes)")
+        parser.add_argument('--page-size', type=int, default=100, help="Nombre de sessions lues par page")
+        parser.add_argument('--dry-run', action='store_true', help="Liste les sessions sans achat, sans rien créer")
+        parser.add_argument('--recorded', help="Fichier de sessions enregistrées à rejouer au lieu d'appeler Stripe")
+
+    def handle(self, *args, **options):
+        client = RecordedStripeClient.from_file(options['recorded']) if options['recorded'] else StripeClient()
+        created_gte = None
+        if options['days']:
+            start = timezone.localdate() - timedelta(days=options['days'])
+            created_gte = timezone.make_aware(datetime.combine(start, time.min))
+
+        report = reconcile(client, created_gte=created_gte, page_size=options['page_size'], dry_run=options['dry_run'])
+
+        self.stdout.write(f"{report['sessions']} session(s) payée(s), {report['queued']} en file d'attente")
+        if options['dry_run']:
+            self.stdout.write(f"{len(report['missing'])} session(s) sans achat")
+            for session_id in report['missing']:
+                self.stdout.write(f"  {session_id}")
+        else:
+            self.stdout.write(f"{len(report['repaired'])} session(s) réparée(s), "
+                              f"{len(report['linked'])} rattachée(s) à des achats existants")
+        for session_id, error in report['errors'].items():
+            self.stderr.write(f"{session_id} : {error}")
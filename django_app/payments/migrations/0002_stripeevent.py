@@ -0,0 +1,30 @@
+# Generated by Django 5.2.2 on 2026-10-18 07:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StripeEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event_id', models.CharField(max_length=255, unique=True, verbose_name='Identifiant Stripe')),
+                ('event_type', models.CharField(max_length=100, verbose_name='Type')),
+                ('payload', models.JSONField()),
+                ('status', models.CharField(choices=[('PENDING', 'En attente'), ('PROCESSED', 'Traité'), ('FAILED', 'En erreur')], db_index=True, default='PENDING', max_length=10)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('error', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('processed_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'Événement Stripe',
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.2 on 2026-10-18 08:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('larp', '0021_faction_places'),
+        ('payments', '0002_stripeevent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SalesSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('access_type', models.CharField(choices=[('PJ', 'Joueur'), ('PNJV', 'PNJ volant'), ('PNJF', 'PNJ de faction')], max_length=15, verbose_name='Type (PJ, PNJ...)')),
+                ('day', models.DateField(verbose_name='Jour')),
+                ('inscriptions', models.IntegerField(default=0, verbose_name='Inscriptions')),
+                ('purchases', models.IntegerField(default=0, verbose_name='Achats')),
+                ('revenue', models.FloatField(default=0.0, verbose_name="Chiffre d'affaires")),
+                ('faction', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='larp.faction')),
+                ('opus', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='larp.opus', verbose_name='Opus')),
+            ],
+            options={
+                'verbose_name': 'Synthèse des ventes',
+                'verbose_name_plural': 'Synthèses des ventes',
+                'indexes': [models.Index(fields=['opus', 'access_type', 'faction', 'day'], name='sales_summary_key')],
+            },
+        ),
+    ]
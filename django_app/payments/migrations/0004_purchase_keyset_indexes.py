@@ -0,0 +1,23 @@
+# Generated by Django 5.2.2 on 2026-10-18 08:13
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0003_sales_summary'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='purchase',
+            index=models.Index(fields=['user', 'created_at', 'id'], name='purchase_user_created'),
+        ),
+        migrations.AddIndex(
+            model_name='purchase',
+            index=models.Index(fields=['created_at', 'id'], name='purchase_created'),
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 5.2.2 on 2026-10-18 08:16
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('larp', '0021_faction_places'),
+        ('payments', '0004_purchase_keyset_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='purchase',
+            name='access_type',
+            field=models.CharField(blank=True, choices=[('PJ', 'Joueur'), ('PNJV', 'PNJ volant'), ('PNJF', 'PNJ de faction')], default='', max_length=15, verbose_name='Type (PJ, PNJ...)'),
+        ),
+        migrations.AddField(
+            model_name='purchase',
+            name='amount_cents',
+            field=models.PositiveIntegerField(default=0, verbose_name='Montant (centimes)'),
+        ),
+        migrations.AddField(
+            model_name='purchase',
+            name='inscription',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='purchases', to='larp.inscription', verbose_name='Inscription'),
+        ),
+        migrations.AddField(
+            model_name='purchase',
+            name='opus',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='larp.opus', verbose_name='Opus'),
+        ),
+        migrations.AddField(
+            model_name='purchase',
+            name='stripe_payment_intent_id',
+            field=models.CharField(blank=True, default='', max_length=255, verbose_name='Paiement Stripe'),
+        ),
+        migrations.AddField(
+            model_name='purchase',
+            name='stripe_session_id',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=255, verbose_name='Session Stripe'),
+        ),
+        migrations.AddField(
+            model_name='purchase',
+            name='ticket',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='larp.ticket', verbose_name='Billet'),
+        ),
+        migrations.AddIndex(
+            model_name='purchase',
+            index=models.Index(fields=['opus', 'access_type', 'created_at'], name='purchase_opus_type_created'),
+        ),
+    ]
@@ -0,0 +1,63 @@
+import re
+
+from django.db import migrations
+
+
+# Libellé écrit par le webhook Stripe avant l'ajout des champs structurés
+ARTICLE_RE = re.compile(r"^Place (?P<access_type>\w+) pour (?P<opus_name>.+)$")
+BATCH_SIZE = 1000
+
+
+def backfill_purchases(apps, schema_editor):
+    """
+    Renseigne les champs structurés des achats existants à partir de leur
+    libellé (le nom d'un opus est unique). Le billet est celui de l'opus et du
+    type de billet, au même prix s'il y en a plusieurs.
+    """
+    Purchase = apps.get_model('payments', 'Purchase')
+    Opus = apps.get_model('larp', 'Opus')
+    Inscription = apps.get_model('larp', 'Inscription')
+    Ticket = apps.get_model('larp', 'Ticket')
+
+    opus_ids = {name: pk for pk, name in Opus.objects.values_list('pk', 'name')}
+    inscription_ids = {(user_id, opus_id): pk for pk, user_id, opus_id in
+                       Inscription.objects.values_list('pk', 'user_id', 'opus_id')}
+    tickets = {}
+    for ticket in Ticket.objects.all():
+        tickets.setdefault((ticket.opus_id, ticket.access_type), []).append(ticket)
+
+    def find_ticket(opus_id, access_type, price):
+        candidates = tickets.get((opus_id, access_type), [])
+        if len(candidates) > 1:
+            candidates = [t for t in candidates if t.price == price]
+        return candidates[0].pk if len(candidates) == 1 else None
+
+    batch = []
+    fields = ['amount_cents', 'opus', 'access_type', 'inscription', 'ticket']
+    for purchase in Purchase.objects.order_by('pk').iterator(chunk_size=BATCH_SIZE):
+        purchase.amount_cents = round(purchase.price * 100)
+        match = ARTICLE_RE.match(purchase.article)
+        if match is not None:
+            opus_id = opus_ids.get(match['opus_name'])
+            if opus_id is not None:
+                purchase.opus_id = opus_id
+                purchase.access_type = match['access_type']
+                purchase.inscription_id = inscription_ids.get((purchase.user_id, opus_id))
+                purchase.ticket_id = find_ticket(opus_id, match['access_type'], purchase.price)
+        batch.append(purchase)
+        if len(batch) >= BATCH_SIZE:
+            Purchase.objects.bulk_update(batch, fields)
+            batch = []
+    Purchase.objects.bulk_update(batch, fields)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('larp', '0021_faction_places'),
+        ('payments', '0005_purchase_line_items'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_purchases, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.2 on 2026-10-18 08:33
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0006_backfill_purchase_line_items'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stripeevent',
+            name='next_attempt_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddIndex(
+            model_name='stripeevent',
+            index=models.Index(fields=['status', 'next_attempt_at'], name='stripe_event_status_next'),
+        ),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 5.2.2 on 2026-10-18 08:43
+
+from django.db import migrations, models
+
+
+def merge_summary_rows(apps, schema_editor):
+    """
+    Chiffre d'affaires converti en centimes et lignes en double (créées par
+    des mises à jour simultanées) fusionnées, avant l'ajout de la contrainte unique
+    """
+    SalesSummary = apps.get_model('payments', 'SalesSummary')
+    rows = {}
+    duplicates = []
+    for row in SalesSummary.objects.order_by('pk'):
+        row.faction_key = row.faction_id or 0
+        row.revenue_cents = round(row.revenue * 100)
+        key = (row.opus_id, row.access_type, row.faction_key, row.day)
+        kept = rows.setdefault(key, row)
+        if kept is not row:
+            kept.inscriptions += row.inscriptions
+            kept.purchases += row.purchases
+            kept.revenue_cents += row.revenue_cents
+            duplicates.append(row.pk)
+    SalesSummary.objects.filter(pk__in=duplicates).delete()
+    SalesSummary.objects.bulk_update(rows.values(), ['faction_key', 'inscriptions', 'purchases', 'revenue_cents'],
+                                     batch_size=1000)
+
+
+def restore_revenue(apps, schema_editor):
+    SalesSummary = apps.get_model('payments', 'SalesSummary')
+    rows = list(SalesSummary.objects.all())
+    for row in rows:
+        row.revenue = row.revenue_cents / 100
+    SalesSummary.objects.bulk_update(rows, ['revenue'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0007_stripe_event_next_attempt'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='salessummary',
+            name='faction_key',
+            field=models.PositiveIntegerField(default=0, verbose_name='Faction (0 si aucune)'),
+        ),
+        migrations.AddField(
+            model_name='salessummary',
+            name='revenue_cents',
+            field=models.BigIntegerField(default=0, verbose_name="Chiffre d'affaires (centimes)"),
+        ),
+        migrations.RunPython(merge_summary_rows, restore_revenue),
+        migrations.RemoveField(
+            model_name='salessummary',
+            name='revenue',
+        ),
+        migrations.AddConstraint(
+            model_name='salessummary',
+            constraint=models.UniqueConstraint(fields=('opus', 'access_type', 'faction_key', 'day'), name='sales_summary_unique_key'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.2 on 2026-10-18 08:58
+
+from django.db import migrations, models
+
+
+BATCH_SIZE = 1000
+
+
+def backfill_session_ids(apps, schema_editor):
+    """Session Checkout des événements checkout.session.completed déjà reçus"""
+    StripeEvent = apps.get_model('payments', 'StripeEvent')
+    batch = []
+    for event in StripeEvent.objects.filter(event_type='checkout.session.completed').\
+                    order_by('pk').iterator(chunk_size=BATCH_SIZE):
+        event.session_id = event.payload['data']['object']['id']
+        batch.append(event)
+        if len(batch) >= BATCH_SIZE:
+            StripeEvent.objects.bulk_update(batch, ['session_id'])
+            batch = []
+    StripeEvent.objects.bulk_update(batch, ['session_id'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0008_sales_summary_unique_cents'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stripeevent',
+            name='session_id',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=255, verbose_name='Session Stripe'),
+        ),
+        migrations.RunPython(backfill_session_ids, migrations.RunPython.noop),
+    ]
@@ -1,15 +1,105 @@
 from django.db import models
+from django.utils import timezone
 from django.contrib.auth.models import User
+from larp.models import AccessType
 
 # Create your models here.
 class Purchase(models.Model):
     class Meta:
         verbose_name = "Achat"
+        indexes = [
+            # Pagination par curseur (payments.pagination) : historique d'un
+            # utilisateur et registre des achats, du plus récent au plus ancien
+            models.Index(fields=["user", "created_at", "id"], name="purchase_user_created"),
+            models.Index(fields=["created_at", "id"], name="purchase_created"),
+            # Chiffre d'affaires par opus et type de billet (synthèse des ventes, registre)
+            models.Index(fields=["opus", "access_type", "created_at"], name="purchase_opus_type_created"),
+        ]
 
     user = models.ForeignKey(User, on_delete=models.CASCADE, verbose_name="Utilisateur")
     price = models.FloatField(verbose_name="Prix", default=1.0)
     article = models.CharField(verbose_name="Article", max_length=100)
     created_at  = models.DateField(auto_now_add=True)
 
+    # Achat d'une place : billet, opus et inscription créée. Nuls pour les
+    # autres achats et pour les anciens achats que la migration 0006 n'a pas
+    # su rattacher à un opus
+    ticket      = models.ForeignKey("larp.Ticket", on_delete=models.SET_NULL, null=True, blank=True, verbose_name="Billet")
+    opus        = models.ForeignKey("larp.Opus", on_delete=models.SET_NULL, null=True, blank=True, verbose_name="Opus")
+    access_type = models.CharField(verbose_name="Type (PJ, PNJ...)", choices=AccessType, max_length=15, blank=True, default="")
+    inscription = models.ForeignKey("larp.Inscription", on_delete=models.SET_NULL, null=True, blank=True,
+                                    related_name="purchases", verbose_name="Inscription")
+    # Montant payé en centimes, comme Stripe : à utiliser pour les sommes (price est un float)
+    amount_cents = models.PositiveIntegerField(verbose_name="Montant (centimes)", default=0)
+    stripe_session_id = models.CharField(verbose_name="Session Stripe", max_length=255, blank=True, default="", db_index=True)
+    stripe_payment_intent_id = models.CharField(verbose_name="Paiement Stripe", max_length=255, blank=True, default="")
+
+    def __str__(self):
+        return f"{self.article} : {self.price}€"
+
+class StripeEvent(models.Model):
+    """
+    Événement reçu par le webhook Stripe, mis en file d'attente et traité
+    ensuite par la commande process_stripe_events
+    """
+    class Meta:
+        verbose_name = "Événement Stripe"
+        indexes = [
+            models.Index(fields=["status", "next_attempt_at"], name="stripe_event_status_next"),
+        ]
+
+    class Status(models.TextChoices):
+        PENDING     = "PENDING", "En attente"
+        PROCESSED   = "PROCESSED", "Traité"
+        FAILED      = "FAILED", "En erreur"
+
+    event_id    = models.CharField(verbose_name="Identifiant Stripe", max_length=255, unique=True)
+    event_type  = models.CharField(verbose_name="Type", max_length=100)
+    # Session Checkout des événements checkout.session.completed (rapprochement)
+    session_id  = models.CharField(verbose_name="Session Stripe", max_length=255, blank=True, default="", db_index=True)
+    payload     = models.JSONField()
+    status      = models.CharField(choices=Status, default=Status.PENDING, max_length=10, db_index=True)
+    attempts    = models.PositiveSmallIntegerField(default=0)
+    # Un événement n'est pris par un worker qu'à partir de cette date : délai
+    # avant une nouvelle tentative, ou fin de la prise en charge par un worker
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    error       = models.TextField(blank=True, default="")
+    created_at  = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.event_type} ({self.event_id})"
+
+
+class SalesSummary(models.Model):
+    """
+    Ventes agrégées par opus, type de billet, faction et jour : tenue à jour
+    au fil de l'eau (inscriptions et achats, voir payments.analytics) et
+    recalculée par la commande rebuild_sales_summary.
+    Le tableau de bord des ventes ne lit que cette table.
+
+    Une seule ligne par clé : la contrainte unique porte sur faction_key
+    (identifiant de la faction, 0 pour les PNJV) car MySQL ne gère ni les
+    contraintes partielles ni les valeurs nulles dans une contrainte unique.
+    """
+    class Meta:
+        verbose_name = "Synthèse des ventes"
+        verbose_name_plural = "Synthèses des ventes"
+        indexes = [
+            models.Index(fields=["opus", "access_type", "faction", "day"], name="sales_summary_key"),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=["opus", "access_type", "faction_key", "day"], name="sales_summary_unique_key"),
+        ]
+
+    opus        = models.ForeignKey("larp.Opus", on_delete=models.CASCADE, verbose_name="Opus")
+    access_type = models.CharField(verbose_name="Type (PJ, PNJ...)", choices=AccessType, max_length=15)
+    faction     = models.ForeignKey("larp.Faction", on_delete=models.CASCADE, null=True, blank=True)
+    faction_key = models.PositiveIntegerField(verbose_name="Faction (0 si aucune)", default=0)
+    day         = models.DateField(verbose_name="Jour")
+    inscriptions = models.IntegerField(verbose_name="Inscriptions", default=0)
+    purchases   = models.IntegerField(verbose_name="Achats", default=0)
+    revenue_cents = models.BigIntegerField(verbose_name="Chiffre d'affaires (centimes)", default=0)
+
     def __str__(self):
-        return f"{self.article} : {self.price}€"
\ No newline at end of file
+        return f"{self.opus_id} {self.access_type} {self.day}"
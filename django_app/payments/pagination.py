@@ -0,0 +1,48 @@
+from django.core.exceptions import BadRequest, ValidationError
+from django.db.models import Q
+
+
+def encode_cursor(obj, field):
+    return f"{getattr(obj, field).isoformat()}_{obj.pk}"
+
+
+def decode_cursor(queryset, field, cursor):
+    value, _, pk = cursor.rpartition('_')
+    try:
+        return queryset.model._meta.get_field(field).to_python(value), int(pk)
+    except (ValidationError, ValueError):
+        raise BadRequest("Curseur de pagination invalide")
+
+
+def keyset_page(queryset, field='created_at', after=None, before=None, page_size=50):
+    """
+    Pagination par curseur (keyset) du plus récent au plus ancien, sur (field, pk).
+    Chaque page est lue par une requête « WHERE (field, pk) < curseur ... LIMIT »
+    qui suit un index sur (field, pk) : la millième page coûte comme la première,
+    contrairement à un OFFSET.
+
+    after : curseur de la page suivante, before : curseur de la page précédente.
+    Retourne un dictionnaire {'object_list', 'next_cursor', 'previous_cursor'},
+    un curseur valant None quand il n'y a pas de page dans cette direction.
+    """
+    if before:
+        value, pk = decode_cursor(queryset, field, before)
+        rows = list(queryset.filter(Q(**{f"{field}__gt": value}) | Q(**{field: value, 'pk__gt': pk})).
+                    order_by(field, 'pk')[:page_size + 1])
+        has_previous = len(rows) > page_size
+        rows = rows[:page_size][::-1]
+        has_next = True
+    else:
+        if after:
+            value, pk = decode_cursor(queryset, field, after)
+            queryset = queryset.filter(Q(**{f"{field}__lt": value}) | Q(**{field: value, 'pk__lt': pk}))
+        rows = list(queryset.order_by(f"-{field}", '-pk')[:page_size + 1])
+        has_next = len(rows) > page_size
+        rows = rows[:page_size]
+        has_previous = bool(after)
+
+    return {
+        'object_list': rows,
+        'next_cursor': encode_cursor(rows[-1], field) if rows and has_next else None,
+        'previous_cursor': encode_cursor(rows[0], field) if rows and has_previous else None,
+    }
@@ -0,0 +1,164 @@
+"""
+Rapprochement hors ligne des paiements Stripe.
+
+Si le webhook n'a pas été reçu (ou si son événement a épuisé ses tentatives),
+une session Checkout payée peut ne pas avoir d'achat. reconcile() parcourt les
+sessions Stripe page par page, compare chaque page aux achats locaux (une
+requête par page) et crée les inscriptions et achats manquants, comme le
+webhook. Une seule page est en mémoire à la fois.
+
+Le client Stripe est interchangeable : StripeClient interroge l'API,
+RecordedStripeClient rejoue des sessions enregistrées (tests, essais hors ligne).
+"""
+import json
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.utils import timezone
+import stripe
+
+from larp.models import Opus
+from .models import Purchase, StripeEvent
+from .services import MAX_ATTEMPTS, handle_checkout_session_completed, lock_session, stripe_list_line_items
+
+
+class StripeClient:
+    """Sessions Checkout et lignes d'achat lues dans l'API Stripe"""
+    def iter_session_pages(self, created_gte=None, created_lt=None, page_size=100):
+        """Pages de sessions Checkout terminées, des plus récentes aux plus anciennes"""
+        stripe.api_key = settings.STRIPE_SECRET_KEY
+        params = {'limit': page_size, 'status': 'complete'}
+        created = {}
+        if created_gte is not None:
+            created['gte'] = int(created_gte.timestamp())
+        if created_lt is not None:
+            created['lt'] = int(created_lt.timestamp())
+        if created:
+            params['created'] = created
+        while True:
+            page = stripe.checkout.Session.list(**params)
+            if page['data']:
+                yield page['data']
+            if not page['has_more']:
+                return
+            params['starting_after'] = page['data'][-1]['id']
+
+    def list_line_items(self, session_id):
+        return stripe_list_line_items(session_id)
+
+
+class RecordedStripeClient:
+    """
+    Client Stripe hors ligne : rejoue des sessions et leurs lignes d'achat
+    enregistrées (format de l'API). calls compte les appels, comme une API facturée.
+    """
+    def __init__(self, sessions, line_items):
+        self.sessions = sessions
+        self.line_items = line_items
+        self.calls = 0
+
+    @classmethod
+    def from_file(cls, path):
+        """Fichier JSON : {"sessions": [...], "line_items": {"<session id>": [...]}}"""
+        with open(path, encoding='utf-8') as f:
+            recorded = json.load(f)
+        return cls(recorded['sessions'], recorded['line_items'])
+
+    def iter_session_pages(self, created_gte=None, created_lt=None, page_size=100):
+        sessions = [s for s in self.sessions
+                    if (created_gte is None or s['created'] >= created_gte.timestamp())
+                    and (created_lt is None or s['created'] < created_lt.timestamp())]
+        for start in range(0, len(sessions), page_size):
+            self.calls += 1
+            yield sessions[start:start + page_size]
+
+    def list_line_items(self, session_id):
+        self.calls += 1
+        return self.line_items[session_id]
+
+
+def link_legacy_purchases(session, line_items) -> bool:
+    """
+    Achats enregistrés avant le suivi des sessions (stripe_session_id vide) :
+    si chaque ligne de la session a son achat (même acheteur, opus et type de
+    billet), on les rattache à la session au lieu d'en créer de nouveaux
+    """
+    purchases = []
+    for line in line_items:
+        metadata = line['price']['product']['metadata']
+        purchase = Purchase.objects.filter(stripe_session_id="", user_id=int(metadata['user_id']),
+                                           opus_id=int(metadata['opus_id']), access_type=metadata['access_type']).\
+                    exclude(pk__in=[p.pk for p in purchases]).order_by('pk').first()
+        if purchase is None:
+            return False
+        purchases.append(purchase)
+    for purchase in purchases:
+        purchase.stripe_session_id = session['id']
+        purchase.stripe_payment_intent_id = session.get('payment_intent') or ""
+    Purchase.objects.bulk_update(purchases, ['stripe_session_id', 'stripe_payment_intent_id'])
+    return True
+
+
+def reconcile_page(client, sessions, report, dry_run=False):
+    paid = {s['id']: s for s in sessions if s.get('payment_status') == 'paid'}
+    known = set(Purchase.objects.filter(stripe_session_id__in=list(paid)).
+                values_list('stripe_session_id', flat=True).distinct())
+    # Les événements encore en file seront traités par process_stripe_events
+    queued = set(StripeEvent.objects.filter(session_id__in=list(paid),
+                                            status__in=[StripeEvent.Status.PENDING, StripeEvent.Status.FAILED],
+                                            attempts__lt=MAX_ATTEMPTS).
+                 values_list('session_id', flat=True))
+    missing = paid.keys() - known - queued
+
+    report['sessions'] += len(paid)
+    report['queued'] += len(queued - known)
+    if dry_run:
+        report['missing'].extend(sorted(missing))
+        return
+
+    line_items_by_session = {}
+    for session_id in sorted(missing):
+        try:
+            line_items_by_session[session_id] = list(client.list_line_items(session_id))
+        except Exception as e:
+            report['errors'][session_id] = repr(e)
+
+    metadatas = [line['price']['product']['metadata']
+                 for line_items in line_items_by_session.values() for line in line_items]
+    opus_by_id = Opus.objects.in_bulk({int(m['opus_id']) for m in metadatas})
+    user_by_id = User.objects.in_bulk({int(m['user_id']) for m in metadatas})
+
+    for session_id, line_items in line_items_by_session.items():
+        session = paid[session_id]
+        try:
+            with transaction.atomic():
+                # Même verrou que le traitement des événements : la session n'est appliquée qu'une fois
+                if not lock_session(session_id, line_items):
+                    continue
+                if link_legacy_purchases(session, line_items):
+                    report['linked'].append(session_id)
+                else:
+                    handle_checkout_session_completed(line_items, opus_by_id, user_by_id, session=session, locked=True)
+                    report['repaired'].append(session_id)
+                # Événement abandonné après MAX_ATTEMPTS : il est désormais traité
+                StripeEvent.objects.filter(session_id=session_id, status=StripeEvent.Status.FAILED).\
+                    update(status=StripeEvent.Status.PROCESSED, processed_at=timezone.now())
+        except Exception as e:
+            report['errors'][session_id] = repr(e)
+
+
+def reconcile(client, created_gte=None, created_lt=None, page_size=100, dry_run=False):
+    """
+    Rapproche les sessions Checkout payées de Stripe (éventuellement limitées
+    à une période) des achats locaux. Idempotent : une session qui a déjà ses
+    achats n'est jamais retraitée.
+
+    Retourne un rapport : nombre de sessions payées et de sessions encore en
+    file, identifiants des sessions réparées, rattachées à d'anciens achats,
+    manquantes (dry_run, rien n'est créé) et en erreur (avec l'erreur).
+    """
+    report = {'sessions': 0, 'queued': 0, 'missing': [], 'repaired': [], 'linked': [], 'errors': {}}
+    for sessions in client.iter_session_pages(created_gte, created_lt, page_size):
+        reconcile_page(client, sessions, report, dry_run=dry_run)
+    return report
@@ -0,0 +1,220 @@
+from datetime import timedelta
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from larp.models import Inscription, Opus
+from .analytics import add_to_summary, purchase_article
+from .models import Purchase, StripeEvent
+import stripe
+
+
+# Nombre de tentatives avant d'abandonner un événement en erreur, retenté
+# après 1, 2, 4, 8... minutes
+MAX_ATTEMPTS = 5
+RETRY_BASE_DELAY = timedelta(minutes=1)
+# Durée de la prise en charge d'un lot par un worker (voir claim_events)
+CLAIM_TIMEOUT = timedelta(minutes=5)
+
+
+def stripe_list_line_items(session_id):
+    stripe.api_key = settings.STRIPE_SECRET_KEY
+    line_items = stripe.checkout.Session.list_line_items(
+        session_id,
+        expand=['data.price.product']
+        )
+    return line_items['data']
+
+
+def send_confirmation_mail(user, price, opus, access_type):
+    from django.core.mail import EmailMultiAlternatives
+    from django.template.loader import render_to_string
+
+    context = {
+        'user': f"{user.first_name} {user.last_name}",
+        'price': price,
+        'opus': opus,
+        'access_type': access_type
+    }
+    text_content = render_to_string(
+            "payments/emails/buy_confirmation.txt",
+            context=context,
+    )
+
+    # Then, create a multipart email instance.
+    msg = EmailMultiAlternatives(
+        "Les Echos des Limbes : Confirmation de paiement",
+        text_content,
+        settings.DEFAULT_FROM_EMAIL,
+        [user.email],
+    )
+
+    # Lastly, attach the HTML content to the email instance and send.
+    #msg.attach_alternative(html_content, "text/html")
+    msg.send()
+
+
+def event_session_id(event: dict) -> str:
+    """Session Checkout d'un événement checkout.session.completed, vide pour les autres types"""
+    if event['type'] != 'checkout.session.completed':
+        return ""
+    return event['data']['object']['id']
+
+
+def enqueue_event(event: dict) -> bool:
+    """
+    Met en file d'attente un événement Stripe déjà vérifié.
+    Stripe renvoie le même événement tant qu'il n'a pas reçu de réponse :
+    l'identifiant de l'événement garantit qu'il n'est enregistré qu'une fois.
+    """
+    _, created = StripeEvent.objects.get_or_create(
+        event_id=event['id'],
+        defaults={
+            'event_type': event['type'],
+            'session_id': event_session_id(event),
+            'payload': event,
+        })
+    return created
+
+
+def lock_session(session_id, line_items) -> bool:
+    """
+    Verrouille les acheteurs d'une session Checkout jusqu'à la fin de la
+    transaction en cours et indique si la session reste à traiter (aucun achat).
+    L'événement Stripe et le rapprochement (payments.reconciliation) prennent ce
+    même verrou : une session n'est jamais appliquée deux fois.
+    """
+    user_ids = {int(line['price']['product']['metadata']['user_id']) for line in line_items}
+    # Verrous pris dans le même ordre par tous les workers
+    list(User.objects.select_for_update().filter(pk__in=user_ids).order_by('pk').values_list('pk', flat=True))
+    return not Purchase.objects.filter(stripe_session_id=session_id).exists()
+
+
+def handle_checkout_session_completed(line_items, opus_by_id, user_by_id, session=None, locked=False) -> bool:
+    """
+    Crée les inscriptions et achats d'une session Checkout payée, dans une transaction.
+    session : objet Session de l'événement (identifiants de session et de paiement)
+    locked : l'appelant a déjà pris le verrou (lock_session) dans cette transaction
+    Retourne False, sans rien créer, si la session a déjà ses achats
+    (événement renvoyé par Stripe ou session déjà rapprochée).
+    """
+    session = session or {}
+    if session.get('id') and not locked and not lock_session(session['id'], line_items):
+        return False
+    for line in line_items:
+        metadata = line['price']['product']['metadata']
+        user_id = int(metadata['user_id'])
+        amount_cents = line['price']['unit_amount']
+        price = float(amount_cents/100)
+        opus_id = int(metadata['opus_id'])
+        opus = opus_by_id[opus_id]
+        access_type = metadata['access_type']
+
+        infos = {
+            'access_type': access_type,
+        }
+        if access_type != 'PNJV':
+            infos['faction_id'] = int(metadata['faction_id'])
+
+        # On crée une unique inscription pour un même
+        # couple opus/user
+        inscription, _ = Inscription.objects.get_or_create(
+            user_id=user_id,
+            opus_id=opus_id,
+            defaults=infos
+        )
+
+        user = user_by_id[user_id]
+        purchase = Purchase.objects.create(
+            user_id=user_id,
+            price=price,
+            article=purchase_article(access_type, opus.name),
+            amount_cents=amount_cents,
+            opus_id=opus_id,
+            access_type=access_type,
+            # Absent des sessions créées avant l'ajout du billet aux métadonnées
+            ticket_id=int(metadata['ticket_id']) if 'ticket_id' in metadata else None,
+            inscription=inscription,
+            stripe_session_id=session.get('id') or "",
+            stripe_payment_intent_id=session.get('payment_intent') or "",
+        )
+        # L'inscription est comptée par le signal post_save, l'achat ici,
+        # dans la faction de l'inscription (déjà existante ou non)
+        add_to_summary(opus_id, access_type, inscription.faction_id, purchase.created_at,
+                       purchases=1, revenue_cents=amount_cents)
+        # Avec l'outbox (core.mail), le mail est enregistré dans la même transaction
+        # que l'achat : les deux sont validés ou annulés ensemble
+        send_confirmation_mail(user, price, opus, access_type)
+    return True
+
+
+def claim_events(batch_size):
+    """
+    Réserve un lot d'événements à traiter, dans une transaction courte : leur
+    prochaine tentative est repoussée de CLAIM_TIMEOUT, les autres workers les
+    ignorent donc jusque-là. Si ce worker s'arrête en cours de route, les
+    événements sont repris après ce délai.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        events = list(StripeEvent.objects.
+                        select_for_update(skip_locked=True).
+                        filter(Q(status=StripeEvent.Status.PENDING) |
+                               Q(status=StripeEvent.Status.FAILED, attempts__lt=MAX_ATTEMPTS),
+                               next_attempt_at__lte=now).
+                        order_by('next_attempt_at')[:batch_size])
+        for event in events:
+            event.attempts += 1
+            event.next_attempt_at = now + CLAIM_TIMEOUT
+        StripeEvent.objects.bulk_update(events, ['attempts', 'next_attempt_at'])
+    return events
+
+
+def process_pending_events(batch_size=50, list_line_items=stripe_list_line_items) -> int:
+    """
+    Traite un lot d'événements en attente et retourne le nombre d'événements traités.
+    Les lignes d'achat sont demandées à Stripe hors de toute transaction, puis
+    chaque événement est appliqué dans sa propre transaction avec la mise à jour
+    de son statut : il n'est donc appliqué qu'une fois, et une erreur n'annule
+    que l'événement concerné, retenté plus tard (délai doublé à chaque fois).
+    list_line_items permet de remplacer l'appel à l'API Stripe (tests)
+    """
+    events = claim_events(batch_size)
+
+    line_items_by_event = {}
+    for event in events:
+        if event.event_type == 'checkout.session.completed':
+            try:
+                line_items_by_event[event.pk] = list(list_line_items(event.payload['data']['object']['id']))
+            except Exception as e:
+                line_items_by_event[event.pk] = e
+
+    # Chargement groupé des opus et utilisateurs de tout le lot
+    metadatas = [line['price']['product']['metadata']
+                 for line_items in line_items_by_event.values() if not isinstance(line_items, Exception)
+                 for line in line_items]
+    opus_by_id = Opus.objects.in_bulk({int(m['opus_id']) for m in metadatas})
+    user_by_id = User.objects.in_bulk({int(m['user_id']) for m in metadatas})
+
+    for event in events:
+        try:
+            with transaction.atomic():
+                # Les autres types d'événements sont enregistrés sans traitement
+                if event.event_type == 'checkout.session.completed':
+                    line_items = line_items_by_event[event.pk]
+                    if isinstance(line_items, Exception):
+                        raise line_items
+                    handle_checkout_session_completed(line_items, opus_by_id, user_by_id,
+                                                      session=event.payload['data']['object'])
+                event.status = StripeEvent.Status.PROCESSED
+                event.error = ""
+                event.processed_at = timezone.now()
+                event.save(update_fields=['status', 'error', 'processed_at'])
+        except Exception as e:
+            event.status = StripeEvent.Status.FAILED
+            event.error = repr(e)
+            event.next_attempt_at = timezone.now() + RETRY_BASE_DELAY * 2 ** (event.attempts - 1)
+            event.save(update_fields=['status', 'error', 'next_attempt_at'])
+
+    return len(events)
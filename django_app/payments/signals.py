@@ -0,0 +1,33 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from larp.models import Inscription
+from larp.signals import inscription_values, inscriptions_bulk_created
+from .analytics import add_many_to_summary, add_to_summary, inscription_key
+
+
+# Synthèse des ventes : chaque inscription créée, modifiée (admin) ou
+# supprimée est répercutée sur SalesSummary. L'état précédent d'une inscription
+# modifiée est mémorisé par larp.signals (_previous_values), sans requête
+@receiver(post_save, sender=Inscription)
+def count_inscription(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    previous = getattr(instance, '_previous_values', None)
+    previous_key = inscription_key(**previous) if previous and not created else None
+    key = inscription_key(**inscription_values(instance))
+    if created or previous_key != key:
+        if previous_key is not None:
+            add_to_summary(*previous_key, inscriptions=-1)
+        add_to_summary(*key, inscriptions=1)
+
+
+@receiver(post_delete, sender=Inscription)
+def uncount_inscription(sender, instance, **kwargs):
+    add_to_summary(*inscription_key(**inscription_values(instance)), inscriptions=-1)
+
+
+@receiver(inscriptions_bulk_created, sender=Inscription)
+def count_inscriptions(sender, inscriptions, **kwargs):
+    add_many_to_summary((inscription_key(**inscription_values(inscription)), {'inscriptions': 1})
+                        for inscription in inscriptions)
@@ -1,3 +1,527 @@
-from django.test import TestCase
+import hashlib
+import hmac
+import io
+import json
+import tempfile
+import time
+from datetime import date, timedelta
+from importlib import import_module
+from pathlib import Path
+import unittest
+from unittest import mock
 
-# Create your tests here.
+from cms.utils.permissions import set_current_user
+from django.apps import apps as django_apps
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.cache import cache
+from django.core.exceptions import BadRequest
+from django.core.management import call_command
+from django.db import connection, DatabaseError, IntegrityError, transaction
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from core.models import OutgoingEmail
+from larp import models as larp_models
+from larp.tests import QueryBudgetMixin
+from larp.dataset import seed_dataset
+from .analytics import add_to_summary, purchase_article, rebuild_sales_summary
+from .models import Purchase, SalesSummary, StripeEvent
+from .pagination import keyset_page
+from .reconciliation import RecordedStripeClient, reconcile
+from .services import enqueue_event, handle_checkout_session_completed, process_pending_events
+
+
+FIXTURES_DIR = Path(__file__).resolve().parent / 'fixtures' / 'stripe'
+ENDPOINT_SECRET = 'whsec_test'
+
+
+def load_recorded_event(name):
+    with open(FIXTURES_DIR / f"{name}.json", encoding='utf-8') as f:
+        return json.load(f)
+
+
+def sign_payload(payload: bytes, secret=ENDPOINT_SECRET):
+    timestamp = int(time.time())
+    signed_payload = f"{timestamp}.{payload.decode()}".encode()
+    signature = hmac.new(secret.encode(), signed_payload, hashlib.sha256).hexdigest()
+    return f"t={timestamp},v1={signature}"
+
+
+@override_settings(STRIPE_ENDPOINT_SECRET=ENDPOINT_SECRET,
+                   EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend')
+class StripeWebhookTests(TestCase):
+    def setUp(self):
+        set_current_user(None)
+        self.user = User.objects.create_user("player", email="player@example.com")
+        larp = larp_models.Larp.objects.create(name="GN test", factions_name="Faction")
+        self.opus = larp_models.Opus.objects.create(larp=larp, name="Opus 1")
+        self.faction = larp_models.Faction.objects.create(larp=larp, name="Faction 1")
+
+        # On fait correspondre l'enregistrement aux objets créés pour le test
+        self.recorded = load_recorded_event('checkout_session_completed')
+        metadata = self.recorded['line_items'][0]['price']['product']['metadata']
+        metadata.update(user_id=str(self.user.pk), opus_id=str(self.opus.pk), faction_id=str(self.faction.pk))
+
+    def post_event(self, event, signature=None):
+        payload = json.dumps(event).encode()
+        return self.client.post(reverse('payments:webhook'), payload,
+                                content_type='application/json',
+                                headers={'Stripe-Signature': signature or sign_payload(payload)})
+
+    def list_line_items(self, session_id):
+        self.assertEqual(session_id, self.recorded['event']['data']['object']['id'])
+        return self.recorded['line_items']
+
+    def test_webhook_only_enqueues(self):
+        response = self.post_event(self.recorded['event'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(StripeEvent.objects.get().status, StripeEvent.Status.PENDING)
+        self.assertEqual(Purchase.objects.count(), 0)
+
+    def test_webhook_rejects_bad_signature(self):
+        response = self.post_event(self.recorded['event'], signature="t=1,v1=bad")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(StripeEvent.objects.count(), 0)
+
+    def test_retried_event_is_processed_once(self):
+        # Stripe renvoie l'événement après un timeout
+        self.post_event(self.recorded['event'])
+        self.post_event(self.recorded['event'])
+        self.assertEqual(StripeEvent.objects.count(), 1)
+
+        self.assertEqual(process_pending_events(list_line_items=self.list_line_items), 1)
+        self.assertEqual(process_pending_events(list_line_items=self.list_line_items), 0)
+
+        purchase = Purchase.objects.get()
+        self.assertEqual(purchase.user, self.user)
+        self.assertEqual(purchase.price, 45.0)
+        inscription = larp_models.Inscription.objects.get(user=self.user, opus=self.opus)
+        self.assertEqual(inscription.faction, self.faction)
+        self.assertEqual((purchase.opus, purchase.access_type, purchase.inscription, purchase.amount_cents),
+                         (self.opus, 'PJ', inscription, 4500))
+        self.assertEqual((purchase.stripe_session_id, purchase.stripe_payment_intent_id),
+                         ("cs_test_a1checkoutSession0001", "pi_3RpaymentIntent0001"))
+        self.assertEqual(StripeEvent.objects.get().status, StripeEvent.Status.PROCESSED)
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_stripe_is_called_outside_the_claim_transaction(self):
+        self.post_event(self.recorded['event'])
+        # Transactions ouvertes par TestCase lui-même
+        test_atomic_blocks = len(connection.atomic_blocks)
+        calls = []
+
+        def list_line_items(session_id):
+            # Aucune transaction (ni verrou) ouverte pendant l'appel HTTP
+            calls.append((len(connection.atomic_blocks), StripeEvent.objects.get().attempts))
+            return self.list_line_items(session_id)
+
+        process_pending_events(list_line_items=list_line_items)
+        self.assertEqual(calls, [(test_atomic_blocks, 1)])
+        self.assertEqual(StripeEvent.objects.get().status, StripeEvent.Status.PROCESSED)
+
+    def test_other_event_types_are_only_recorded(self):
+        self.post_event(load_recorded_event('payment_intent_succeeded')['event'])
+
+        def list_line_items(session_id):
+            self.fail("Lignes d'achat demandées pour un événement hors Checkout")
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(process_pending_events(list_line_items=list_line_items), 1)
+        self.assertEqual(StripeEvent.objects.get().status, StripeEvent.Status.PROCESSED)
+        self.assertFalse(any("payments_purchase" in query['sql'] for query in queries))
+        self.assertFalse(Purchase.objects.exists())
+
+    @override_settings(EMAIL_BACKEND='core.mail.OutboxEmailBackend')
+    def test_purchase_and_mail_are_committed_together(self):
+        self.post_event(self.recorded['event'])
+
+        with mock.patch.object(OutgoingEmail.objects, 'bulk_create', side_effect=DatabaseError("outbox indisponible")):
+            process_pending_events(list_line_items=self.list_line_items)
+        self.assertEqual(StripeEvent.objects.get().status, StripeEvent.Status.FAILED)
+        self.assertFalse(Purchase.objects.exists())
+        self.assertFalse(larp_models.Inscription.objects.filter(user=self.user).exists())
+
+        StripeEvent.objects.update(next_attempt_at=timezone.now())
+        process_pending_events(list_line_items=self.list_line_items)
+        self.assertEqual(StripeEvent.objects.get().status, StripeEvent.Status.PROCESSED)
+        self.assertEqual(Purchase.objects.count(), 1)
+        self.assertEqual(list(OutgoingEmail.objects.values_list('to', flat=True)), [[self.user.email]])
+
+    def test_failed_event_is_retried(self):
+        self.post_event(self.recorded['event'])
+
+        def failing_list_line_items(session_id):
+            raise ConnectionError("Stripe indisponible")
+
+        process_pending_events(list_line_items=failing_list_line_items)
+        event = StripeEvent.objects.get()
+        self.assertEqual(event.status, StripeEvent.Status.FAILED)
+        self.assertEqual(Purchase.objects.count(), 0)
+        # Pas de nouvel essai avant la fin du délai
+        self.assertGreater(event.next_attempt_at, timezone.now())
+        self.assertEqual(process_pending_events(list_line_items=self.list_line_items), 0)
+
+        StripeEvent.objects.update(next_attempt_at=timezone.now())
+        process_pending_events(list_line_items=self.list_line_items)
+        event.refresh_from_db()
+        self.assertEqual(event.status, StripeEvent.Status.PROCESSED)
+        self.assertEqual(event.attempts, 2)
+        self.assertEqual(Purchase.objects.count(), 1)
+
+
+def summary_snapshot():
+    """Synthèse des ventes par clé, sans les lignes vides"""
+    return {(row['opus_id'], row['access_type'], row['faction_id'], row['day']):
+                (row['inscriptions'], row['purchases'], row['revenue_cents'])
+            for row in SalesSummary.objects.values('opus_id', 'access_type', 'faction_id', 'day',
+                                                   'inscriptions', 'purchases', 'revenue_cents')
+            if (row['inscriptions'], row['purchases'], row['revenue_cents']) != (0, 0, 0)}
+
+
+class SalesSummaryTests(TestCase):
+    def setUp(self):
+        set_current_user(None)
+        cache.clear()
+        self.dataset = seed_dataset(seed=5, nb_larps=1, nb_opus=2, nb_factions=3, nb_players=30)
+        self.larp = self.dataset['larps'][0]
+        self.opus = self.dataset['opus'][-1]
+        self.faction = self.dataset['factions'][0]
+
+    def line_item(self, user, access_type, faction=None, price=4500):
+        metadata = {'user_id': str(user.pk), 'opus_id': str(self.opus.pk), 'access_type': access_type}
+        if faction is not None:
+            metadata['faction_id'] = str(faction.pk)
+        return {'price': {'unit_amount': price, 'product': {'metadata': metadata}}}
+
+    def test_incremental_updates_match_rebuild(self):
+        newcomers = [User.objects.create_user(f"newcomer{i}") for i in range(3)]
+        line_items = [
+            self.line_item(newcomers[0], 'PJ', self.faction),
+            self.line_item(newcomers[1], 'PNJV', price=1000),
+            # Achat d'un joueur déjà inscrit : seul l'achat est compté
+            self.line_item(self.dataset['player'], 'PJ', self.faction),
+        ]
+        handle_checkout_session_completed(line_items, {self.opus.pk: self.opus},
+                                          {u.pk: u for u in newcomers + [self.dataset['player']]})
+
+        # Inscription ajoutée, modifiée puis supprimée depuis l'admin
+        inscription = larp_models.Inscription.objects.create(user=newcomers[2], opus=self.opus,
+                                                             access_type='PNJF', faction=self.faction)
+        inscription.faction = self.dataset['factions'][1]
+        inscription.save()
+        inscription.delete()
+        larp_models.Inscription.objects.create(user=newcomers[2], opus=self.opus, access_type='PJ', faction=self.faction)
+
+        incremental = summary_snapshot()
+        rebuild_sales_summary(self.larp.pk)
+        self.assertEqual(incremental, summary_snapshot())
+
+    def test_seeded_dataset_is_summarized_without_rebuild(self):
+        seeded = summary_snapshot()
+        self.assertTrue(seeded)
+        rebuild_sales_summary(self.larp.pk)
+        self.assertEqual(seeded, summary_snapshot())
+
+    def test_one_row_per_key(self):
+        day = date(2025, 1, 1)
+        for faction_id in (None, self.faction.pk):
+            add_to_summary(self.opus.pk, 'PJ', faction_id, day, inscriptions=1)
+            add_to_summary(self.opus.pk, 'PJ', faction_id, day, purchases=1, revenue_cents=4550)
+        rows = SalesSummary.objects.filter(opus=self.opus, day=day).order_by('faction_key')
+        self.assertEqual([(r.faction_id, r.inscriptions, r.purchases, r.revenue_cents) for r in rows],
+                         [(None, 1, 1, 4550), (self.faction.pk, 1, 1, 4550)])
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            SalesSummary.objects.create(opus=self.opus, access_type='PJ', day=day)
+
+    def test_dashboard(self):
+        self.faction.places = 10
+        self.faction.save()
+        self.client.force_login(self.dataset['orga'])
+        response = self.client.get(reverse('larp:orga_sales', kwargs={'larp_id': self.larp.pk}) + f"?opus={self.opus.pk}")
+        self.assertEqual(response.status_code, 200)
+
+        sales = response.context['sales']
+        inscriptions = larp_models.Inscription.objects.filter(opus=self.opus)
+        self.assertEqual(sales['totals']['inscriptions'], inscriptions.count())
+        self.assertEqual(sales['totals']['purchases'], Purchase.objects.filter(opus=self.opus).count())
+        by_access_type = {row['access_type']: row['inscriptions'] for row in sales['by_access_type']}
+        self.assertEqual(by_access_type['PNJV'], inscriptions.filter(access_type='PNJV').count())
+        faction_row = next(row for row in sales['by_faction'] if row['faction'] == self.faction)
+        nb_pj = inscriptions.filter(access_type='PJ', faction=self.faction).count()
+        self.assertEqual(faction_row['pj'], nb_pj)
+        self.assertEqual(faction_row['fill_rate'], nb_pj / 10)
+        self.assertEqual(sum(row['inscriptions'] for row in sales['by_week']), inscriptions.count())
+
+        self.client.force_login(self.dataset['player'])
+        response = self.client.get(reverse('larp:orga_sales', kwargs={'larp_id': self.larp.pk}))
+        self.assertEqual(response.status_code, 403)
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        set_current_user(None)
+        cache.clear()
+        self.user = User.objects.create_user("player")
+        Purchase.objects.bulk_create([Purchase(user=self.user, price=i, article=f"Achat {i}") for i in range(25)])
+        # Plusieurs achats le même jour : l'identifiant départage
+        for i, purchase in enumerate(Purchase.objects.order_by('pk')):
+            Purchase.objects.filter(pk=purchase.pk).update(created_at=date(2025, 1, 1) + timedelta(days=i // 3))
+        self.expected = list(Purchase.objects.order_by('-created_at', '-pk').values_list('pk', flat=True))
+
+    def test_pages_cover_all_purchases_in_both_directions(self):
+        queryset = Purchase.objects.filter(user=self.user)
+        pages = [keyset_page(queryset, page_size=10)]
+        while pages[-1]['next_cursor']:
+            pages.append(keyset_page(queryset, after=pages[-1]['next_cursor'], page_size=10))
+        self.assertEqual([len(p['object_list']) for p in pages], [10, 10, 5])
+        self.assertEqual([o.pk for p in pages for o in p['object_list']], self.expected)
+        self.assertIsNone(pages[0]['previous_cursor'])
+
+        previous = keyset_page(queryset, before=pages[2]['previous_cursor'], page_size=10)
+        self.assertEqual(previous['object_list'], pages[1]['object_list'])
+        first = keyset_page(queryset, before=previous['previous_cursor'], page_size=10)
+        self.assertEqual(first['object_list'], pages[0]['object_list'])
+        self.assertIsNone(first['previous_cursor'])
+
+        with self.assertRaises(BadRequest):
+            keyset_page(queryset, after="pas-un-curseur")
+
+    def test_deep_pages_follow_the_index(self):
+        if connection.vendor != 'sqlite':
+            raise unittest.SkipTest("Plan d'exécution SQLite")
+        cursor = keyset_page(Purchase.objects.all(), page_size=20)['next_cursor']
+        for queryset in (Purchase.objects.filter(user=self.user), Purchase.objects.all()):
+            with CaptureQueriesContext(connection) as queries:
+                keyset_page(queryset, after=cursor, page_size=10)
+            plan = "\n".join(row[-1] for row in connection.cursor().execute("EXPLAIN QUERY PLAN " + queries[0]['sql']))
+            self.assertNotIn("SCAN payments_purchase\n", plan + "\n")
+            self.assertNotIn("TEMP B-TREE", plan)
+
+    def test_purchase_list_pages(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('payments:purchase-list'))
+        self.assertEqual(len(response.context['object_list']), 25)
+        self.assertIsNone(response.context['page']['next_cursor'])
+        response = self.client.get(reverse('payments:purchase-list') + "?after=nimporte_quoi")
+        self.assertEqual(response.status_code, 400)
+
+
+class PurchaseLedgerTests(TestCase):
+    def setUp(self):
+        set_current_user(None)
+        cache.clear()
+        self.larps = [larp_models.Larp.objects.create(name=f"GN {i}", factions_name="Faction") for i in range(2)]
+        self.opus = [larp_models.Opus.objects.create(larp=larp, name=f"Opus {larp.name}") for larp in self.larps]
+        self.orga = User.objects.create_user("orga")
+        self.orga.groups.add(self.larps[0].orga_group)
+        self.player = User.objects.create_user("player")
+        for opus in self.opus:
+            for access_type in ('PJ', 'PNJV'):
+                Purchase.objects.create(user=self.player, price=10, amount_cents=1000, opus=opus, access_type=access_type,
+                                        article=purchase_article(access_type, opus.name))
+        Purchase.objects.create(user=self.player, price=5, article="Tee-shirt")
+
+    def ledger(self, query=""):
+        return self.client.get(reverse('payments:ledger') + query)
+
+    def test_orga_only_sees_own_larps(self):
+        self.client.force_login(self.orga)
+        response = self.ledger()
+        self.assertEqual({p.article for p in response.context['page']['object_list']},
+                         {purchase_article(t, self.opus[0].name) for t in ('PJ', 'PNJV')})
+
+        # Un GN dont l'utilisateur n'est pas orga ne fait pas partie des choix
+        response = self.ledger(f"?larp={self.larps[1].pk}")
+        self.assertIn('larp', response.context['form'].errors)
+        self.assertEqual(response.context['page']['object_list'], [])
+
+        Purchase.objects.filter(access_type='PJ').update(created_at=date(2025, 1, 1))
+        response = self.ledger(f"?opus={self.opus[0].pk}&date_from=2025-06-01")
+        self.assertEqual([p.article for p in response.context['page']['object_list']],
+                         [purchase_article('PNJV', self.opus[0].name)])
+
+    def test_superuser_sees_everything(self):
+        self.client.force_login(User.objects.create_superuser("admin"))
+        self.assertEqual(len(self.ledger().context['page']['object_list']), 5)
+        self.assertEqual(len(self.ledger(f"?larp={self.larps[1].pk}").context['page']['object_list']), 2)
+
+    def test_requires_orga(self):
+        self.client.force_login(self.player)
+        self.assertEqual(self.ledger().status_code, 403)
+
+
+class PurchaseBackfillTests(TestCase):
+    def setUp(self):
+        set_current_user(None)
+        cache.clear()
+
+    def test_backfill_parses_articles(self):
+        backfill_purchases = import_module('payments.migrations.0006_backfill_purchase_line_items').backfill_purchases
+        opus = larp_models.Opus.objects.create(larp=larp_models.Larp.objects.create(name="GN", factions_name="Faction"),
+                                               name="Opus 1")
+        # Deux billets PJ : le prix départage
+        larp_models.Ticket.objects.create(opus=opus, access_type='PJ', price=30)
+        ticket = larp_models.Ticket.objects.create(opus=opus, access_type='PJ', price=45.5)
+        users = [User.objects.create_user(f"player{i}") for i in range(2)]
+        inscription = larp_models.Inscription.objects.create(user=users[0], opus=opus, access_type='PJ')
+        purchases = [
+            Purchase.objects.create(user=users[0], price=45.5, article="Place PJ pour Opus 1"),
+            # Opus supprimé depuis : l'achat n'est pas rattaché
+            Purchase.objects.create(user=users[1], price=45.5, article="Place PJ pour Opus 0"),
+            Purchase.objects.create(user=users[1], price=12, article="Tee-shirt"),
+        ]
+
+        backfill_purchases(django_apps, None)
+        for purchase in purchases:
+            purchase.refresh_from_db()
+        self.assertEqual((purchases[0].opus, purchases[0].access_type, purchases[0].inscription, purchases[0].ticket),
+                         (opus, 'PJ', inscription, ticket))
+        self.assertEqual([p.amount_cents for p in purchases], [4550, 4550, 1200])
+        self.assertEqual([(p.opus_id, p.access_type) for p in purchases[1:]], [(None, ""), (None, "")])
+
+    def test_backfill_event_session_ids(self):
+        backfill_session_ids = import_module('payments.migrations.0009_stripe_event_session_id').backfill_session_ids
+        checkout = StripeEvent.objects.create(event_id="evt_1", event_type='checkout.session.completed',
+                                              payload={'data': {'object': {'id': "cs_test_1"}}})
+        other = StripeEvent.objects.create(event_id="evt_2", event_type='payment_intent.succeeded',
+                                           payload={'data': {'object': {'id': "pi_test_1"}}})
+
+        backfill_session_ids(django_apps, None)
+        checkout.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual((checkout.session_id, other.session_id), ("cs_test_1", ""))
+
+
+def recorded_session(session_id, created=1750000000, payment_status='paid'):
+    return {'id': session_id, 'object': 'checkout.session', 'created': created, 'mode': 'payment',
+            'payment_intent': session_id.replace("cs_", "pi_"), 'payment_status': payment_status, 'status': 'complete'}
+
+
+@override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend')
+class ReconciliationTests(TestCase):
+    def setUp(self):
+        set_current_user(None)
+        cache.clear()
+        larp = larp_models.Larp.objects.create(name="GN test", factions_name="Faction")
+        self.opus = larp_models.Opus.objects.create(larp=larp, name="Opus 1")
+        self.faction = larp_models.Faction.objects.create(larp=larp, name="Faction 1")
+        self.users = [User.objects.create_user(f"player{i}", email=f"player{i}@example.com") for i in range(5)]
+        self.sessions = [recorded_session(f"cs_test_{i}") for i in range(5)]
+        self.sessions[2]['payment_status'] = 'unpaid'
+        self.client_stub = RecordedStripeClient(self.sessions, {
+            session['id']: [{'price': {'unit_amount': 4500, 'product': {'metadata': {
+                'user_id': str(user.pk), 'opus_id': str(self.opus.pk), 'access_type': 'PJ',
+                'faction_id': str(self.faction.pk)}}}}]
+            for session, user in zip(self.sessions, self.users)})
+
+        # 0 : traitée par le webhook, 3 : encore en file, 4 : achat antérieur au suivi des sessions
+        handle_checkout_session_completed(self.client_stub.line_items["cs_test_0"], {self.opus.pk: self.opus},
+                                          {self.users[0].pk: self.users[0]}, session=self.sessions[0])
+        enqueue_event({'id': "evt_3", 'type': 'checkout.session.completed', 'data': {'object': self.sessions[3]}})
+        Purchase.objects.create(user=self.users[4], price=45, amount_cents=4500, opus=self.opus, access_type='PJ',
+                                article=purchase_article('PJ', self.opus.name))
+        # Mail de la session 0, déjà traitée
+        mail.outbox = []
+
+    def test_repairs_missing_sessions_once(self):
+        report = reconcile(self.client_stub, page_size=2)
+        self.assertEqual((report['sessions'], report['queued']), (4, 1))
+        self.assertEqual((report['repaired'], report['linked'], report['errors']), (["cs_test_1"], ["cs_test_4"], {}))
+
+        purchase = Purchase.objects.get(stripe_session_id="cs_test_1")
+        self.assertEqual((purchase.user, purchase.inscription.faction, purchase.stripe_payment_intent_id),
+                         (self.users[1], self.faction, "pi_test_1"))
+        self.assertEqual(Purchase.objects.get(user=self.users[4]).stripe_session_id, "cs_test_4")
+        self.assertFalse(Purchase.objects.filter(user__in=self.users[2:4]).exists())
+        self.assertEqual(len(mail.outbox), 1)
+
+        report = reconcile(self.client_stub, page_size=2)
+        self.assertEqual((report['repaired'], report['linked']), ([], []))
+        self.assertEqual(Purchase.objects.count(), 3)
+
+    def test_event_redelivered_after_repair_is_not_applied_twice(self):
+        reconcile(self.client_stub)
+        self.assertEqual(len(mail.outbox), 1)
+
+        enqueue_event({'id': "evt_1", 'type': 'checkout.session.completed', 'data': {'object': self.sessions[1]}})
+        event = StripeEvent.objects.get(event_id="evt_1")
+        self.assertEqual(event.session_id, "cs_test_1")
+        process_pending_events(list_line_items=self.client_stub.list_line_items)
+        event.refresh_from_db()
+        self.assertEqual(event.status, StripeEvent.Status.PROCESSED)
+        self.assertEqual(Purchase.objects.filter(stripe_session_id="cs_test_1").count(), 1)
+        # L'événement encore en file (session 3) est traité normalement
+        self.assertEqual(sorted(m.to[0] for m in mail.outbox), ["player1@example.com", "player3@example.com"])
+
+    def test_dry_run_and_command(self):
+        report = reconcile(self.client_stub, dry_run=True)
+        self.assertEqual(report['missing'], ["cs_test_1", "cs_test_4"])
+        self.assertEqual(Purchase.objects.count(), 2)
+
+        path = Path(self.enterContext(tempfile.TemporaryDirectory())) / "sessions.json"
+        path.write_text(json.dumps({'sessions': self.sessions, 'line_items': self.client_stub.line_items}))
+        out = io.StringIO()
+        call_command('reconcile_stripe', recorded=str(path), days=0, stdout=out)
+        self.assertIn("1 session(s) réparée(s), 1 rattachée(s)", out.getvalue())
+        self.assertEqual(Purchase.objects.count(), 3)
+
+    def test_one_query_per_page_for_known_sessions(self):
+        sessions = [recorded_session(f"cs_bulk_{i}") for i in range(250)]
+        Purchase.objects.bulk_create([Purchase(user=self.users[0], price=45, stripe_session_id=s['id'])
+                                      for s in sessions])
+        client = RecordedStripeClient(sessions, {})
+        with CaptureQueriesContext(connection) as queries:
+            report = reconcile(client, page_size=100)
+        self.assertEqual(report['sessions'], 250)
+        # Achats connus et événements en file : deux requêtes par page, aucun appel aux lignes d'achat
+        self.assertEqual((len(queries), client.calls), (6, 3))
+
+
+# Budgets des vues payments : (URL, rôle, code HTTP, kwargs, requêtes max, ms max[, options])
+PAYMENTS_BUDGETS = [
+    ('payments:config', 'anonymous', 200, lambda d: {}, 1, 100),
+    ('payments:config', 'player', 200, lambda d: {}, 3, 100),
+    ('payments:config', 'orga', 200, lambda d: {}, 3, 100),
+    ('payments:create-cs', 'player', 200, lambda d: {'ticket_id': d['ticket'].pk}, 9, 300,
+     {'query': lambda d: f"faction={d['faction'].pk}", 'headers': {'Referer': "https://example.com/billetterie"}}),
+    ('payments:create-cs', 'orga', 200, lambda d: {'ticket_id': d['ticket'].pk}, 9, 300,
+     {'query': lambda d: f"faction={d['faction'].pk}", 'headers': {'Referer': "https://example.com/billetterie"}}),
+    ('payments:create-cs', 'anonymous', 200, lambda d: {'ticket_id': d['ticket'].pk}, 1, 100),
+    ('payments:success', 'player', 200, lambda d: {}, 14, 300),
+    ('payments:success', 'orga', 200, lambda d: {}, 14, 300),
+    ('payments:cancelled', 'player', 200, lambda d: {}, 14, 300),
+    ('payments:cancelled', 'orga', 200, lambda d: {}, 14, 300),
+    ('payments:webhook', 'anonymous', 400, lambda d: {}, 1, 100,
+     {'method': 'post', 'data': b"{}", 'content_type': 'application/json',
+      'headers': {'Stripe-Signature': "t=1,v1=bad"}}),
+    ('payments:purchase-list', 'player', 200, lambda d: {}, 16, 300),
+    ('payments:purchase-list', 'orga', 200, lambda d: {}, 16, 300),
+    ('payments:ledger', 'orga', 200, lambda d: {}, 17, 300),
+    ('payments:ledger', 'player', 403, lambda d: {}, 5, 100),
+]
+
+# Vues budgétées pour un seul rôle, et pourquoi
+PAYMENTS_SINGLE_ROLE_URLS = {
+    'webhook': "appelé par Stripe seul, sans utilisateur",
+}
+
+
+class PaymentsQueryBudgetTests(QueryBudgetMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.seed_budget_dataset()
+
+    def setUp(self):
+        set_current_user(None)
+        cache.clear()
+
+    def test_every_payments_url_has_a_budget(self):
+        from .urls import urlpatterns
+        self.assert_all_urls_budgeted(urlpatterns, 'payments', PAYMENTS_BUDGETS, single_role=PAYMENTS_SINGLE_ROLE_URLS)
+
+    @mock.patch('stripe.checkout.Session.create', return_value={'id': 'cs_test_budget'})
+    def test_payments_views_within_budget(self, create_session):
+        self.assert_budgets(PAYMENTS_BUDGETS)
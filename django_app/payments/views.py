@@ -1,26 +1,84 @@
 
 from django.conf import settings
 from django.http import HttpResponse, HttpRequest
-from django.contrib.auth.models import User
 from django.http.response import JsonResponse
 from django.urls import reverse
 from django.contrib.auth.decorators import login_required
 from django.views.decorators.csrf import csrf_exempt
 from django.views.generic.base import TemplateView
-from larp.models import Inscription, Opus
+from django.core.exceptions import PermissionDenied
+from django.shortcuts import render
+from larp.models import Larp
+from larp.utils import get_orga_larp_ids
+from .forms import LedgerFilterForm
 from .models import Purchase
+from .pagination import keyset_page
+from .services import enqueue_event
 from django.views.generic.list import ListView
+import json
 import stripe
-import pprint
 
 
 class PurchaseListView(ListView):
     model = Purchase
-    paginate_by = 100  # if pagination is desired
+    # Pagination par curseur (?after=... / ?before=...) plutôt que par numéro de page
+    page_size = 100
     
     def get_queryset(self):
         return super().get_queryset().filter(user_id=self.request.user.pk)
 
+    def get_context_data(self, **kwargs):
+        page = keyset_page(self.object_list,
+                           after=self.request.GET.get('after'),
+                           before=self.request.GET.get('before'),
+                           page_size=self.page_size)
+        return super().get_context_data(object_list=page['object_list'], page=page, **kwargs)
+
+
+LEDGER_PAGE_SIZE = 100
+
+
+@login_required
+def purchase_ledger(request: HttpRequest):
+    """Registre des achats des GN dont l'utilisateur est orga, filtrable par GN, opus et dates"""
+    if request.user.is_superuser:
+        larp_ids = set(Larp.objects.values_list('pk', flat=True))
+    else:
+        larp_ids = get_orga_larp_ids(request.user)
+    if not larp_ids:
+        raise PermissionDenied
+
+    form = LedgerFilterForm(request.GET, larp_ids=larp_ids)
+    purchases = Purchase.objects.select_related('user')
+    page = {'object_list': [], 'next_cursor': None, 'previous_cursor': None}
+    if form.is_valid():
+        filters = form.cleaned_data
+        if filters['date_from']:
+            purchases = purchases.filter(created_at__gte=filters['date_from'])
+        if filters['date_to']:
+            purchases = purchases.filter(created_at__lte=filters['date_to'])
+        if filters['opus']:
+            purchases = purchases.filter(opus=filters['opus'])
+        if filters['larp']:
+            purchases = purchases.filter(opus__larp=filters['larp'])
+        elif not request.user.is_superuser:
+            purchases = purchases.filter(opus__larp_id__in=larp_ids)
+        page = keyset_page(purchases,
+                           after=request.GET.get('after'),
+                           before=request.GET.get('before'),
+                           page_size=LEDGER_PAGE_SIZE)
+
+    # Filtres à conserver dans les liens de pagination
+    filters_query = request.GET.copy()
+    filters_query.pop('after', None)
+    filters_query.pop('before', None)
+
+    return render(request, 'payments/purchase_ledger.html', {
+        'form': form,
+        'page': page,
+        'filters_query': filters_query.urlencode(),
+    })
+
 
 # new
 @csrf_exempt
@@ -54,7 +112,8 @@ def create_checkout_session(request : HttpRequest, ticket_id: int):
         metadata = {
             "user_id": request.user.pk,
             "access_type": ticket.access_type,
-            "opus_id": ticket.opus.pk
+            "opus_id": ticket.opus.pk,
+            "ticket_id": ticket.pk,
         }
 
         description = f"Billet {ticket.access_type} pour {ticket.opus}"
@@ -102,43 +161,13 @@ def create_checkout_session(request : HttpRequest, ticket_id: int):
         
 @csrf_exempt
 def stripe_webhook(request):
-    def send_confirmation_mail(user, price, opus, access_type):
-        from django.core.mail import EmailMultiAlternatives
-        from django.template.loader import render_to_string
-
-        context = {
-            'user': f"{user.first_name} {user.last_name}",
-            'price': price,
-            'opus': opus,
-            'access_type': access_type
-        }
-        text_content = render_to_string(
-                "payments/emails/buy_confirmation.txt",
-                context=context,
-        )
-
-        # Then, create a multipart email instance.
-        msg = EmailMultiAlternatives(
-            "Les Echos des Limbes : Confirmation de paiement",
-            text_content,
-            settings.DEFAULT_FROM_EMAIL,
-            [user.email],
-        )
-
-        # Lastly, attach the HTML content to the email instance and send.
-        #msg.attach_alternative(html_content, "text/html")
-        msg.send()
-
-
-    print("!! stripe_webhook !!")
     stripe.api_key = settings.STRIPE_SECRET_KEY
     endpoint_secret = settings.STRIPE_ENDPOINT_SECRET
     payload = request.body
-    sig_header = request.META['HTTP_STRIPE_SIGNATURE']
-    event = None
+    sig_header = request.META.get('HTTP_STRIPE_SIGNATURE', '')
 
     try:
-        event = stripe.Webhook.construct_event(
+        stripe.Webhook.construct_event(
             payload, sig_header, endpoint_secret
         )
     except ValueError as e:
@@ -148,52 +177,8 @@ def stripe_webhook(request):
         # Invalid signature
         return HttpResponse(status=400)
 
+    # L'événement est seulement mis en file d'attente : Stripe reçoit sa réponse
+    # immédiatement, et la commande process_stripe_events crée les inscriptions et achats
+    enqueue_event(json.loads(payload))
 
-    # Handle the checkout.session.completed event
-    if event['type'] == 'checkout.session.completed':
-        pprint.pprint(event)
-        print("Payment was successful.")
-        
-        line_items = stripe.checkout.Session.list_line_items(
-            event['data']['object']['id'],
-            expand=['data.price.product']
-            )
-
-        for line in line_items:
-            print(f"{line.description} (x1): {float(line.price.unit_amount/100)}")
-            user_id = int(line.price.product.metadata['user_id'])
-            price = float(line.price.unit_amount/100)
-            opus_id = int(line.price.product.metadata['opus_id'])
-            opus = Opus.objects.get(pk=opus_id)
-            access_type = line.price.product.metadata['access_type']
-
-            
-            infos = {
-                'user_id': user_id,
-                'access_type': access_type,
-                'opus_id': opus_id
-            }
-            if access_type != 'PNJV':
-                faction_id = int(line.price.product.metadata['faction_id'])
-                infos['faction_id'] = faction_id
-                
-            existing_inscription = Inscription.objects.filter(
-                user_id=user_id,
-                opus_id=opus_id
-            ).count()
-
-            # On crée une unique inscription pour un même
-            # couple opus/user
-            if existing_inscription == 0:
-                Inscription.objects.create(**infos)
-
-            user = User.objects.get(pk=user_id)
-
-            Purchase.objects.create(
-                user_id=user_id,
-                price=price,
-                article=f"Place {access_type} pour {opus.name}"
-            )
-            send_confirmation_mail(user, price, opus, access_type)
-
-    return HttpResponse(status=200)
\ No newline at end of file
+    return HttpResponse(status=200)